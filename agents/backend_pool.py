@@ -0,0 +1,237 @@
+import os
+import random
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+import requests
+
+
+# Several Ollama hosts, e.g. "http://gpu1:11434 weight=2 models=mistral,llama3.2; http://gpu2:11434"
+# (unset: the single host at OLLAMA_BASE_URL)
+OLLAMA_BACKENDS = os.environ.get("OLLAMA_BACKENDS", "")
+# Seconds between health checks (GET /api/tags) of each backend; 0 turns them off
+OLLAMA_HEALTH_INTERVAL = float(os.environ.get("OLLAMA_HEALTH_INTERVAL", "10"))
+# Consecutive failures that take a backend out of rotation, and consecutive
+# passed health checks that bring it back
+OLLAMA_EJECT_AFTER = int(os.environ.get("OLLAMA_EJECT_AFTER", "3"))
+OLLAMA_READMIT_AFTER = int(os.environ.get("OLLAMA_READMIT_AFTER", "2"))
+# Chat sessions whose backend is remembered for affinity
+OLLAMA_AFFINITY_SESSIONS = int(os.environ.get("OLLAMA_AFFINITY_SESSIONS", "10000"))
+
+
+def model_name(model: str) -> str:
+    # Ollama treats "mistral" and "mistral:latest" as the same model
+    return model[:-len(":latest")] if model.endswith(":latest") else model
+
+
+class Backend:
+    """One Ollama host and what the pool knows about it (all access under the pool's lock)"""
+
+    def __init__(self, url: str, models: Optional[Iterable[str]] = None, weight: float = 1.0):
+        self.url = url.rstrip("/")
+        # Configured models; without any, the ones found by the last health check
+        self.models: Set[str] = {model_name(model) for model in models or ()}
+        self.discovered: Set[str] = set()
+        self.weight = weight
+        self.healthy = True
+        self.in_flight = 0
+        self.failures = 0
+        self.passed_checks = 0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+        self.last_error: Optional[str] = None
+
+    def hosts(self, model: str) -> bool:
+        models = self.models or self.discovered
+        return not models or model_name(model) in models
+
+    def load(self) -> float:
+        return self.in_flight / self.weight
+
+    def stats(self) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "weight": self.weight,
+            "models": sorted(self.models or self.discovered),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejections": self.ejections,
+            "last_error": self.last_error,
+        }
+
+
+def parse_backends(spec: str) -> List[Backend]:
+    """Parse "url [weight=N] [models=a,b]; url ..." into backends"""
+    backends = []
+    for entry in spec.split(";"):
+        parts = entry.split()
+        if not parts:
+            continue
+        options = {}
+        for part in parts[1:]:
+            key, sep, value = part.partition("=")
+            if not sep or key not in ("weight", "models"):
+                raise ValueError(f"Invalid Ollama backend option: {part}")
+            options[key] = value
+        weight = float(options.get("weight", "1"))
+        if weight <= 0:
+            raise ValueError(f"Ollama backend weight must be positive: {entry.strip()}")
+        models = [model for model in options.get("models", "").split(",") if model]
+        backends.append(Backend(parts[0], models, weight))
+    return backends
+
+
+class BackendPool:
+    """Routes Ollama requests across one or more backends
+
+    A request goes to the healthy backend hosting its model with the fewest
+    requests in flight for its weight. Requests of a chat session stay on the
+    backend that served it before, as long as that one is healthy and hosts the
+    model, so the model and the conversation stay warm there. A backend is taken
+    out of rotation after eject_after failures in a row and put back after
+    readmit_after passed health checks. If no healthy backend is left, requests
+    go to the ejected ones rather than failing outright.
+    """
+
+    def __init__(self, backends: List[Backend], health_interval: float = OLLAMA_HEALTH_INTERVAL,
+                 eject_after: int = OLLAMA_EJECT_AFTER, readmit_after: int = OLLAMA_READMIT_AFTER,
+                 affinity_sessions: int = OLLAMA_AFFINITY_SESSIONS, check_timeout: float = 5.0):
+        if not backends:
+            raise ValueError("At least one Ollama backend is required")
+        self.backends = backends
+        self.health_interval = health_interval
+        self.eject_after = max(eject_after, 1)
+        self.readmit_after = max(readmit_after, 1)
+        self.affinity_sessions = affinity_sessions
+        self.check_timeout = check_timeout
+        self._lock = threading.Lock()
+        self._affinity: "OrderedDict[str, Backend]" = OrderedDict()
+        self._random = random.Random()
+        self._checker: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self.affinity_hits = 0
+        self.affinity_moves = 0
+
+    def _candidates(self, model: Optional[str], exclude: Iterable[Backend] = ()) -> List[Backend]:
+        """Backends a request may use, best first: healthy ones hosting the model (lock held)"""
+        hosting = [b for b in self.backends if model is None or b.hosts(model)] or self.backends
+        return ([b for b in hosting if b.healthy and b not in exclude]
+                or [b for b in hosting if b not in exclude]
+                or hosting)
+
+    def acquire(self, model: Optional[str] = None, affinity: Optional[str] = None,
+                exclude: Iterable[Backend] = ()) -> Backend:
+        """Choose a backend for a request and count it as busy until release()
+
+        affinity is the chat session the request belongs to; exclude lists
+        backends that already failed this request.
+        """
+        self._start_checks()
+        with self._lock:
+            candidates = self._candidates(model, exclude)
+            backend = None
+            if affinity is not None:
+                pinned = self._affinity.get(affinity)
+                if pinned is not None and pinned in candidates and pinned.healthy:
+                    backend = pinned
+                    self.affinity_hits += 1
+                elif pinned is not None:
+                    self.affinity_moves += 1
+            if backend is None:
+                lowest = min(b.load() for b in candidates)
+                least = [b for b in candidates if b.load() == lowest]
+                # Ties (typically idle backends) are split by weight
+                backend = self._random.choices(least, weights=[b.weight for b in least])[0]
+            backend.in_flight += 1
+            backend.requests += 1
+            if affinity is not None and self.affinity_sessions > 0:
+                self._affinity[affinity] = backend
+                self._affinity.move_to_end(affinity)
+                while len(self._affinity) > self.affinity_sessions:
+                    self._affinity.popitem(last=False)
+            return backend
+
+    def release(self, backend: Backend, error: Optional[BaseException] = None):
+        """Finish a request; error is a failure of the backend itself, e.g. a refused connection"""
+        with self._lock:
+            backend.in_flight -= 1
+            if error is None:
+                backend.failures = 0
+            else:
+                backend.errors += 1
+                self._failed(backend, error)
+
+    def has_untried(self, model: Optional[str], tried: Iterable[Backend]) -> bool:
+        """Whether a healthy backend for model is left that isn't in tried"""
+        tried = list(tried)
+        with self._lock:
+            return any(b.healthy and b not in tried and (model is None or b.hosts(model)) for b in self.backends)
+
+    def routable(self) -> List[Backend]:
+        """Healthy backends, or all of them if none is"""
+        with self._lock:
+            return self._candidates(None)
+
+    def _failed(self, backend: Backend, error: BaseException):
+        backend.failures += 1
+        backend.passed_checks = 0
+        backend.last_error = str(error)
+        if backend.healthy and backend.failures >= self.eject_after:
+            backend.healthy = False
+            backend.ejections += 1
+            print(f"Ollama backend {backend.url} taken out of rotation after {backend.failures} failures: {error}")
+
+    def check(self, backend: Backend) -> bool:
+        """Health-check one backend, learning its models; returns whether it answered"""
+        try:
+            response = requests.get(f"{backend.url}/api/tags", timeout=self.check_timeout)
+            response.raise_for_status()
+            models = {model_name(model["name"]) for model in response.json().get("models", [])}
+        except (requests.RequestException, ValueError, KeyError) as e:
+            with self._lock:
+                self._failed(backend, e)
+            return False
+        with self._lock:
+            backend.discovered = models
+            backend.failures = 0
+            if not backend.healthy:
+                backend.passed_checks += 1
+                if backend.passed_checks >= self.readmit_after:
+                    backend.healthy = True
+                    backend.passed_checks = 0
+                    print(f"Ollama backend {backend.url} is back in rotation")
+        return True
+
+    def check_all(self):
+        for backend in self.backends:
+            self.check(backend)
+
+    def _start_checks(self):
+        # A lone backend gets every request anyway, so it isn't checked
+        if self._checker is not None or len(self.backends) < 2 or self.health_interval <= 0:
+            return
+        with self._lock:
+            if self._checker is None:
+                self._checker = threading.Thread(target=self._run_checks, name="ollama-health", daemon=True)
+                self._checker.start()
+
+    def _run_checks(self):
+        while not self._stopped.is_set():
+            self.check_all()
+            self._stopped.wait(self.health_interval)
+
+    def close(self):
+        self._stopped.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "backends": [backend.stats() for backend in self.backends],
+                "affinity_sessions": len(self._affinity),
+                "affinity_hits": self.affinity_hits,
+                "affinity_moves": self.affinity_moves,
+            }
@@ -1,7 +1,4 @@
-import json
-import requests
 import subprocess
-import socket
 import sys
 import time
 import threading
@@ -18,8 +15,24 @@ except ImportError:
         # Fallback if chat_storage is not available
         chat_storage = None
 
+try:
+    from .ollama_client import ollama_client, OllamaClient
+    from .conversation import ConversationMemory
+    from .context import RequestContext
+except ImportError:
+    from ollama_client import ollama_client, OllamaClient
+    from conversation import ConversationMemory
+    from context import RequestContext
+
+try:
+    from response_cache import cache_key
+except ImportError:
+    cache_key = None
+
+# Earlier turns of each chat session, carried into the next generation
+conversation_memory = ConversationMemory(chat_storage) if chat_storage else None
+
 OLLAMA_MODEL = "mistral"
-OLLAMA_URL = "http://localhost:11434/api/generate"
 
 # Color codes for terminal output
 class Colors:
@@ -67,10 +80,6 @@ class LoadingAnimation:
 
 def ensure_ollama_running():
     """Ensure Ollama server is running"""
-    def is_port_open(host, port):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            return s.connect_ex((host, port)) == 0
-
     def is_ollama_installed():
         try:
             result = subprocess.run(
@@ -88,11 +97,11 @@ def ensure_ollama_running():
         print("Make sure Ollama is added to your system PATH.")
         sys.exit(1)
 
-    if not is_port_open("localhost", 11434):
+    if not ollama_client.is_running():
         print("Starting Ollama server...")
         subprocess.Popen(["ollama", "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         time.sleep(5)
-        if not is_port_open("localhost", 11434):
+        if not ollama_client.is_running():
             print("Failed to start Ollama. Is it installed correctly?")
             sys.exit(1)
 
@@ -100,88 +109,90 @@ def ensure_ollama_running():
 def ensure_model_downloaded(model=OLLAMA_MODEL):
     """Ensure the specified model is downloaded"""
     print(f"Checking if model '{model}' is available...")
-    models = requests.get("http://localhost:11434/api/tags").json()
-    if not any(model in m["name"] for m in models.get("models", [])):
+    models = ollama_client.list_models()
+    if not any(model in name for name in models):
         print(f"Pulling model '{model}'...")
         subprocess.run(["ollama", "pull", model], check=True)
 
 
 class BaseAgent(ABC):
-    """Base class for all agents with streaming support"""
+    """Base class for all agents with streaming support
     
-    def __init__(self, model=OLLAMA_MODEL):
-        self.model = model
-        self._loading_message = 'Thinking...'
-        self._current_session_id = None
+    One instance serves every request for its agent, concurrently in the web
+    server, so agents hold no per-request state: the model, session and loading
+    status of a request come in a RequestContext.
+    """
     
-    def set_loading_message(self, message):
-        """Set custom loading message for background tasks"""
-        self._loading_message = message
+    # Seconds an identical answer may be served from a response cache (0: never cached)
+    response_cache_ttl = 0
+    # Whether prepare_prompt fetches the same data whatever the question, so the semantic
+    # cache may match the bare question before it runs; otherwise the prepared prompt is matched
+    semantic_cache_before_prepare = False
     
-    def set_session_id(self, session_id: str):
-        """Set the current chat session ID"""
-        self._current_session_id = session_id
+    def __init__(self, model=OLLAMA_MODEL, client: Optional[OllamaClient] = None):
+        # Model used by the CLI; web requests choose their own
+        self.model = model
+        self.client = client or ollama_client
     
-    def get_session_id(self) -> Optional[str]:
-        """Get the current chat session ID"""
-        return self._current_session_id
+    def new_context(self, session_id: Optional[str] = None) -> RequestContext:
+        """Context for a CLI request, using this agent's model"""
+        return RequestContext(self.model, session_id)
     
     @abstractmethod
-    def get_system_prompt(self):
+    def get_system_prompt(self, ctx: RequestContext):
         """Return the system prompt for this agent"""
         pass
     
     @abstractmethod
-    def prepare_prompt(self, user_message):
-        """Prepare the prompt for this agent given a user message"""
+    def prepare_prompt(self, user_message, ctx: RequestContext):
+        """Prepare the prompt for this agent given a user message, reporting progress with ctx.status()"""
         pass
     
-    def stream_response(self, user_message):
+    def plan_generation(self, prompt, system_prompt, ctx: RequestContext) -> "Generation":
+        """Work out the model call for a prepared prompt as part of the request's chat session
+
+        The session's earlier turns are carried over (see ConversationMemory);
+        without a session the prompt is sent on its own.
+        """
+        session_id = ctx.session_id
+        model = ctx.model
+        memory = conversation_memory if session_id is not None else None
+        fields = {}
+        if memory is not None:
+            prompt, fields, covered = memory.prepare(session_id, model, prompt)
+
+        def on_done(context):
+            if memory is not None:
+                memory.remember(session_id, model, covered, context)
+
+        return Generation(self, model, prompt, system_prompt, fields, on_done, affinity=session_id,
+                          on_cancel=ctx.on_cancel)
+    
+    def stream_tokens(self, prompt, system_prompt, ctx: RequestContext, cache=None, flights=None):
+        """Stream the model's reply to a prepared prompt (see plan_generation and Generation.stream)"""
+        return self.plan_generation(prompt, system_prompt, ctx).stream(cache, flights)
+    
+    def stream_response(self, user_message, ctx: Optional[RequestContext] = None):
         """Stream the response from Ollama"""
-        # Set default loading message
-        self.set_loading_message("Thinking...")
+        ctx = ctx or self.new_context()
         
-        system_prompt = self.get_system_prompt()
-        prompt = self.prepare_prompt(user_message)
+        system_prompt = self.get_system_prompt(ctx)
+        prompt = self.prepare_prompt(user_message, ctx)
         
         # Set final loading message for AI generation
-        self.set_loading_message("Generating response...")
-        
-        payload = {
-            "model": self.model,
-            "system": system_prompt,
-            "prompt": prompt,
-            "stream": True
-        }
+        ctx.status("Generating response...")
         
         try:
-            response = requests.post(OLLAMA_URL, json=payload, stream=True)
-            first_token = True
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        json_response = json.loads(line.decode('utf-8'))
-                        if 'response' in json_response:
-                            token = json_response['response']
-                            # Strip leading whitespace from the first token only
-                            if first_token:
-                                token = token.lstrip()
-                                first_token = False
-                            yield token
-                        if json_response.get('done', False):
-                            break
-                    except json.JSONDecodeError:
-                        continue
+            yield from self.stream_tokens(prompt, system_prompt, ctx)
         except Exception as e:
             yield f"Error: {str(e)}"
     
-    def stream_response_with_colors(self, user_message):
+    def stream_response_with_colors(self, user_message, ctx: Optional[RequestContext] = None):
         """Stream response with colored output for terminal use"""
-        # Get custom loading message if available
-        loading_message = getattr(self, '_loading_message', 'Thinking...')
+        ctx = ctx or self.new_context()
         
         # Start loading animation
-        loader = LoadingAnimation(loading_message)
+        loader = LoadingAnimation(ctx.loading_message)
         loader.start()
         
         full_response = ""
@@ -189,56 +200,31 @@ class BaseAgent(ABC):
         
         try:
             # Get system prompt first (this shouldn't print anything)
-            system_prompt = self.get_system_prompt()
+            system_prompt = self.get_system_prompt(ctx)
             
             # Stop loading animation before prepare_prompt (which might print things)
             loader.stop()
             
             # Prepare prompt (this might print status messages)
-            prompt = self.prepare_prompt(user_message)
+            prompt = self.prepare_prompt(user_message, ctx)
             
-            # Get updated loading message in case it changed during prepare_prompt
-            loading_message = getattr(self, '_loading_message', 'Thinking...')
-            
-            # Restart loading animation for the actual LLM call
-            loader = LoadingAnimation(loading_message)
+            # Restart loading animation for the actual LLM call, with the latest status
+            loader = LoadingAnimation(ctx.loading_message)
             loader.start()
             
             # Now make the streaming request
-            payload = {
-                "model": self.model,
-                "system": system_prompt,
-                "prompt": prompt,
-                "stream": True
-            }
-            
-            response = requests.post(OLLAMA_URL, json=payload, stream=True)
-            
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        json_response = json.loads(line.decode('utf-8'))
-                        if 'response' in json_response:
-                            token = json_response['response']
-                            
-                            # Stop loading animation when first token arrives
-                            if first_token:
-                                loader.stop()
-                                # Strip leading whitespace from the first token only
-                                token = token.lstrip()
-                                first_token = False
-                            
-                            full_response += token
-                            # Print token with appropriate color for ACTION items
-                            if token.strip().startswith('ACTION:') or 'ACTION:' in full_response.split('\n')[-1]:
-                                print(f"{Colors.RED}{token}{Colors.RESET}", end='', flush=True)
-                            else:
-                                print(f"{Colors.LIGHT_BLUE}{token}{Colors.RESET}", end='', flush=True)
-                        
-                        if json_response.get('done', False):
-                            break
-                    except json.JSONDecodeError:
-                        continue
+            for token in self.stream_tokens(prompt, system_prompt, ctx):
+                # Stop loading animation when first token arrives
+                if first_token:
+                    loader.stop()
+                    first_token = False
+                
+                full_response += token
+                # Print token with appropriate color for ACTION items
+                if token.strip().startswith('ACTION:') or 'ACTION:' in full_response.split('\n')[-1]:
+                    print(f"{Colors.RED}{token}{Colors.RESET}", end='', flush=True)
+                else:
+                    print(f"{Colors.LIGHT_BLUE}{token}{Colors.RESET}", end='', flush=True)
         
         except Exception as e:
             full_response = f"Error: {str(e)}"
@@ -276,12 +262,11 @@ class BaseAgent(ABC):
         session_id = None
         if chat_storage:
             session_id = chat_storage.create_chat_session(self.get_agent_name(), self.model)
-            self.set_session_id(session_id)
             print(f"Chat session created: {session_id}")
         
         print(f"\n{self.get_agent_name()} is ready!")
         if session_id:
-            print(f"Chat history will be saved to: chat_history/{session_id}.json")
+            print(f"Chat history will be saved to: {chat_storage.describe_location(session_id)}")
         print()
         
         while True:
@@ -294,7 +279,7 @@ class BaseAgent(ABC):
                 chat_storage.add_message(session_id, "user", q)
             
             print()  # Add a newline before the response
-            response = self.stream_response_with_colors(q)
+            response = self.stream_response_with_colors(q, self.new_context(session_id))
             
             # Store bot response
             if chat_storage and session_id:
@@ -303,6 +288,88 @@ class BaseAgent(ABC):
             print("\n")  # Add newlines after the response
 
 
+class Generation:
+    """A planned model call: what is sent to the model and what happens with the result"""
+    
+    def __init__(self, agent: BaseAgent, model, prompt, system_prompt, fields, on_done, affinity=None,
+                 on_cancel=None):
+        self.agent = agent
+        self.model = model
+        self.prompt = prompt
+        self.system_prompt = system_prompt
+        self.fields = fields
+        self.on_done = on_done
+        # Chat session, kept on one Ollama backend where there are several
+        self.affinity = affinity
+        # Registers how to cut the stream off when the request is cancelled (RequestContext.on_cancel)
+        self.on_cancel = on_cancel
+        self.key = cache_key(agent.get_agent_name(), model, system_prompt, prompt, fields) if cache_key else None
+    
+    def _cacheable(self, cache) -> bool:
+        return (cache is not None and cache.enabled and self.agent.response_cache_ttl > 0
+                and self.key is not None)
+    
+    def cached(self, cache):
+        """Tokens replaying a cached answer, or None if there is none and it has to be generated"""
+        return cache.replay(self.key, self.on_done) if self._cacheable(cache) else None
+    
+    async def acached(self, cache):
+        """cached() for generations streamed with astream()"""
+        return await cache.areplay(self.key, self.on_done) if self._cacheable(cache) else None
+    
+    def _upstream(self, cache, on_context, on_cancel):
+        def generate(on_final_chunk):
+            return self.agent.client.stream_tokens(self.model, self.prompt, self.system_prompt,
+                                                   on_done=on_final_chunk, affinity=self.affinity,
+                                                   on_cancel=on_cancel, **self.fields)
+        
+        if not self._cacheable(cache):
+            return generate(lambda chunk: on_context(chunk.get("context")))
+        return cache.stream(self.key, self.agent.response_cache_ttl, generate, on_context)
+    
+    def stream(self, cache=None, flights=None):
+        """Stream the reply tokens
+        
+        With a ResponseCache and a non-zero response_cache_ttl, identical requests
+        are answered from it. With a SingleFlight, an identical generation already
+        in progress is shared instead of starting another one.
+        """
+        if flights is None or self.key is None:
+            return self._upstream(cache, self.on_done, self.on_cancel)
+        # A shared generation is only cut off once every request reading it is cancelled
+        return flights.stream(self.key, lambda on_context, on_cancel: self._upstream(cache, on_context, on_cancel),
+                              self.on_done, self.on_cancel)
+    
+    def join(self, flights):
+        """Tokens of an identical generation already in progress, or None if there is none to share"""
+        if flights is None or self.key is None:
+            return None
+        return flights.join(self.key, self.on_done, self.on_cancel)
+    
+    def _aupstream(self, client, cache, on_context):
+        def generate(on_final_chunk):
+            return client.stream_tokens(self.model, self.prompt, self.system_prompt,
+                                        on_done=on_final_chunk, affinity=self.affinity, **self.fields)
+        
+        if not self._cacheable(cache):
+            return generate(lambda chunk: on_context(chunk.get("context")))
+        return cache.astream(self.key, self.agent.response_cache_ttl, generate, on_context)
+    
+    def astream(self, client, cache=None, flights=None):
+        """stream() as an async generator, generating through an AsyncOllamaClient"""
+        if flights is None or self.key is None:
+            return self._aupstream(client, cache, self.on_done)
+        # Cancelled asyncio tasks stop their reads themselves, so on_cancel isn't needed here
+        return flights.astream(self.key, lambda on_context, _: self._aupstream(client, cache, on_context),
+                               self.on_done)
+    
+    def ajoin(self, flights):
+        """join() for generations streamed with astream()"""
+        if flights is None or self.key is None:
+            return None
+        return flights.ajoin(self.key, self.on_done)
+
+
 class SimpleAgent(BaseAgent):
     """Simple agent that takes a system prompt and uses it directly"""
     
@@ -312,10 +379,10 @@ class SimpleAgent(BaseAgent):
         self._agent_name = agent_name
         self._prompt_text = prompt_text
     
-    def get_system_prompt(self):
+    def get_system_prompt(self, ctx):
         return self._system_prompt
     
-    def prepare_prompt(self, user_message):
+    def prepare_prompt(self, user_message, ctx):
         return user_message
     
     def get_agent_name(self):
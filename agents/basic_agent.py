@@ -8,13 +8,13 @@ except ImportError:
 class BasicAgent(BaseAgent):
     """Basic conversational agent with no system prompt for general chat"""
     
-    def get_system_prompt(self):
+    def get_system_prompt(self, ctx):
         """Return an empty system prompt for natural conversation"""
         return ""
     
-    def prepare_prompt(self, user_message):
+    def prepare_prompt(self, user_message, ctx):
         """Set custom loading message for basic conversation"""
-        self.set_loading_message("Thinking...")
+        ctx.status("Thinking...")
         return user_message
     
     def get_agent_name(self):
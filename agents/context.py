@@ -0,0 +1,79 @@
+import threading
+import time
+from typing import Callable, List, Optional
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request has run out of time"""
+    pass
+
+
+class RequestContext:
+    """Everything specific to one request, passed through the agent's hooks
+
+    Agents are shared between requests and keep no per-request state; the
+    model, chat session, loading status and deadline of a request live here.
+    status() records a loading message and hands it to on_status, if given.
+    cancel() is called when the client goes away and runs the callbacks
+    registered with on_cancel(), e.g. to stop reading from Ollama.
+    """
+
+    def __init__(self, model: str, session_id: Optional[str] = None,
+                 on_status: Optional[Callable[[str], None]] = None, timeout: Optional[float] = None,
+                 loading_message: str = "Thinking..."):
+        self.model = model
+        self.session_id = session_id
+        self.on_status = on_status
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.loading_message = loading_message
+        self.cancelled = False
+        self._cancel_lock = threading.Lock()
+        self._cancel_callbacks: List[Callable[[], None]] = []
+
+    def status(self, message: str):
+        """Set the loading message shown while the request is being prepared"""
+        self.loading_message = message
+        if self.on_status is not None:
+            self.on_status(message)
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Call callback when the request is cancelled (right away if it already is)
+
+        Returns a function that unregisters it, for once it no longer applies.
+        """
+        with self._cancel_lock:
+            if not self.cancelled:
+                self._cancel_callbacks.append(callback)
+                return lambda: self._forget(callback)
+        callback()
+        return lambda: None
+
+    def _forget(self, callback: Callable[[], None]):
+        with self._cancel_lock:
+            if callback in self._cancel_callbacks:
+                self._cancel_callbacks.remove(callback)
+
+    def cancel(self):
+        """Mark the request as abandoned by its client and run the on_cancel callbacks"""
+        with self._cancel_lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._cancel_callbacks = self._cancel_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def time_left(self) -> Optional[float]:
+        """Seconds until the deadline, or None without one"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def timeout(self, default: float) -> float:
+        """default, shortened to the time left; raises DeadlineExceeded once it has passed"""
+        left = self.time_left()
+        if left is None:
+            return default
+        if left <= 0:
+            raise DeadlineExceeded("Request deadline exceeded")
+        return min(default, left)
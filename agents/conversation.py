@@ -0,0 +1,81 @@
+import os
+from typing import Dict, Tuple
+
+
+# Reuse the context Ollama returns after each turn, so a follow-up only evaluates its new tokens
+CONTEXT_REUSE = os.environ.get("CHAT_CONTEXT_REUSE", "1").lower() in ("1", "true", "yes")
+# Stored contexts longer than this (in tokens) are dropped in favour of a fresh, bounded replay
+CONTEXT_MAX_TOKENS = int(os.environ.get("CHAT_CONTEXT_MAX_TOKENS", "4096"))
+# Earlier messages replayed into the prompt when there is no usable context
+REPLAY_MESSAGES = int(os.environ.get("CHAT_REPLAY_MESSAGES", "10"))
+REPLAY_CHARS = int(os.environ.get("CHAT_REPLAY_CHARS", "6000"))
+
+SPEAKERS = {"user": "User", "bot": "Assistant"}
+
+
+class ConversationMemory:
+    """Carries the earlier turns of a chat session into the next generation
+
+    After every turn the context (token IDs) returned by Ollama is stored with the
+    session, along with the model and the number of messages it covers. The next
+    turn passes it back so Ollama skips re-evaluating the conversation so far.
+    When the context is missing or doesn't match the transcript (another model,
+    messages added elsewhere, a restored session), the last few messages are
+    replayed in the prompt instead, and the context of that turn is stored.
+    """
+
+    def __init__(self, storage, reuse_context: bool = CONTEXT_REUSE,
+                 max_context_tokens: int = CONTEXT_MAX_TOKENS,
+                 replay_messages: int = REPLAY_MESSAGES, replay_chars: int = REPLAY_CHARS):
+        self.storage = storage
+        self.reuse_context = reuse_context
+        self.max_context_tokens = max_context_tokens
+        self.replay_messages = replay_messages
+        self.replay_chars = replay_chars
+
+    def prepare(self, session_id: str, model: str, prompt: str) -> Tuple[str, Dict, int]:
+        """Prompt and extra request fields for a turn, plus the messages the reply will complete
+
+        Expects the user message of this turn to be stored already.
+        """
+        page = self.storage.get_chat_history_range(session_id, tail=self.replay_messages + 1)
+        count = page["message_count"]
+        # The context will cover everything up to and including this turn's reply
+        covered = count + 1
+
+        if self.reuse_context:
+            state = self.storage.get_session_state(session_id) or {}
+            context = state.get("context")
+            if (context and state.get("model") == model and state.get("message_count") == count - 1
+                    and len(context) <= self.max_context_tokens):
+                return prompt, {"context": context}, covered
+
+        # Everything but the newest message, which is this turn's user message
+        return self._with_replay(page["history"][:-1], prompt), {}, covered
+
+    def _with_replay(self, history, prompt: str) -> str:
+        lines = []
+        budget = self.replay_chars
+        for message in reversed(history):
+            text = message.get("message") or ""
+            if message.get("sender") == "bot" and text.startswith("Error:"):
+                continue
+            line = f"{SPEAKERS.get(message.get('sender'), 'User')}: {text}"
+            if len(line) > budget:
+                break
+            budget -= len(line)
+            lines.append(line)
+        if not lines:
+            return prompt
+        lines.reverse()
+        return "Conversation so far:\n" + "\n".join(lines) + f"\n\n{prompt}"
+
+    def remember(self, session_id: str, model: str, message_count: int, context):
+        """Store the context returned at the end of a turn"""
+        if not self.reuse_context or not context:
+            return
+        self.storage.set_session_state(session_id, {
+            "model": model,
+            "message_count": message_count,
+            "context": context,
+        })
@@ -8,6 +8,9 @@ except ImportError:
 class JokeAgent(SimpleAgent):
     """Professional entertainer and education specialist with humor expertise"""
     
+    # Asking again should get a different joke
+    response_cache_ttl = 0
+    
     def __init__(self):
         super().__init__(
             """
@@ -70,10 +73,10 @@ Always aim to create content that leaves people smiling, learning something new,
             "Ask for a joke, pun, fun fact, or humorous content on any topic"
         )
     
-    def prepare_prompt(self, user_message):
+    def prepare_prompt(self, user_message, ctx):
         # Set custom loading message for joke generation
-        self.set_loading_message("Crafting the perfect joke...")
-        return super().prepare_prompt(user_message)
+        ctx.status("Crafting the perfect joke...")
+        return super().prepare_prompt(user_message, ctx)
 
 
 def main():
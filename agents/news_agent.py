@@ -10,7 +10,9 @@ except ImportError:
 class NewsAgent(BaseAgent):
     """Advanced news analysis agent with comprehensive reporting capabilities"""
     
-    def get_system_prompt(self):
+    response_cache_ttl = 300
+    
+    def get_system_prompt(self, ctx):
         return """
 You are an expert news analyst and journalist with deep knowledge of current events, media literacy, and global affairs. You provide comprehensive news analysis, context, and insights.
 
@@ -59,21 +61,21 @@ GLOBAL PERSPECTIVE:
 Always encourage users to seek multiple sources and think critically about the information they consume.
 """
     
-    def prepare_prompt(self, user_message):
+    def prepare_prompt(self, user_message, ctx):
         # Set custom loading message for news data fetching
-        self.set_loading_message("Fetching latest news...")
+        ctx.status("Fetching latest news...")
         
         # Fetch current headlines
-        headlines = self._fetch_headlines()
+        headlines = self._fetch_headlines(ctx)
         
         # Update loading message for analysis
-        self.set_loading_message("Analyzing news relevance...")
+        ctx.status("Analyzing news relevance...")
         
         # Check if user is asking about a specific topic
         topic_analysis = self._analyze_topic_relevance(user_message, headlines)
         
         # Set final loading message for AI processing
-        self.set_loading_message("Preparing news analysis...")
+        ctx.status("Preparing news analysis...")
         
         context = f"""
 CURRENT TOP HEADLINES:
@@ -93,27 +95,27 @@ User Question: {user_message}
 """
         return context
     
-    def _fetch_headlines(self):
+    def _fetch_headlines(self, ctx):
         """Fetch and format current headlines from multiple sources"""
         try:
             # Try multiple free news sources
-            headlines = self._try_newsapi() or self._try_rss_feeds() or self._fallback_headlines()
+            headlines = self._try_newsapi(ctx) or self._try_rss_feeds(ctx) or self._fallback_headlines()
             return headlines
             
         except Exception as e:
             return f"News data temporarily unavailable. Error: {str(e)}"
     
-    def _try_newsapi(self):
+    def _try_newsapi(self, ctx):
         """Try to fetch from NewsAPI (free tier)"""
         try:
             # Using NewsAPI free tier - replace with your API key if you have one
             # For now, using BBC RSS as an alternative
             url = "http://feeds.bbci.co.uk/news/rss.xml"
-            return self._parse_rss_feed(url, "BBC News")
+            return self._parse_rss_feed(url, "BBC News", ctx)
         except:
             return None
     
-    def _try_rss_feeds(self):
+    def _try_rss_feeds(self, ctx):
         """Fetch headlines from RSS feeds"""
         try:
             import xml.etree.ElementTree as ET
@@ -130,7 +132,7 @@ User Question: {user_message}
             
             for url, source_name in rss_sources:
                 try:
-                    response = requests.get(url, timeout=5)
+                    response = requests.get(url, timeout=ctx.timeout(5))
                     if response.status_code == 200:
                         root = ET.fromstring(response.content)
                         items = root.findall('.//item')[:3]  # Get 3 items per source
@@ -155,12 +157,12 @@ User Question: {user_message}
         except:
             return None
     
-    def _parse_rss_feed(self, url, source_name):
+    def _parse_rss_feed(self, url, source_name, ctx):
         """Parse a single RSS feed"""
         try:
             import xml.etree.ElementTree as ET
             
-            response = requests.get(url, timeout=10)
+            response = requests.get(url, timeout=ctx.timeout(10))
             if response.status_code != 200:
                 return None
                 
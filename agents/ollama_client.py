@@ -0,0 +1,441 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+from typing import List, Dict, Optional, Iterator, AsyncIterator, Callable, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    # Only needed by the asyncio server (asgi_server.py)
+    httpx = None
+
+# Handle both relative and absolute imports
+try:
+    from .backend_pool import Backend, BackendPool, parse_backends, OLLAMA_BACKENDS
+except ImportError:
+    from backend_pool import Backend, BackendPool, parse_backends, OLLAMA_BACKENDS
+
+
+# Connection settings, overridable without code changes
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "3.05"))
+# Longest silence allowed between streamed chunks (model loading can take a while)
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_CONNECT_RETRIES = int(os.environ.get("OLLAMA_CONNECT_RETRIES", "3"))
+OLLAMA_RETRY_BACKOFF = float(os.environ.get("OLLAMA_RETRY_BACKOFF", "0.5"))
+OLLAMA_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", "16"))
+
+
+class OllamaError(Exception):
+    """Raised when Ollama can't be reached or rejects a request"""
+    pass
+
+
+class GenerationCancelled(OllamaError):
+    """Raised when a stream was cut off because its request was cancelled"""
+    pass
+
+
+def _shutdown(response: requests.Response):
+    """Wake a thread blocked reading a streamed response by shutting down its socket
+
+    Closing the response from another thread isn't safe and leaves a blocked read
+    waiting for the next chunk; the reading thread closes it once woken.
+    """
+    try:
+        sock = response.raw._fp.fp.raw._sock
+    except AttributeError:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class OllamaClient:
+    """HTTP client for the Ollama API with a keep-alive connection pool
+
+    One instance is shared by the CLI agents and the web server, so repeated
+    generations reuse pooled connections instead of opening a new one each time.
+    Requests are routed by a BackendPool: the hosts in OLLAMA_BACKENDS, or just
+    base_url. Failures to connect are retried on another backend when there is
+    one, and with exponential backoff once every backend has failed; once a
+    response has started streaming it is never retried.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+                 read_timeout: float = OLLAMA_READ_TIMEOUT, retries: int = OLLAMA_CONNECT_RETRIES,
+                 backoff: float = OLLAMA_RETRY_BACKOFF, pool_size: int = OLLAMA_POOL_SIZE,
+                 pool: Optional[BackendPool] = None):
+        self.base_url = (base_url or OLLAMA_BASE_URL).rstrip("/")
+        if pool is None:
+            backends = None if base_url else parse_backends(OLLAMA_BACKENDS)
+            pool = BackendPool(backends or [Backend(self.base_url)])
+        self.pool = pool
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        # One connection pool per backend
+        adapter = HTTPAdapter(pool_connections=len(pool.backends), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._stats_lock = threading.Lock()
+        self._generations = {"started": 0, "completed": 0, "cancelled": 0, "failed": 0,
+                             "tokens_generated": 0, "cancelled_tokens": 0, "tokens_saved_estimate": 0}
+        # model -> [completed generations, tokens in them], for the average reply length
+        self._model_tokens: Dict[str, List[int]] = {}
+
+    @property
+    def host(self) -> str:
+        return urlparse(self.base_url).hostname or "localhost"
+
+    @property
+    def port(self) -> int:
+        parsed = urlparse(self.base_url)
+        return parsed.port or (443 if parsed.scheme == "https" else 80)
+
+    def is_running(self) -> bool:
+        """Whether something is listening on the Ollama port of any backend"""
+        for backend in self.pool.backends:
+            parsed = urlparse(backend.url)
+            address = (parsed.hostname or "localhost", parsed.port or (443 if parsed.scheme == "https" else 80))
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                s.settimeout(self.connect_timeout)
+                if s.connect_ex(address) == 0:
+                    return True
+        return False
+
+    def _request(self, method: str, path: str, model: Optional[str] = None, affinity: Optional[str] = None,
+                 **kwargs) -> Tuple[Backend, requests.Response]:
+        """Send a request to a backend for model, retrying only when the connection can't be established
+
+        The backend counts as busy until the caller hands it to self.pool.release().
+        """
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+        tried = []
+        for attempt in range(self.retries + 1):
+            backend = self.pool.acquire(model, affinity, exclude=tried)
+            try:
+                response = self.session.request(method, f"{backend.url}{path}", **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                # Covers refused connections, connect timeouts and stale pooled connections
+                self.pool.release(backend, e)
+                if attempt == self.retries:
+                    raise OllamaError(f"Could not connect to Ollama at {backend.url}: {e}") from e
+                tried.append(backend)
+                if not self.pool.has_untried(model, tried):
+                    time.sleep(self.backoff * (2 ** attempt))
+                continue
+            except BaseException:
+                self.pool.release(backend)
+                raise
+            if response.status_code >= 400:
+                self.pool.release(backend)
+                try:
+                    message = response.json().get("error", response.text)
+                except ValueError:
+                    message = response.text
+                response.close()
+                raise OllamaError(f"Ollama returned {response.status_code}: {message}")
+            return backend, response
+
+    def list_models(self) -> List[str]:
+        """Names of the models available on the backends"""
+        names, errors = [], []
+        for backend in self.pool.routable():
+            try:
+                response = self.session.get(f"{backend.url}/api/tags", timeout=(self.connect_timeout, 10))
+                response.raise_for_status()
+                models = response.json().get("models", [])
+            except (requests.RequestException, ValueError) as e:
+                errors.append(f"{backend.url}: {e}")
+                continue
+            names.extend(model["name"] for model in models if model["name"] not in names)
+        if errors and not names:
+            raise OllamaError(f"Could not list Ollama models ({'; '.join(errors)})")
+        return names
+
+    def embed(self, model: str, text: str) -> List[float]:
+        """Embedding vector of a text"""
+        backend, response = self._request("POST", "/api/embed", model=model, json={"model": model, "input": text})
+        try:
+            embeddings = response.json().get("embeddings") or []
+        finally:
+            self.pool.release(backend)
+        if not embeddings:
+            raise OllamaError(f"Ollama returned no embedding for model {model}")
+        return embeddings[0]
+
+    def generate_stream(self, payload: Dict, affinity: Optional[str] = None,
+                        on_cancel: Optional[Callable[[Callable[[], None]], Callable[[], None]]] = None
+                        ) -> Iterator[Dict]:
+        """Stream the NDJSON chunks of /api/generate until the final ("done") chunk
+
+        affinity (a chat session id) keeps a conversation on the backend that served it before.
+        on_cancel (e.g. RequestContext.on_cancel) registers a callback that cuts the
+        stream off from another thread, which raises GenerationCancelled here.
+        """
+        payload = dict(payload, stream=True)
+        backend, response = self._request("POST", "/api/generate", model=payload.get("model"), affinity=affinity,
+                                          json=payload, stream=True)
+        error = None
+        lines = response.iter_lines()
+        # Held while cutting the stream off, so a connection already back in the pool is never touched
+        abort_lock = threading.Lock()
+        state = {"finished": False, "aborted": False}
+
+        def abort():
+            with abort_lock:
+                if not state["finished"]:
+                    state["aborted"] = True
+                    _shutdown(response)
+
+        unregister = on_cancel(abort) if on_cancel is not None else None
+        try:
+            for line in lines:
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line.decode('utf-8'))
+                except json.JSONDecodeError:
+                    continue
+                if "error" in chunk:
+                    raise OllamaError(chunk["error"])
+                yield chunk
+                if chunk.get("done", False):
+                    # Read up to the end of the chunked body so the connection can be reused
+                    for _ in lines:
+                        pass
+                    break
+        except requests.exceptions.RequestException as e:
+            if state["aborted"]:
+                raise GenerationCancelled("Generation cancelled") from e
+            # Read timeout or dropped connection mid-stream: the backend's fault, not the request's
+            error = e
+            raise OllamaError(f"Ollama at {backend.url} stopped responding: {e}") from e
+        finally:
+            if unregister is not None:
+                unregister()
+            with abort_lock:
+                state["finished"] = True
+            # Returns a fully read connection to the pool, or drops it if the stream was abandoned
+            response.close()
+            self.pool.release(backend, error)
+        if state["aborted"]:
+            raise GenerationCancelled("Generation cancelled")
+
+    def stream_tokens(self, model: str, prompt: str, system: Optional[str] = None,
+                      on_done: Optional[Callable[[Dict], None]] = None, affinity: Optional[str] = None,
+                      on_cancel: Optional[Callable[[Callable[[], None]], Callable[[], None]]] = None,
+                      **fields) -> Iterator[str]:
+        """Stream response tokens for a prompt, without leading whitespace on the first token
+
+        on_done is called with the final chunk, which carries the conversation
+        context and timing counters. on_cancel is passed on to generate_stream().
+        """
+        payload = {"model": model, "prompt": prompt, **fields}
+        if system is not None:
+            payload["system"] = system
+        first_token = True
+        count = 0
+        self._count("started")
+        chunks = self.generate_stream(payload, affinity, on_cancel)
+        try:
+            for chunk in chunks:
+                if chunk.get("done", False):
+                    self._record_completed(model, chunk.get("eval_count", count))
+                    if on_done is not None:
+                        on_done(chunk)
+                token = chunk.get("response")
+                if first_token and token:
+                    token = token.lstrip()
+                # The final chunk's response is empty, as is a first token of only whitespace
+                if not token:
+                    continue
+                first_token = False
+                count += 1
+                yield token
+        except (GeneratorExit, GenerationCancelled):
+            # Stopped by the caller before the end: the response (and Ollama's generation) stops here
+            self._record_cancelled(model, count)
+            raise
+        except Exception:
+            self._count("failed")
+            raise
+        finally:
+            chunks.close()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self._generations[name] += amount
+
+    def _record_completed(self, model: str, tokens: int):
+        with self._stats_lock:
+            self._generations["completed"] += 1
+            self._generations["tokens_generated"] += tokens
+            totals = self._model_tokens.setdefault(model, [0, 0])
+            totals[0] += 1
+            totals[1] += tokens
+
+    def _record_cancelled(self, model: str, tokens: int):
+        with self._stats_lock:
+            self._generations["cancelled"] += 1
+            self._generations["tokens_generated"] += tokens
+            self._generations["cancelled_tokens"] += tokens
+            # Assume the reply would have been as long as this model's average one
+            completed, total = self._model_tokens.get(model, (0, 0))
+            if completed:
+                self._generations["tokens_saved_estimate"] += max(round(total / completed) - tokens, 0)
+
+    def stats(self) -> Dict:
+        """Counters of generations streamed through this client"""
+        with self._stats_lock:
+            stats = dict(self._generations)
+            stats["avg_reply_tokens"] = {model: round(total / completed, 1)
+                                         for model, (completed, total) in self._model_tokens.items()}
+        return stats
+
+
+class AsyncOllamaClient:
+    """asyncio counterpart of OllamaClient, built on httpx
+
+    Takes its backends, timeouts and retry settings from an OllamaClient and
+    records generations in that client's counters, so its stats() cover both. The httpx
+    connection pool is created on first use, inside the event loop that uses it.
+    """
+
+    def __init__(self, client: OllamaClient, pool_size: int = OLLAMA_POOL_SIZE):
+        if httpx is None:
+            raise RuntimeError("The async Ollama client needs httpx: pip install httpx")
+        self.client = client
+        self.pool_size = pool_size
+        self._http: Optional["httpx.AsyncClient"] = None
+
+    def _session(self) -> "httpx.AsyncClient":
+        if self._http is None:
+            client = self.client
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(client.read_timeout, connect=client.connect_timeout, pool=None),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+        return self._http
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _send(self, method: str, path: str, model: Optional[str] = None, affinity: Optional[str] = None,
+                    **kwargs) -> Tuple[Backend, "httpx.Response"]:
+        """Send a request and return the unread response, retrying only failed connections
+
+        As with OllamaClient._request(), the backend must be released by the caller.
+        """
+        http = self._session()
+        pool = self.client.pool
+        retries = self.client.retries
+        tried = []
+        for attempt in range(retries + 1):
+            backend = pool.acquire(model, affinity, exclude=tried)
+            try:
+                response = await http.send(http.build_request(method, f"{backend.url}{path}", **kwargs), stream=True)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                pool.release(backend, e)
+                if attempt == retries:
+                    raise OllamaError(f"Could not connect to Ollama at {backend.url}: {e}") from e
+                tried.append(backend)
+                if not pool.has_untried(model, tried):
+                    await asyncio.sleep(self.client.backoff * (2 ** attempt))
+                continue
+            except BaseException:
+                pool.release(backend)
+                raise
+            if response.status_code >= 400:
+                pool.release(backend)
+                body = await response.aread()
+                await response.aclose()
+                try:
+                    message = json.loads(body).get("error", body.decode('utf-8', 'replace'))
+                except ValueError:
+                    message = body.decode('utf-8', 'replace')
+                raise OllamaError(f"Ollama returned {response.status_code}: {message}")
+            return backend, response
+
+    async def generate_stream(self, payload: Dict, affinity: Optional[str] = None) -> AsyncIterator[Dict]:
+        """Stream the NDJSON chunks of /api/generate until the final ("done") chunk"""
+        backend, response = await self._send("POST", "/api/generate", model=payload.get("model"), affinity=affinity,
+                                             json=dict(payload, stream=True))
+        error = None
+        lines = response.aiter_lines()
+        try:
+            async for line in lines:
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "error" in chunk:
+                    raise OllamaError(chunk["error"])
+                yield chunk
+                if chunk.get("done", False):
+                    # Read up to the end of the chunked body so the connection can be reused
+                    async for _ in lines:
+                        pass
+                    break
+        except httpx.TransportError as e:
+            error = e
+            raise OllamaError(f"Ollama at {backend.url} stopped responding: {e}") from e
+        finally:
+            self.client.pool.release(backend, error)
+            await response.aclose()
+
+    async def stream_tokens(self, model: str, prompt: str, system: Optional[str] = None,
+                            on_done: Optional[Callable[[Dict], None]] = None, affinity: Optional[str] = None,
+                            **fields) -> AsyncIterator[str]:
+        """OllamaClient.stream_tokens() as an async generator"""
+        payload = {"model": model, "prompt": prompt, **fields}
+        if system is not None:
+            payload["system"] = system
+        client = self.client
+        first_token = True
+        count = 0
+        client._count("started")
+        chunks = self.generate_stream(payload, affinity)
+        try:
+            async for chunk in chunks:
+                if chunk.get("done", False):
+                    client._record_completed(model, chunk.get("eval_count", count))
+                    if on_done is not None:
+                        on_done(chunk)
+                token = chunk.get("response")
+                if first_token and token:
+                    token = token.lstrip()
+                # The final chunk's response is empty, as is a first token of only whitespace
+                if not token:
+                    continue
+                first_token = False
+                count += 1
+                yield token
+        except (GeneratorExit, asyncio.CancelledError):
+            # Closed or cancelled before the end; closing the response stops Ollama's generation
+            client._record_cancelled(model, count)
+            raise
+        except Exception:
+            client._count("failed")
+            raise
+        finally:
+            await chunks.aclose()
+
+
+# Shared instance used by the agents and the server
+ollama_client = OllamaClient()
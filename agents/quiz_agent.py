@@ -9,7 +9,7 @@ import json
 from urllib.parse import quote
 
 
-def search_web(query, num_results=3):
+def search_web(query, num_results=3, timeout=10):
     """Search the web for information using DuckDuckGo Instant Answer API"""
     try:
         # Use DuckDuckGo Instant Answer API (free, no API key required)
@@ -22,7 +22,7 @@ def search_web(query, num_results=3):
             'skip_disambig': '1'
         }
         
-        response = requests.get(url, params=params, timeout=10)
+        response = requests.get(url, params=params, timeout=timeout)
         data = response.json()
         
         results = []
@@ -145,7 +145,7 @@ WEB INFORMATION INTEGRATION:
 Always make learning engaging, accessible, and pedagogically sound. Encourage curiosity and deeper understanding beyond memorization. When web information is available, use it to create more relevant and current quiz questions.
 """
     
-    def get_system_prompt(self):
+    def get_system_prompt(self, ctx):
         return self._system_prompt
     
     def get_agent_name(self):
@@ -154,7 +154,7 @@ Always make learning engaging, accessible, and pedagogically sound. Encourage cu
     def get_prompt_text(self):
         return "Request a quiz or flashcard on any topic, or ask for learning strategies"
     
-    def prepare_prompt(self, user_message):
+    def prepare_prompt(self, user_message, ctx):
         """Prepare the prompt with web search results if relevant"""
         # Keywords that suggest the user wants current/recent information
         current_keywords = [
@@ -182,7 +182,7 @@ Always make learning engaging, accessible, and pedagogically sound. Encourage cu
         
         if should_search:
             # Set custom loading message for web search
-            self.set_loading_message("Searching for current information...")
+            ctx.status("Searching for current information...")
             
             # Extract the main topic for searching
             search_query = user_message
@@ -204,10 +204,10 @@ Always make learning engaging, accessible, and pedagogically sound. Encourage cu
                         break
             
             print(f"Searching web for current information on: {search_query}")
-            web_results = search_web(search_query)
+            web_results = search_web(search_query, timeout=ctx.timeout(10))
             
             # Update loading message for quiz generation
-            self.set_loading_message("Creating quiz questions...")
+            ctx.status("Creating quiz questions...")
             
             if web_results:
                 # Format web information for the prompt
@@ -222,7 +222,7 @@ Always make learning engaging, accessible, and pedagogically sound. Encourage cu
                 return user_message + web_info
         else:
             # Set loading message for regular quiz generation
-            self.set_loading_message("Creating quiz questions...")
+            ctx.status("Creating quiz questions...")
         
         return user_message
 
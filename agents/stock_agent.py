@@ -13,7 +13,10 @@ from datetime import datetime, timedelta
 class StockAgent(BaseAgent):
     """Financial assistant agent with real-time stock data"""
     
-    def get_system_prompt(self):
+    # Quotes go stale quickly
+    response_cache_ttl = 60
+    
+    def get_system_prompt(self, ctx):
         return """
 You are an expert financial advisor and stock market analyst with access to REAL-TIME market data. You provide comprehensive investment guidance, market analysis, and financial education using current, accurate stock prices and market information.
 
@@ -58,20 +61,20 @@ COMMUNICATION STYLE:
 IMPORTANT: Always include a disclaimer that this is not personalized financial advice and users should consult with qualified financial advisors for their specific situations. All data is sourced from Yahoo Finance and reflects the most recent available market information.
 """
     
-    def prepare_prompt(self, user_message):
+    def prepare_prompt(self, user_message, ctx):
         # Set custom loading message for market data fetching
-        self.set_loading_message("Fetching market data...")
+        ctx.status("Fetching market data...")
         
         # Extract stock symbols from user message if any
         market_data = self._get_market_overview()
         
         # Update loading message for specific stock analysis
-        self.set_loading_message("Analyzing stock information...")
+        ctx.status("Analyzing stock information...")
         
         stock_data = self._extract_and_fetch_stocks(user_message)
         
         # Set final loading message for AI processing
-        self.set_loading_message("Preparing financial analysis...")
+        ctx.status("Preparing financial analysis...")
         
         context = f"""
 CURRENT MARKET OVERVIEW:
@@ -68,10 +68,10 @@ Always encourage good organizational habits and provide context for why certain
             "Enter a todo command (add, remove, list, prioritize, etc.) or ask for productivity advice"
         )
     
-    def prepare_prompt(self, user_message):
+    def prepare_prompt(self, user_message, ctx):
         # Set custom loading message for productivity analysis
-        self.set_loading_message("Organizing your tasks...")
-        return super().prepare_prompt(user_message)
+        ctx.status("Organizing your tasks...")
+        return super().prepare_prompt(user_message, ctx)
 
 
 def main():
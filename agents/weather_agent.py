@@ -1,9 +1,5 @@
 import requests
-import subprocess
 import time
-import socket
-import sys
-import json
 
 # Handle both relative and absolute imports
 try:
@@ -17,56 +13,16 @@ class Colors:
     RED = '\033[91m'
     RESET = '\033[0m'
 
-OLLAMA_MODEL = "mistral"
-
-# Cache for weather data
-_location_cache = None
+# Cache for weather data: (fetched at, location, weather), replaced as a whole
+# so concurrent requests never see a location with another fetch's weather
 _weather_cache = None
-_cache_time = None
-
-
-def ensure_ollama_running():
-    def is_port_open(host, port):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            return s.connect_ex((host, port)) == 0
-
-    def is_ollama_installed():
-        try:
-            result = subprocess.run(
-                ["ollama", "--version"], 
-                capture_output=True, 
-                text=True, 
-                timeout=10
-            )
-            return result.returncode == 0
-        except (subprocess.TimeoutExpired, FileNotFoundError, subprocess.SubprocessError):
-            return False
-
-    if not is_ollama_installed():
-        print("Ollama is not installed or not accessible. Please install it from https://ollama.com")
-        print("Make sure Ollama is added to your system PATH.")
-        sys.exit(1)
-
-    if not is_port_open("localhost", 11434):
-        print("Starting Ollama server...")
-        subprocess.Popen(["ollama", "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        time.sleep(5)
-        if not is_port_open("localhost", 11434):
-            print("Failed to start Ollama. Is it installed correctly?")
-            sys.exit(1)
+# Seconds to wait for the location and forecast services
+FETCH_TIMEOUT = 10
 
 
-def ensure_model_downloaded(model=OLLAMA_MODEL):
-    print(f"Checking if model '{model}' is available...")
-    models = requests.get("http://localhost:11434/api/tags").json()
-    if not any(model in m["name"] for m in models.get("models", [])):
-        print(f"Pulling model '{model}'...")
-        subprocess.run(["ollama", "pull", model], check=True)
-
-
-def get_location():
+def get_location(timeout=FETCH_TIMEOUT):
     try:
-        response = requests.get("http://ip-api.com/json/").json()
+        response = requests.get("http://ip-api.com/json/", timeout=timeout).json()
         return {
             "city": response["city"],
             "region": response["regionName"],
@@ -79,7 +35,7 @@ def get_location():
         return None
 
 
-def get_weather(lat, lon):
+def get_weather(lat, lon, timeout=FETCH_TIMEOUT):
     url = (
         f"https://api.open-meteo.com/v1/forecast?"
         f"latitude={lat}&longitude={lon}"
@@ -89,36 +45,43 @@ def get_weather(lat, lon):
         f"&forecast_days=3&timezone=auto&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch"
     )
     try:
-        return requests.get(url).json()
+        return requests.get(url, timeout=timeout).json()
     except:
         print("Could not get weather data.")
         return None
 
 
-def get_cached_weather_data():
+def get_cached_weather_data(ctx=None):
     """Get cached weather data or fetch new if cache is stale"""
-    global _location_cache, _weather_cache, _cache_time
+    global _weather_cache
     
     current_time = time.time()
+    cached = _weather_cache
     # Cache for 10 minutes
-    if (_cache_time is None or 
-        current_time - _cache_time > 600 or 
-        _location_cache is None or 
-        _weather_cache is None):
-        
-        print("Fetching fresh weather data...")
-        _location_cache = get_location()
-        if _location_cache:
-            _weather_cache = get_weather(_location_cache['lat'], _location_cache['lon'])
-            _cache_time = current_time
+    if cached is not None and current_time - cached[0] <= 600:
+        return cached[1], cached[2]
     
-    return _location_cache, _weather_cache
+    print("Fetching fresh weather data...")
+    # Each fetch gets what is left of the request's time, if it has a deadline
+    timeout = ctx.timeout if ctx else lambda default: default
+    location = get_location(timeout(FETCH_TIMEOUT))
+    if not location:
+        return None, None
+    weather = get_weather(location['lat'], location['lon'], timeout(FETCH_TIMEOUT))
+    if weather:
+        _weather_cache = (current_time, location, weather)
+    return location, weather
 
 
 class WeatherAgent(BaseAgent):
     """Weather agent that provides detailed weather information"""
     
-    def get_system_prompt(self):
+    # Forecasts only change every few minutes
+    response_cache_ttl = 600
+    # The forecast fetched is for the user's location, not for anything in the question
+    semantic_cache_before_prepare = True
+    
+    def get_system_prompt(self, ctx):
         return """
 You are a helpful weather assistant that analyzes comprehensive weather data to answer user questions.
 
@@ -148,16 +111,16 @@ YOUR TASK:
 Be conversational but precise. Always ground your answers in the actual data provided.
 """
     
-    def prepare_prompt(self, user_message):
+    def prepare_prompt(self, user_message, ctx):
         # Set custom loading message for weather data fetching
-        self.set_loading_message("Fetching weather data...")
+        ctx.status("Fetching weather data...")
         
-        location, weather = get_cached_weather_data()
+        location, weather = get_cached_weather_data(ctx)
         if not location or not weather:
             return "I'm sorry, I couldn't fetch weather data at the moment."
         
         # Reset to default message for AI processing
-        self.set_loading_message("Analyzing weather conditions...")
+        ctx.status("Analyzing weather conditions...")
         
         location_str = f"{location['city']}, {location['region']}, {location['country']}"
         
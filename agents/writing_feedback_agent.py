@@ -8,6 +8,11 @@ except ImportError:
 class WritingFeedbackAgent(SimpleAgent):
     """Expert writing coach and editor with comprehensive feedback capabilities"""
     
+    # The same text gets the same feedback
+    response_cache_ttl = 3600
+    # Nothing is fetched; the prompt is the text itself
+    semantic_cache_before_prepare = True
+    
     def __init__(self):
         super().__init__(
             """
@@ -88,10 +93,10 @@ Always provide balanced feedback that celebrates strengths while offering clear,
             "Submit your writing for detailed feedback and improvement suggestions"
         )
     
-    def prepare_prompt(self, user_message):
+    def prepare_prompt(self, user_message, ctx):
         # Set custom loading message for writing analysis
-        self.set_loading_message("Analyzing your writing...")
-        return super().prepare_prompt(user_message)
+        ctx.status("Analyzing your writing...")
+        return super().prepare_prompt(user_message, ctx)
 
 
 def main():
@@ -0,0 +1,237 @@
+import asyncio
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from functools import partial
+from threading import Thread
+
+from a2wsgi import WSGIMiddleware
+from quart import Quart, request, Response, jsonify
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+
+import server
+from server import (agents_registry, stream_stats, stream_stats_lock, start_ollama_server, REQUEST_DEADLINE,
+                    semantic_hit, replay_events)
+from chat_storage import chat_storage
+from response_cache import response_cache
+from semantic_cache import semantic_cache
+from scheduler import scheduler, SchedulerOverloaded
+from single_flight import single_flight
+from sse import StreamOptions, aframe_events, MIMETYPE as SSE_MIMETYPE, HEADERS as SSE_HEADERS
+from agents.ollama_client import ollama_client, AsyncOllamaClient
+from agents.context import RequestContext
+
+
+# Threads for agent work that still blocks: data fetches in prepare_prompt, storage, embeddings
+PREPARE_WORKERS = int(os.environ.get("ASGI_PREPARE_WORKERS", "8"))
+# Threads serving the other routes through the Flask app
+FLASK_WORKERS = int(os.environ.get("ASGI_FLASK_WORKERS", "10"))
+ASGI_BIND = os.environ.get("ASGI_BIND", "127.0.0.1:5000")
+
+app = Quart(__name__)
+# Agent streams last as long as the model keeps generating
+app.config["RESPONSE_TIMEOUT"] = None
+
+prepare_pool = ThreadPoolExecutor(max_workers=PREPARE_WORKERS, thread_name_prefix="prepare")
+async_ollama_client = AsyncOllamaClient(ollama_client)
+# Every other route (history, exports, stats) is served by the Flask app
+flask_app = WSGIMiddleware(server.app, workers=FLASK_WORKERS)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run blocking work on the prepare pool without holding up the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(prepare_pool, partial(func, *args, **kwargs))
+
+
+async def status_events(task: asyncio.Future, statuses: asyncio.Queue, last_message: str):
+    """Loading events for the status messages posted while task runs, ending once it is done"""
+    while not (task.done() and statuses.empty()):
+        if statuses.empty():
+            getter = asyncio.ensure_future(statuses.get())
+            try:
+                await asyncio.wait([task, getter], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                if not getter.done():
+                    getter.cancel()
+            # A getter cancelled above is only done once the loop has run it again
+            if not getter.done() or getter.cancelled():
+                continue
+            message = getter.result()
+        else:
+            message = statuses.get_nowait()
+        if message != last_message:
+            last_message = message
+            yield {'status': 'loading', 'message': message}
+
+
+@app.after_request
+async def allow_cross_origin(response):
+    # Preflight requests go to the Flask app, whose flask_cors allows any origin
+    response.headers.setdefault("Access-Control-Allow-Origin", "*")
+    return response
+
+
+@app.after_serving
+async def shutdown():
+    await async_ollama_client.aclose()
+    prepare_pool.shutdown(wait=False)
+
+
+@app.route("/api/agent", methods=["POST"])
+async def handle_agent():
+    """Handle agent requests with streaming responses (see server.handle_agent)"""
+    data = await request.get_json()
+    agent_name = data.get("agent")
+    message = data.get("message")
+    model = data.get("model", "mistral")
+    session_id = data.get("session_id")
+    try:
+        options = StreamOptions.from_request(data.get("stream_options"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    agent = agents_registry.get(agent_name)
+    if not agent:
+        async def error_generator():
+            yield {'token': 'Unknown agent.', 'done': True}
+        return Response(aframe_events(error_generator(), options), mimetype=SSE_MIMETYPE, headers=SSE_HEADERS)
+
+    try:
+        ticket = scheduler.reserve(model, session_id or request.remote_addr or "")
+    except SchedulerOverloaded as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": "5"}
+
+    if not session_id:
+        session_id = await run_blocking(chat_storage.create_chat_session, agent_name, model)
+    await run_blocking(chat_storage.add_message, session_id, "user", message)
+
+    # Status messages posted from the prepare pool are passed to the event loop as they happen
+    loop = asyncio.get_running_loop()
+    statuses = asyncio.Queue()
+    ctx = RequestContext(model, session_id, on_status=lambda text: loop.call_soon_threadsafe(statuses.put_nowait, text),
+                         timeout=REQUEST_DEADLINE)
+
+    async def agent_stream_with_status():
+        loading_message = ctx.loading_message
+        yield {'status': 'loading', 'message': loading_message}
+
+        system_prompt = await run_blocking(agent.get_system_prompt, ctx)
+
+        # Paraphrases of a recently answered opening question are answered from the
+        # semantic cache, before prompt preparation when the agent allows it
+        opening = False
+        if semantic_cache.enabled and agent.response_cache_ttl > 0:
+            summary = await run_blocking(chat_storage.get_session_summary, session_id)
+            # No summary: a stale or deleted session, so just generate
+            opening = summary is not None and summary["message_count"] == 1
+        looked_up = None
+        cached_text = None
+        if opening and agent.semantic_cache_before_prepare:
+            cached_text = message
+            looked_up = await run_blocking(semantic_cache.lookup, agent_name, model, system_prompt, cached_text)
+            if semantic_hit(looked_up):
+                ticket.release()
+                for event in replay_events(looked_up["response"]):
+                    yield event
+                return
+
+        preparing = asyncio.ensure_future(run_blocking(agent.prepare_prompt, message, ctx))
+        async for event in status_events(preparing, statuses, loading_message):
+            loading_message = event['message']
+            yield event
+        prompt = preparing.result()
+
+        # The fetched data depends on the question: match on the prompt it went into
+        if opening and not agent.semantic_cache_before_prepare:
+            cached_text = prompt
+            looked_up = await run_blocking(semantic_cache.lookup, agent_name, model, system_prompt, cached_text)
+            if semantic_hit(looked_up):
+                ticket.release()
+                for event in replay_events(looked_up["response"]):
+                    yield event
+                return
+
+        generation = await run_blocking(agent.plan_generation, prompt, system_prompt, ctx)
+        reply = await generation.acached(response_cache)
+        if reply is None:
+            reply = generation.ajoin(single_flight)
+        if reply is not None:
+            ticket.release()
+        else:
+            queued = False
+            async with aclosing(ticket.wait_async(timeout=ctx.timeout(scheduler.queue_timeout))) as positions:
+                async for position in positions:
+                    queued = True
+                    yield {'status': 'queued', 'position': position,
+                           'message': f"Waiting for {model} (position {position} in queue)..."}
+            if queued:
+                yield {'status': 'loading', 'message': loading_message}
+
+        tokens = []
+        if reply is None:
+            reply = generation.astream(async_ollama_client, response_cache, single_flight)
+        async with aclosing(reply) as stream:
+            async for token in stream:
+                tokens.append(token)
+                yield {'token': token, 'done': False}
+        if looked_up is not None:
+            await run_blocking(semantic_cache.add, agent_name, model, system_prompt, cached_text, "".join(tokens),
+                               agent.response_cache_ttl, looked_up)
+        yield {'token': '', 'done': True}
+
+    async def generate():
+        full_response = ""
+        stream = agent_stream_with_status()
+        try:
+            async for item in stream:
+                if 'token' in item:
+                    full_response += item['token']
+                    if item.get('done', False):
+                        item['full_response'] = full_response
+                        item['session_id'] = session_id
+                        await run_blocking(chat_storage.add_message, session_id, "bot", full_response)
+                yield item
+        except (GeneratorExit, asyncio.CancelledError):
+            # Closed by the framing on disconnect, or cancelled by Quart mid-await
+            await stream.aclose()
+            with stream_stats_lock:
+                stream_stats["disconnects"] += 1
+                if full_response:
+                    stream_stats["truncated_responses"] += 1
+            if full_response:
+                # Off the event loop like the other storage calls; shielded so a second
+                # cancellation can't abandon the write halfway
+                await asyncio.shield(run_blocking(chat_storage.add_message, session_id, "bot", full_response,
+                                                  truncated=True))
+            raise
+        except Exception as e:
+            yield {'token': f"Error: {str(e)}", 'done': True}
+        finally:
+            ticket.release()
+
+    body = aframe_events(generate(), options)
+    # A body that is never iterated (client gone before the stream started) still frees its slot
+    weakref.finalize(body, ticket.release)
+    return Response(body, mimetype=SSE_MIMETYPE, headers=SSE_HEADERS)
+
+
+async def application(scope, receive, send):
+    """ASGI entry point: agent streams run on asyncio, everything else on the Flask app"""
+    if scope["type"] == "lifespan" or (scope["type"] == "http" and scope["path"] == "/api/agent"
+                                       and scope["method"] == "POST"):
+        await app(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
+
+
+if __name__ == "__main__":
+    print("Multi-Agent Assistant starting (asyncio)...")
+
+    Thread(target=start_ollama_server, daemon=True).start()
+
+    config = Config()
+    config.bind = [ASGI_BIND]
+    print(f"Starting ASGI server on {ASGI_BIND}...")
+    asyncio.run(serve(application, config))
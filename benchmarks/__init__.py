@@ -0,0 +1 @@
+"""Benchmarks and stress tests for chat storage and Ollama routing"""
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Stand-in Ollama servers for trying out routing across several backends
+Usage: python -m benchmarks.fake_ollama [--port N ...] [--models a,b] [--tokens N] [--delay S]
+
+Each port gets a small HTTP server answering /api/tags, /api/generate (streamed)
+and /api/embed the way Ollama does, with made-up text. Point the app at them with
+    OLLAMA_BACKENDS="http://127.0.0.1:11501; http://127.0.0.1:11502" python server.py
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, List
+
+
+class FakeOllama:
+    """One stand-in Ollama server on a port, recording the prompts it was sent"""
+
+    def __init__(self, port: int, models: Iterable[str] = ("mistral",), tokens: int = 20,
+                 delay: float = 0.01, host: str = "127.0.0.1"):
+        self.host = host
+        self.port = port
+        self.models = list(models)
+        self.tokens = tokens
+        self.delay = delay
+        self.prompts: List[str] = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path != "/api/tags":
+                    return self.send_json(404, {"error": "not found"})
+                self.send_json(200, {"models": [{"name": f"{model}:latest"} for model in fake.models]})
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                model = request.get("model", "").split(":")[0]
+                if model not in fake.models:
+                    return self.send_json(404, {"error": f"model '{request.get('model')}' not found"})
+                if self.path == "/api/embed":
+                    digest = hashlib.sha256(request.get("input", "").encode("utf-8")).digest()
+                    return self.send_json(200, {"embeddings": [[byte / 255 for byte in digest[:16]]]})
+                if self.path != "/api/generate":
+                    return self.send_json(404, {"error": "not found"})
+
+                with fake._lock:
+                    fake.prompts.append(request.get("prompt", ""))
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                try:
+                    for i in range(fake.tokens):
+                        time.sleep(fake.delay)
+                        chunk = {"model": request["model"], "response": f" {fake.port}-{i}", "done": False}
+                        self.wfile.write(json.dumps(chunk).encode("utf-8") + b"\n")
+                        self.wfile.flush()
+                    done = {"model": request["model"], "response": "", "done": True,
+                            "context": [fake.port, fake.tokens], "eval_count": fake.tokens}
+                    self.wfile.write(json.dumps(done).encode("utf-8") + b"\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run stand-in Ollama servers")
+    parser.add_argument("--port", type=int, action="append", help="Port to serve on (repeatable; default 11501, 11502)")
+    parser.add_argument("--models", default="mistral", help="Comma-separated models every server hosts")
+    parser.add_argument("--tokens", type=int, default=20, help="Tokens per generated reply")
+    parser.add_argument("--delay", type=float, default=0.02, help="Seconds between tokens")
+    args = parser.parse_args()
+
+    models = [model for model in args.models.split(",") if model]
+    fakes = [FakeOllama(port, models, args.tokens, args.delay).start() for port in args.port or [11501, 11502]]
+    print("Serving " + "; ".join(fake.url for fake in fakes))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for fake in fakes:
+            fake.stop()
+
+
+if __name__ == "__main__":
+    main()
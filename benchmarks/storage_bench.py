@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Storage benchmark for ChatStorage
+Usage: python -m benchmarks.storage_bench [--backend file] [--sessions N] [--messages N] [--output results.json]
+
+Generates a synthetic history and times create_chat_session, add_message,
+list_chat_sessions, search_chats, load_chat_session, tail reads and export
+against each requested backend. Prints one JSON document with p50/p95/p99
+latencies (ms) and throughput (ops/s) per operation.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import List, Dict, Callable
+
+from chat_storage import ChatStorage
+from benchmarks.synthetic import SyntheticHistory
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(durations: List[float]) -> Dict:
+    """Latency percentiles (ms) and throughput for a list of per-call durations (s)"""
+    values = sorted(durations)
+    total = sum(values)
+    return {
+        "count": len(values),
+        "total_s": round(total, 4),
+        "ops_per_s": round(len(values) / total, 1) if total else None,
+        "mean_ms": round(total / len(values) * 1000, 4) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 4),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 4),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 4),
+        "max_ms": round(values[-1] * 1000, 4) if values else 0.0,
+    }
+
+
+def timed(func: Callable, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def run_backend(backend: str, storage_dir: str, history: SyntheticHistory, samples: int, cache: bool) -> Dict:
+    """Run every benchmark phase against one backend"""
+    cache_entries = 256 if cache else 0
+    storage = ChatStorage(storage_dir, backend=backend, cache_entries=cache_entries, write_behind=False)
+    results = {}
+
+    durations = []
+    session_ids = []
+    for agent_name, model in history.session_plan():
+        elapsed, session_id = timed(storage.create_chat_session, agent_name, model)
+        durations.append(elapsed)
+        session_ids.append(session_id)
+    results["create_chat_session"] = summarize(durations)
+
+    durations = []
+    message_bytes = 0
+    for index, session_id in enumerate(session_ids):
+        for sender, text, timestamp in history.message_plan(index):
+            elapsed, _ = timed(storage.add_message, session_id, sender, text, timestamp)
+            durations.append(elapsed)
+            message_bytes += len(text.encode('utf-8'))
+    results["add_message"] = summarize(durations)
+    results["add_message"]["mb_per_s"] = (
+        round(message_bytes / 1024 / 1024 / sum(durations), 2) if durations else None
+    )
+
+    picks = [session_ids[history.random.randrange(len(session_ids))] for _ in range(samples)]
+
+    results["list_chat_sessions"] = summarize(
+        [timed(storage.list_chat_sessions)[0] for _ in range(max(samples // 10, 1))]
+    )
+    results["list_chat_sessions_page"] = summarize(
+        [timed(storage.list_chat_sessions_page, None, 20)[0] for _ in range(samples)]
+    )
+    results["search_chats"] = summarize(
+        [timed(storage.search_chats, query, None, 20)[0] for query in history.queries(samples)]
+    )
+    results["load_chat_session"] = summarize([timed(storage.load_chat_session, sid)[0] for sid in picks])
+    results["get_chat_history_tail"] = summarize(
+        [timed(storage.get_chat_history, sid, tail=10)[0] for sid in picks]
+    )
+    results["export_chat_session"] = summarize(
+        [timed(storage.export_chat_session, sid, "json")[0] for sid in picks]
+    )
+
+    archive_samples = max(samples // 50, 1)
+    durations = []
+    archive_bytes = 0
+    for _ in range(archive_samples):
+        elapsed, written = timed(lambda: sum(len(chunk) for chunk in storage.iter_export_archive("jsonl")))
+        durations.append(elapsed)
+        archive_bytes += written
+    results["export_archive"] = summarize(durations)
+    results["export_archive"]["mb_per_s"] = round(archive_bytes / 1024 / 1024 / sum(durations), 2)
+
+    if storage.cache.enabled:
+        results["cache"] = storage.cache_stats()
+    storage.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ChatStorage operations on a synthetic history")
+    parser.add_argument("--backend", action="append", help="Backend to test (repeatable, default: file)")
+    parser.add_argument("--sessions", type=int, default=200, help="Sessions to generate")
+    parser.add_argument("--messages", type=int, default=50, help="Messages per session")
+    parser.add_argument("--message-size", type=int, default=200, help="Characters per message")
+    parser.add_argument("--agents", type=int, default=4, help="Distinct agent names")
+    parser.add_argument("--samples", type=int, default=200, help="Calls timed per read operation")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated history")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the loaded-session cache")
+    parser.add_argument("--dir", help="Keep generated data under this directory instead of a temporary one")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {
+        "config": {
+            "sessions": args.sessions,
+            "messages": args.messages,
+            "message_size": args.message_size,
+            "agents": args.agents,
+            "samples": args.samples,
+            "seed": args.seed,
+            "cache": not args.no_cache,
+        },
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "backends": {},
+    }
+
+    for backend in args.backend or ["file"]:
+        storage_dir = os.path.join(args.dir, backend) if args.dir else tempfile.mkdtemp(prefix=f"chat_bench_{backend}_")
+        history = SyntheticHistory(args.sessions, args.messages, args.message_size, args.agents, args.seed)
+        print(f"Benchmarking {backend} backend in {storage_dir}...", file=sys.stderr)
+        try:
+            report["backends"][backend] = run_backend(backend, storage_dir, history, args.samples, not args.no_cache)
+        finally:
+            if not args.dir:
+                shutil.rmtree(storage_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Stress test for routing generations across several Ollama backends
+Usage: python -m benchmarks.stress_backends [--backends N] [--sessions N] [--turns N] [--port N]
+
+Starts stand-in Ollama servers (see fake_ollama) on consecutive ports and runs
+chat sessions against them concurrently through one OllamaClient. Checks that
+every session stays on one backend, that a model only one backend hosts is
+only sent there, that a stopped backend is taken out of rotation without
+failing requests, and that it is put back once it answers again.
+Exits with status 1 if any check fails.
+"""
+
+import argparse
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from agents.backend_pool import Backend, BackendPool
+from agents.ollama_client import OllamaClient
+from benchmarks.fake_ollama import FakeOllama
+
+
+def generate(client: OllamaClient, model: str, session: str, turn: int) -> int:
+    """Run one turn of a session and return the port of the backend that answered"""
+    reply = "".join(client.stream_tokens(model, f"{session} turn {turn}", affinity=session))
+    return int(reply.split("-", 1)[0])
+
+
+def run_sessions(client: OllamaClient, sessions, turns: int, first_turn: int = 0):
+    """Run turns of every session concurrently; returns (session -> ports that answered it, errors)"""
+    served = {session: [] for session in sessions}
+    errors = []
+
+    def run(session):
+        for turn in range(first_turn, first_turn + turns):
+            try:
+                served[session].append(generate(client, "mistral", session, turn))
+            except Exception as e:
+                errors.append(f"{session} turn {turn}: {e}")
+
+    with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+        list(pool.map(run, sessions))
+    return served, errors
+
+
+def wait_for(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Route chat sessions across stand-in Ollama backends")
+    parser.add_argument("--backends", type=int, default=3, help="Stand-in servers (at least 2)")
+    parser.add_argument("--sessions", type=int, default=24, help="Concurrent chat sessions")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per session in each phase")
+    parser.add_argument("--tokens", type=int, default=10, help="Tokens per reply")
+    parser.add_argument("--port", type=int, default=11501, help="Port of the first server")
+    args = parser.parse_args()
+    if args.backends < 2:
+        parser.error("--backends must be at least 2")
+
+    # The first backend is twice as big and the only one with llama3.2
+    fakes = [FakeOllama(args.port + i, ["mistral", "llama3.2"] if i == 0 else ["mistral"], args.tokens, 0.005).start()
+             for i in range(args.backends)]
+    backends = [Backend(fake.url, weight=2 if i == 0 else 1) for i, fake in enumerate(fakes)]
+    pool = BackendPool(backends, health_interval=0.2, eject_after=2, readmit_after=2, check_timeout=1)
+    client = OllamaClient(pool=pool, backoff=0.05)
+    problems = []
+    sessions = [f"session-{i}" for i in range(args.sessions)]
+
+    # The models each backend hosts are learned from the first health check
+    pool.check_all()
+    started = time.perf_counter()
+    served, errors = run_sessions(client, sessions, args.turns)
+    problems += errors
+    pinned = {session: ports[0] for session, ports in served.items() if ports}
+    for session, ports in served.items():
+        if len(set(ports)) > 1:
+            problems.append(f"{session} moved between backends: {ports}")
+    spread = Counter(pinned.values())
+    print(f"Balanced {args.sessions} sessions x {args.turns} turns in {time.perf_counter() - started:.2f}s")
+    for fake, backend in zip(fakes, backends):
+        print(f"  {fake.url} (weight {backend.weight:g}): {spread[fake.port]} sessions")
+    if len(spread) < args.backends:
+        problems.append(f"sessions went to {len(spread)} of {args.backends} backends")
+
+    ports = [generate(client, "llama3.2", f"llama-{i}", 0) for i in range(5)]
+    if set(ports) != {fakes[0].port}:
+        problems.append(f"llama3.2 was sent to {sorted(set(ports))}, only {fakes[0].port} hosts it")
+
+    # Stop a backend: its sessions must move without any request failing
+    stopped = fakes[1]
+    stopped.stop()
+    served, errors = run_sessions(client, sessions, 1, first_turn=args.turns)
+    problems += [f"after stopping {stopped.url}: {error}" for error in errors]
+    if any(stopped.port in ports for ports in served.values()):
+        problems.append(f"requests were answered by stopped backend {stopped.url}")
+    if not wait_for(lambda: not backends[1].healthy, 5):
+        problems.append(f"{stopped.url} was not taken out of rotation")
+    moved = sum(1 for session, port in pinned.items() if port == stopped.port)
+    print(f"Stopped {stopped.url}: {moved} sessions moved, {len(errors)} failed requests")
+
+    # Restart it: health checks must bring it back and new sessions reach it
+    fakes[1] = FakeOllama(stopped.port, ["mistral"], args.tokens, 0.005).start()
+    if not wait_for(lambda: backends[1].healthy, 5):
+        problems.append(f"{stopped.url} was not put back in rotation")
+    fresh = [f"fresh-{i}" for i in range(args.sessions)]
+    served, errors = run_sessions(client, fresh, 1)
+    problems += errors
+    readmitted = sum(1 for ports in served.values() if stopped.port in ports)
+    print(f"Restarted {stopped.url}: {readmitted} of {len(fresh)} new sessions sent to it")
+    if not readmitted:
+        problems.append(f"no new session went to restarted backend {stopped.url}")
+
+    stats = pool.stats()
+    print(f"Affinity: {stats['affinity_hits']} hits, {stats['affinity_moves']} moves")
+    pool.close()
+    for fake in fakes:
+        fake.stop()
+
+    if problems:
+        print(f"FAILED: {len(problems)} problem(s)")
+        for problem in problems[:20]:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("OK: sessions kept their backend, failed over and came back")
+
+
+if __name__ == "__main__":
+    main()
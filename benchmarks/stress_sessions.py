@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Stress test for concurrent writers of one chat session
+Usage: python -m benchmarks.stress_sessions [--backend file|sqlite] [--processes N] [--threads N] [--messages N]
+
+Every thread of every process appends messages to the same session. Afterwards
+the session is reloaded and checked for lost, duplicated or reordered messages.
+Exits with status 1 if any check fails.
+"""
+
+import argparse
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from chat_storage import ChatStorage
+
+
+def run_writer(storage_dir: str, backend: str, session_id: str, process_index: int,
+               threads: int, messages: int, start_event=None):
+    """Append messages from several threads of this process"""
+    storage = ChatStorage(storage_dir, backend=backend)
+    if start_event is not None:
+        start_event.wait()
+
+    def write(thread_index: int):
+        for i in range(messages):
+            storage.add_message(session_id, "user", f"p{process_index}-t{thread_index}-{i}")
+
+    workers = [threading.Thread(target=write, args=(t,)) for t in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    storage.close()
+
+
+def verify(storage: ChatStorage, session_id: str, processes: int, threads: int, messages: int) -> list:
+    """Return a list of problems found in the stored session"""
+    problems = []
+    expected = processes * threads * messages
+    history = storage.get_chat_history(session_id)
+    summary = storage.get_session_summary(session_id) or {}
+
+    if len(history) != expected:
+        problems.append(f"expected {expected} messages, found {len(history)}")
+    if summary.get("message_count") != len(history):
+        problems.append(f"summary message_count {summary.get('message_count')} != {len(history)} stored")
+
+    seen = set()
+    last_index = {}
+    for message in history:
+        text = message.get("message", "")
+        if text in seen:
+            problems.append(f"duplicate message {text}")
+            continue
+        seen.add(text)
+        writer, _, index = text.rpartition("-")
+        # Messages of one thread must stay in the order that thread wrote them
+        if int(index) <= last_index.get(writer, -1):
+            problems.append(f"message {text} out of order")
+        last_index[writer] = int(index)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hammer one chat session from many threads and processes")
+    parser.add_argument("--backend", choices=["file", "sqlite"], default="file")
+    parser.add_argument("--processes", type=int, default=4, help="Writer processes")
+    parser.add_argument("--threads", type=int, default=4, help="Writer threads per process")
+    parser.add_argument("--messages", type=int, default=200, help="Messages per thread")
+    parser.add_argument("--dir", help="Storage directory (default: a temporary directory)")
+    args = parser.parse_args()
+
+    storage_dir = args.dir or tempfile.mkdtemp(prefix="chat_stress_")
+    storage = ChatStorage(storage_dir, backend=args.backend)
+    session_id = storage.create_chat_session("StressTest", "none")
+
+    start_event = multiprocessing.Event()
+    workers = [
+        multiprocessing.Process(
+            target=run_writer,
+            args=(storage_dir, args.backend, session_id, p, args.threads, args.messages, start_event)
+        )
+        for p in range(args.processes)
+    ]
+    for worker in workers:
+        worker.start()
+    started = time.perf_counter()
+    start_event.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    total = args.processes * args.threads * args.messages
+    problems = verify(storage, session_id, args.processes, args.threads, args.messages)
+    storage.close()
+
+    print(f"Backend: {args.backend}")
+    print(f"Writers: {args.processes} processes x {args.threads} threads, {args.messages} messages each")
+    print(f"Wrote {total} messages in {elapsed:.2f}s ({total / elapsed:.0f} messages/s)")
+    if any(worker.exitcode != 0 for worker in workers):
+        problems.append("a writer process exited with an error")
+
+    if not args.dir:
+        shutil.rmtree(storage_dir, ignore_errors=True)
+
+    if problems:
+        print(f"FAILED: {len(problems)} problem(s)")
+        for problem in problems[:20]:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("OK: no messages lost, duplicated or reordered")
+
+
+if __name__ == "__main__":
+    main()
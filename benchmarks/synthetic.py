@@ -0,0 +1,65 @@
+"""Synthetic chat history for storage benchmarks"""
+
+import random
+from datetime import datetime, timedelta
+from typing import List, Iterator, Tuple
+
+
+AGENT_NAMES = ["BasicAgent", "WeatherAgent", "NewsAgent", "TodoAgent",
+               "StockAgent", "QuizAgent", "WritingFeedbackAgent", "JokeAgent"]
+
+# Zipf-ish vocabulary so search terms have realistic, uneven frequencies
+VOCABULARY = (
+    "the a to and of is in it you that for on with this be are what how can weather "
+    "forecast rain sunny cloudy temperature stock price market shares portfolio news "
+    "headline article summary todo task deadline reminder quiz question answer score "
+    "essay grammar feedback paragraph joke pun laugh please thanks help explain tell "
+    "today tomorrow week morning evening london paris tokyo apple microsoft tesla "
+    "python code error server latency throughput database index cache memory disk"
+).split()
+
+
+class SyntheticHistory:
+    """Deterministic generator of sessions and messages
+
+    sessions x messages messages are produced, with message text of roughly
+    message_size characters, spread over the first `agents` agent names.
+    """
+
+    def __init__(self, sessions: int = 100, messages: int = 20, message_size: int = 200,
+                 agents: int = 4, seed: int = 0):
+        self.sessions = sessions
+        self.messages = messages
+        self.message_size = message_size
+        self.agents = AGENT_NAMES[:max(1, min(agents, len(AGENT_NAMES)))]
+        self.random = random.Random(seed)
+        self._weights = [1.0 / (rank + 1) for rank in range(len(VOCABULARY))]
+        self._start = datetime(2024, 1, 1)
+
+    def text(self) -> str:
+        """A message of about message_size characters"""
+        words: List[str] = []
+        length = 0
+        while length < self.message_size:
+            word = self.random.choices(VOCABULARY, self._weights)[0]
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)[:self.message_size]
+
+    def session_plan(self) -> Iterator[Tuple[str, str]]:
+        """(agent_name, model) for each session to create"""
+        for i in range(self.sessions):
+            yield self.agents[i % len(self.agents)], "llama3.2"
+
+    def message_plan(self, session_index: int) -> Iterator[Tuple[str, str, str]]:
+        """(sender, text, timestamp) for each message of a session"""
+        base = self._start + timedelta(minutes=session_index)
+        for i in range(self.messages):
+            sender = "user" if i % 2 == 0 else "assistant"
+            timestamp = (base + timedelta(seconds=i)).isoformat()
+            yield sender, self.text(), timestamp
+
+    def queries(self, count: int, words: int = 2) -> List[str]:
+        """Search queries drawn from the vocabulary, skipping the most common words"""
+        pool = VOCABULARY[len(VOCABULARY) // 5:]
+        return [" ".join(self.random.sample(pool, words)) for _ in range(count)]
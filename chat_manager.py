@@ -6,13 +6,43 @@ Utility to view, search, and manage chat history
 
 import argparse
 import json
+import re
+import sys
 from datetime import datetime
-from chat_storage import chat_storage
+from chat_storage import chat_storage, ChatStorage
+from storage.base import session_sort_key
 
 
-def list_sessions(agent_filter=None):
-    """List all chat sessions"""
-    sessions = chat_storage.list_chat_sessions(agent_filter)
+def print_progress(scanned, total, found):
+    """Show scan progress on stderr so stdout stays clean for results"""
+    sys.stderr.write(f"\rScanned {scanned}/{total} session(s), {found} result(s)")
+    sys.stderr.flush()
+
+
+def scan(kind, params, jobs, limit=None):
+    """Run a parallel scan with progress on stderr"""
+    results = list(chat_storage.scan_chats(kind, params, jobs, limit, print_progress))
+    sys.stderr.write("\n")
+    return results
+
+
+def list_sessions(agent_filter=None, limit=None, cursor=None, before=None, after=None, jobs=None):
+    """List chat sessions, one page at a time when a limit is given"""
+    if jobs:
+        if cursor:
+            print("Error: --cursor can't be combined with --jobs")
+            return
+        # A scan sees sessions in ID order, so sort them all before applying the limit
+        sessions = scan('list', {"agent_name": agent_filter, "before": before, "after": after}, jobs)
+        sessions.sort(key=session_sort_key, reverse=True)
+        page = {'sessions': sessions[:limit] if limit is not None else sessions, 'next_cursor': None}
+    else:
+        try:
+            page = chat_storage.list_chat_sessions_page(agent_filter, limit, cursor, before, after)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+    sessions = page['sessions']
     
     if not sessions:
         print("No chat sessions found.")
@@ -31,16 +61,25 @@ def list_sessions(agent_filter=None):
         if session['first_message']:
             print(f"First message: {session['first_message'][:100]}...")
         print("-" * 80)
+    
+    if page['next_cursor']:
+        print(f"More sessions available, continue with: --cursor {page['next_cursor']}")
 
 
-def view_session(session_id):
-    """View a specific chat session"""
-    chat_data = chat_storage.load_chat_session(session_id)
+def view_session(session_id, limit=None, cursor=None, before=None, after=None):
+    """View a specific chat session, one page of messages at a time when a limit is given"""
+    chat_data = chat_storage.get_session_summary(session_id)
     
     if not chat_data:
         print(f"Session {session_id} not found.")
         return
     
+    try:
+        page = chat_storage.get_chat_history_page(session_id, limit, cursor, before, after)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    
     print(f"Chat Session: {session_id}")
     print(f"Agent: {chat_data['agent_name']}")
     print(f"Model: {chat_data['model']}")
@@ -48,19 +87,25 @@ def view_session(session_id):
     print(f"Updated: {chat_data['updated_at']}")
     print("=" * 80)
     
-    for i, message in enumerate(chat_data['messages'], 1):
+    for position, message in zip(page['positions'], page['history']):
         timestamp = datetime.fromisoformat(message['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
         sender = message['sender'].upper()
         content = message['message']
         
-        print(f"\n[{i}] {timestamp} - {sender}:")
+        print(f"\n[{position + 1}] {timestamp} - {sender}:")
         print(content)
         print("-" * 40)
+    
+    if page['next_cursor']:
+        print(f"More messages available, continue with: --cursor {page['next_cursor']}")
 
 
-def search_sessions(query, agent_filter=None):
+def search_sessions(query, agent_filter=None, limit=None, jobs=None):
     """Search for sessions containing specific text"""
-    results = chat_storage.search_chats(query, agent_filter)
+    if jobs:
+        results = scan('search', {"query": query, "agent_name": agent_filter}, jobs, limit)
+    else:
+        results = chat_storage.search_chats(query, agent_filter, limit)
     
     if not results:
         print(f"No sessions found containing '{query}'.")
@@ -74,10 +119,32 @@ def search_sessions(query, agent_filter=None):
         print(f"Agent: {result['agent_name']}")
         print(f"Model: {result['model']}")
         print(f"Messages: {result['message_count']}")
+        if 'score' in result:
+            print(f"Score: {result['score']}")
         print(f"Matching content: {result['matching_message'][:150]}...")
         print("-" * 80)
 
 
+def grep_sessions(pattern, agent_filter=None, ignore_case=False, limit=None, jobs=1):
+    """Print every message matching a regular expression"""
+    try:
+        matches = scan('grep', {"pattern": pattern, "agent_name": agent_filter, "ignore_case": ignore_case},
+                       jobs, limit)
+    except re.error as e:
+        print(f"Invalid pattern: {e}")
+        return
+    
+    if not matches:
+        print(f"No messages match '{pattern}'.")
+        return
+    
+    for match in matches:
+        context = match['context'].replace("\n", " ")
+        print(f"{match['session_id']} [{match['message_index'] + 1}] {match['timestamp']} "
+              f"{match['sender']}: {context}")
+    print(f"{len(matches)} matching message(s).")
+
+
 def delete_session(session_id):
     """Delete a chat session"""
     if chat_storage.delete_chat_session(session_id):
@@ -88,17 +155,89 @@ def delete_session(session_id):
 
 def export_session(session_id, format_type='json'):
     """Export a chat session"""
-    exported_data = chat_storage.export_chat_session(session_id, format_type)
+    chunks = chat_storage.iter_export_chat_session(session_id, format_type)
     
-    if exported_data:
+    if chunks is not None:
         filename = f"chat_{session_id}.{format_type}"
         with open(filename, 'w', encoding='utf-8') as f:
-            f.write(exported_data)
+            for chunk in chunks:
+                f.write(chunk)
         print(f"Session exported to {filename}")
     else:
         print(f"Session {session_id} not found.")
 
 
+def export_all_sessions(format_type='jsonl', output=None, agent_filter=None, since=None, until=None):
+    """Export many sessions into one JSONL or tar archive, streamed to disk"""
+    filename = output or f"chat_history.{format_type}"
+    written = 0
+    with open(filename, 'wb') as f:
+        for chunk in chat_storage.iter_export_archive(format_type, agent_filter, since, until):
+            f.write(chunk)
+            written += len(chunk)
+    print(f"Exported {written} bytes to {filename}")
+
+
+def migrate_sessions(target_backend=None):
+    """Convert legacy sessions, or copy all sessions into another backend"""
+    if target_backend:
+        target = ChatStorage(chat_storage.storage_dir, backend=target_backend)
+        copied = chat_storage.copy_sessions_to(target)
+        print(f"Copied {copied} session(s) to the {target_backend} backend.")
+        return
+    
+    migrated = chat_storage.migrate_legacy_sessions()
+    print(f"Migrated {migrated} legacy session(s) to the journaled format.")
+
+
+def migrate_layout(layout):
+    """Move all sessions into the flat or sharded directory layout"""
+    try:
+        moved = chat_storage.migrate_layout(layout)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    print(f"Moved {moved} session(s) to the {layout} layout.")
+
+
+def compact_sessions(days, codec='gzip'):
+    """Archive sessions untouched for a number of days into compressed packs"""
+    try:
+        stats = chat_storage.compact_sessions(days, codec)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    before, after, elapsed = stats["bytes_before"], stats["bytes_after"], stats["elapsed"]
+    print(f"Archived {stats['sessions']} session(s) not updated in {days:g} day(s).")
+    if stats["skipped"]:
+        print(f"Skipped {stats['skipped']} session(s) that changed while compacting.")
+    if stats["sessions"]:
+        ratio = after / before if before else 0
+        print(f"Bytes: {before:,} -> {after:,} ({before - after:,} reclaimed, {ratio:.1%} of original)")
+        print(f"Throughput: {before / 1024 / 1024 / elapsed:.1f} MB/s, "
+              f"{stats['sessions'] / elapsed:.0f} sessions/s ({elapsed:.2f}s)")
+
+
+def rebuild_manifest():
+    """Rebuild the session summary manifest from the stored sessions"""
+    count = chat_storage.rebuild_manifest()
+    print(f"Session manifest rebuilt with {count} session(s).")
+
+
+def rebuild_search_index():
+    """Rebuild the full-text search index from the stored sessions"""
+    count = chat_storage.rebuild_search_index()
+    print(f"Search index rebuilt with {count} session(s).")
+
+
+def add_page_arguments(parser, timestamp_label):
+    """Add --limit/--cursor/--before/--after pagination options"""
+    parser.add_argument('--limit', type=int, help='Maximum number of entries to show')
+    parser.add_argument('--cursor', help='Continue from a cursor printed by a previous page')
+    parser.add_argument('--before', help=f'Only entries {timestamp_label} before this ISO timestamp')
+    parser.add_argument('--after', help=f'Only entries {timestamp_label} after this ISO timestamp')
+
+
 def main():
     parser = argparse.ArgumentParser(description='Chat History Manager')
     subparsers = parser.add_subparsers(dest='command', help='Available commands')
@@ -106,15 +245,29 @@ def main():
     # List sessions
     list_parser = subparsers.add_parser('list', help='List all chat sessions')
     list_parser.add_argument('--agent', help='Filter by agent name')
+    add_page_arguments(list_parser, 'updated')
+    list_parser.add_argument('--jobs', type=int, help='Scan session files with this many processes instead of reading the manifest')
     
     # View session
     view_parser = subparsers.add_parser('view', help='View a specific chat session')
     view_parser.add_argument('session_id', help='Session ID to view')
+    add_page_arguments(view_parser, 'sent')
     
     # Search sessions
     search_parser = subparsers.add_parser('search', help='Search for sessions')
-    search_parser.add_argument('query', help='Search query')
+    search_parser.add_argument('query',
+                               help='Search query (each word also matches its 63 most common completions)')
     search_parser.add_argument('--agent', help='Filter by agent name')
+    search_parser.add_argument('--limit', type=int, help='Maximum number of sessions to show')
+    search_parser.add_argument('--jobs', type=int, help='Scan session files with this many processes instead of using the index')
+    
+    # Regex search over messages
+    grep_parser = subparsers.add_parser('grep', help='Find messages matching a regular expression')
+    grep_parser.add_argument('pattern', help='Regular expression')
+    grep_parser.add_argument('--agent', help='Filter by agent name')
+    grep_parser.add_argument('-i', '--ignore-case', action='store_true', help='Case-insensitive matching')
+    grep_parser.add_argument('--limit', type=int, help='Stop after this many matching messages')
+    grep_parser.add_argument('--jobs', type=int, default=1, help='Number of scanning processes')
     
     # Delete session
     delete_parser = subparsers.add_parser('delete', help='Delete a chat session')
@@ -125,18 +278,59 @@ def main():
     export_parser.add_argument('session_id', help='Session ID to export')
     export_parser.add_argument('--format', choices=['json', 'txt'], default='json', help='Export format')
     
+    # Export many sessions
+    export_all_parser = subparsers.add_parser('export-all', help='Export many sessions into one archive')
+    export_all_parser.add_argument('--format', choices=['jsonl', 'tar'], default='jsonl', help='Archive format')
+    export_all_parser.add_argument('--output', help='Output file (default: chat_history.<format>)')
+    export_all_parser.add_argument('--agent', help='Filter by agent name')
+    export_all_parser.add_argument('--since', help='Only sessions updated after this ISO timestamp')
+    export_all_parser.add_argument('--until', help='Only sessions updated before this ISO timestamp')
+    
+    # Migrate legacy sessions
+    migrate_parser = subparsers.add_parser('migrate', help='Convert legacy .json sessions to the journaled format')
+    migrate_parser.add_argument('--to-backend', choices=['file', 'sqlite'], help='Copy all sessions into this backend instead')
+    
+    # Change the directory layout
+    layout_parser = subparsers.add_parser('migrate-layout', help='Move sessions into the flat or sharded directory layout')
+    layout_parser.add_argument('layout', choices=['flat', 'sharded'], help='Target layout')
+    
+    # Archive cold sessions
+    compact_parser = subparsers.add_parser('compact', help='Compress sessions not updated recently into the archive')
+    compact_parser.add_argument('--days', type=float, default=30, help='Archive sessions untouched for this many days (default: 30)')
+    compact_parser.add_argument('--codec', choices=['gzip', 'zstd'], default='gzip', help='Compression (zstd needs the zstandard package)')
+    
+    # Rebuild session manifest
+    subparsers.add_parser('rebuild-manifest', help='Rebuild the session summary manifest used for listing')
+    
+    # Rebuild search index
+    subparsers.add_parser('reindex', help='Rebuild the full-text search index')
+    
     args = parser.parse_args()
     
     if args.command == 'list':
-        list_sessions(args.agent)
+        list_sessions(args.agent, args.limit, args.cursor, args.before, args.after, args.jobs)
     elif args.command == 'view':
-        view_session(args.session_id)
+        view_session(args.session_id, args.limit, args.cursor, args.before, args.after)
     elif args.command == 'search':
-        search_sessions(args.query, args.agent)
+        search_sessions(args.query, args.agent, args.limit, args.jobs)
+    elif args.command == 'grep':
+        grep_sessions(args.pattern, args.agent, args.ignore_case, args.limit, args.jobs)
     elif args.command == 'delete':
         delete_session(args.session_id)
     elif args.command == 'export':
         export_session(args.session_id, args.format)
+    elif args.command == 'export-all':
+        export_all_sessions(args.format, args.output, args.agent, args.since, args.until)
+    elif args.command == 'migrate':
+        migrate_sessions(args.to_backend)
+    elif args.command == 'migrate-layout':
+        migrate_layout(args.layout)
+    elif args.command == 'compact':
+        compact_sessions(args.days, args.codec)
+    elif args.command == 'rebuild-manifest':
+        rebuild_manifest()
+    elif args.command == 'reindex':
+        rebuild_search_index()
     else:
         parser.print_help()
 
@@ -1,27 +1,140 @@
+import base64
+import io
 import json
 import os
-from datetime import datetime
-from typing import List, Dict, Optional
+import atexit
+import tarfile
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import List, Dict, Optional, Union, Any, Iterator, Callable
 import uuid
 
+from storage import StorageBackend, FileBackend, SQLiteBackend, SessionCache, WriteBehindWriter
+from storage.write_behind import FSYNC_POLICIES
+from storage.base import session_sort_key
+from storage.scan import parallel_scan
+
+
+# Backend used by the global instance, selectable without code changes
+DEFAULT_BACKEND = os.environ.get("CHAT_STORAGE_BACKEND", "file")
+DEFAULT_STORAGE_DIR = os.environ.get("CHAT_STORAGE_DIR", "chat_history")
+# File backend directory layout ("flat" or "sharded"); unset means whatever the directory already uses
+DEFAULT_LAYOUT = os.environ.get("CHAT_STORAGE_LAYOUT") or None
+# Loaded-session cache limits (0 disables the cache)
+DEFAULT_CACHE_ENTRIES = int(os.environ.get("CHAT_CACHE_ENTRIES", "256"))
+DEFAULT_CACHE_BYTES = int(os.environ.get("CHAT_CACHE_BYTES", str(64 * 1024 * 1024)))
+# Write-behind group commit: queue message writes and flush them from a background thread
+DEFAULT_WRITE_BEHIND = os.environ.get("CHAT_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+DEFAULT_FLUSH_INTERVAL = float(os.environ.get("CHAT_FLUSH_INTERVAL", "0.05"))
+DEFAULT_FLUSH_MAX_PENDING = int(os.environ.get("CHAT_FLUSH_MAX_PENDING", "256"))
+# Queue depth at which add_message writes the queue itself instead of leaving it to the thread
+DEFAULT_FLUSH_MAX_QUEUED = int(os.environ.get("CHAT_FLUSH_MAX_QUEUED", "4096"))
+# fsync policy: "none" (leave it to the OS), "interval" (at most every CHAT_FSYNC_INTERVAL s), "always"
+DEFAULT_FSYNC = os.environ.get("CHAT_FSYNC", "none").lower()
+DEFAULT_FSYNC_INTERVAL = float(os.environ.get("CHAT_FSYNC_INTERVAL", "1.0"))
+
+EXPORT_FORMATS = ("json", "txt")
+ARCHIVE_FORMATS = ("jsonl", "tar")
+# Sessions listed per page while streaming an archive
+ARCHIVE_PAGE_SIZE = 200
+
+
+def create_backend(name: str, storage_dir: str = DEFAULT_STORAGE_DIR,
+                   layout: Optional[str] = None) -> StorageBackend:
+    """Create a storage backend by name ("file" or "sqlite")"""
+    name = name.lower()
+    if name == "file":
+        return FileBackend(storage_dir, layout)
+    if name == "sqlite":
+        return SQLiteBackend(os.path.join(storage_dir, "chat_history.db"))
+    raise ValueError(f"Unknown chat storage backend: {name}")
+
+
+def encode_cursor(value: Any) -> str:
+    """Encode a pagination position as an opaque URL-safe cursor"""
+    raw = json.dumps(value, separators=(",", ":")).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Any:
+    """Decode a cursor produced by encode_cursor, raising ValueError if it's invalid"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
 
 class ChatStorage:
     """Handles storing and retrieving chat conversations"""
-    
-    def __init__(self, storage_dir: str = "chat_history"):
+
+    def __init__(self, storage_dir: str = DEFAULT_STORAGE_DIR,
+                 backend: Union[str, StorageBackend, None] = None,
+                 cache_entries: int = DEFAULT_CACHE_ENTRIES, cache_bytes: int = DEFAULT_CACHE_BYTES,
+                 write_behind: bool = DEFAULT_WRITE_BEHIND, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 flush_max_pending: int = DEFAULT_FLUSH_MAX_PENDING, flush_max_queued: int = DEFAULT_FLUSH_MAX_QUEUED,
+                 fsync: str = DEFAULT_FSYNC, fsync_interval: float = DEFAULT_FSYNC_INTERVAL,
+                 layout: Optional[str] = DEFAULT_LAYOUT):
         self.storage_dir = storage_dir
-        self.ensure_storage_dir()
-        
-    def ensure_storage_dir(self):
-        """Create storage directory if it doesn't exist"""
-        if not os.path.exists(self.storage_dir):
-            os.makedirs(self.storage_dir)
-    
+        if backend is None:
+            backend = DEFAULT_BACKEND
+        if isinstance(backend, str):
+            backend = create_backend(backend, storage_dir, layout)
+        self.backend = backend
+        self.cache = SessionCache(cache_entries, cache_bytes)
+
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._last_fsync = time.monotonic()
+        self.writer = None
+        if write_behind:
+            self.writer = WriteBehindWriter(self._persist_messages, flush_interval, flush_max_pending,
+                                            flush_max_queued)
+            # Don't lose queued messages on a normal interpreter exit
+            atexit.register(self.close)
+
+    def close(self):
+        """Flush queued writes and release backend resources"""
+        if self.writer is not None:
+            self.writer.close()
+        self.backend.close()
+
+    def flush(self, session_id: Optional[str] = None):
+        """Write any queued messages (for one session, or all of them) to the backend
+
+        Raises FlushError if queued messages failed to write since the last check.
+        """
+        if self.writer is not None:
+            self.writer.flush(session_id)
+
+    def _write_queued(self, session_id: Optional[str] = None):
+        # Reads bring the backend up to date; write errors are left for add_message()/flush()
+        if self.writer is not None:
+            self.writer.flush(session_id, check=False)
+
+    def writer_stats(self) -> Dict:
+        """Queue depth and flush counters of the write-behind writer"""
+        stats = {"write_behind": self.writer is not None, "fsync": self.fsync}
+        if self.writer is not None:
+            stats.update(self.writer.stats())
+        return stats
+
+    def cache_stats(self) -> Dict:
+        """Hit/miss counters and current size of the loaded-session cache"""
+        return self.cache.stats()
+
+    def describe_location(self, session_id: str) -> str:
+        """Where a session is stored, for CLI output"""
+        return self.backend.describe_location(session_id)
+
     def create_chat_session(self, agent_name: str, model: str) -> str:
         """Create a new chat session and return session ID"""
         session_id = str(uuid.uuid4())
         timestamp = datetime.now().isoformat()
-        
+
         chat_data = {
             "session_id": session_id,
             "agent_name": agent_name,
@@ -30,150 +143,382 @@ class ChatStorage:
             "updated_at": timestamp,
             "messages": []
         }
-        
-        self.save_chat_session(chat_data)
+
+        self.backend.create_session(chat_data)
         return session_id
-    
-    def add_message(self, session_id: str, sender: str, message: str, timestamp: Optional[str] = None):
-        """Add a message to an existing chat session"""
+
+    def add_message(self, session_id: str, sender: str, message: str, timestamp: Optional[str] = None,
+                    **fields):
+        """Add a message to an existing chat session
+
+        Extra keyword fields (e.g. truncated=True) are stored with the message.
+        With write-behind, raises FlushError if earlier messages of the session
+        failed to write.
+        """
         if timestamp is None:
             timestamp = datetime.now().isoformat()
-            
-        chat_data = self.load_chat_session(session_id)
-        if chat_data:
-            chat_data["messages"].append({
-                "sender": sender,
-                "message": message,
-                "timestamp": timestamp
-            })
-            chat_data["updated_at"] = timestamp
-            self.save_chat_session(chat_data)
+
+        record = {
+            "sender": sender,
+            "message": message,
+            "timestamp": timestamp,
+            **fields
+        }
+        if self.writer is None:
+            return self._persist_messages(session_id, [record])
+
+        # Sessions are created synchronously, so an unknown ID can be rejected right away
+        if self.writer.pending(session_id) == 0 and self.backend.session_version(session_id) is None:
+            return False
+        self.writer.add(session_id, record)
+        return True
+
+    def _should_fsync(self) -> bool:
+        if self.fsync == "always":
             return True
+        if self.fsync == "interval":
+            now = time.monotonic()
+            if now - self._last_fsync >= self.fsync_interval:
+                self._last_fsync = now
+                return True
         return False
-    
+
+    def _persist_messages(self, session_id: str, records: List[Dict]) -> bool:
+        """Append records to the backend, keeping the session cache in step"""
+        sync = self._should_fsync()
+        if not self.cache.enabled:
+            return self.backend.append_messages(session_id, records, sync)
+
+        # Hold the session lock so no other writer, in this process or another,
+        # can slip in between the version checks and the append
+        with self.backend.session_lock(session_id):
+            version_before = self.backend.session_version(session_id)
+            if not self.backend.append_messages(session_id, records, sync):
+                self.cache.invalidate(session_id)
+                return False
+            # Keep a cached copy warm so the next load after this turn is a hit
+            version_after = self.backend.session_version(session_id)
+            self.cache.append(session_id, version_before, version_after, records, records[-1]["timestamp"])
+        return True
+
     def load_chat_session(self, session_id: str) -> Optional[Dict]:
         """Load a chat session by ID"""
-        filepath = os.path.join(self.storage_dir, f"{session_id}.json")
-        if os.path.exists(filepath):
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError):
-                return None
-        return None
-    
+        self._write_queued(session_id)
+        if not self.cache.enabled:
+            return self.backend.load_session(session_id)
+
+        version = self.backend.session_version(session_id)
+        if version is None:
+            self.cache.invalidate(session_id)
+            return None
+        chat_data = self.cache.get(session_id, version)
+        if chat_data is not None:
+            return chat_data
+
+        chat_data = self.backend.load_session(session_id)
+        # Only cache if nothing changed while we were reading
+        if chat_data is not None and self.backend.session_version(session_id) == version:
+            self.cache.put(session_id, version, chat_data)
+        return chat_data
+
+    def get_session_summary(self, session_id: str) -> Optional[Dict]:
+        """Get a session's summary (header and message count) without loading its messages"""
+        self._write_queued(session_id)
+        return self.backend.load_summary(session_id)
+
     def save_chat_session(self, chat_data: Dict):
-        """Save chat session to file"""
-        session_id = chat_data["session_id"]
-        filepath = os.path.join(self.storage_dir, f"{session_id}.json")
-        
-        try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(chat_data, f, indent=2, ensure_ascii=False)
-        except IOError as e:
-            print(f"Error saving chat session: {e}")
-    
-    def list_chat_sessions(self, agent_name: Optional[str] = None) -> List[Dict]:
-        """List all chat sessions, optionally filtered by agent"""
-        sessions = []
-        
-        for filename in os.listdir(self.storage_dir):
-            if filename.endswith('.json'):
-                session_id = filename[:-5]  # Remove .json extension
-                chat_data = self.load_chat_session(session_id)
-                
-                if chat_data:
-                    if agent_name is None or chat_data.get("agent_name") == agent_name:
-                        # Add summary info
-                        summary = {
-                            "session_id": session_id,
-                            "agent_name": chat_data.get("agent_name"),
-                            "model": chat_data.get("model"),
-                            "created_at": chat_data.get("created_at"),
-                            "updated_at": chat_data.get("updated_at"),
-                            "message_count": len(chat_data.get("messages", [])),
-                            "first_message": chat_data.get("messages", [{}])[0].get("message", "")[:100] if chat_data.get("messages") else ""
-                        }
-                        sessions.append(summary)
-        
-        # Sort by updated_at (most recent first)
-        sessions.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
-        return sessions
-    
+        """Save a full chat session, replacing any stored copy"""
+        self._write_queued(chat_data["session_id"])
+        self.cache.invalidate(chat_data["session_id"])
+        self.backend.save_session(chat_data)
+
+    def list_chat_sessions(self, agent_name: Optional[str] = None, limit: Optional[int] = None,
+                           cursor: Optional[str] = None, before: Optional[str] = None,
+                           after: Optional[str] = None) -> List[Dict]:
+        """List chat sessions, most recent first, optionally filtered by agent"""
+        return self.list_chat_sessions_page(agent_name, limit, cursor, before, after)["sessions"]
+
+    def list_chat_sessions_page(self, agent_name: Optional[str] = None, limit: Optional[int] = None,
+                                cursor: Optional[str] = None, before: Optional[str] = None,
+                                after: Optional[str] = None) -> Dict:
+        """List one page of chat sessions plus the cursor for the next page
+
+        before/after filter on the session's updated_at timestamp.
+        """
+        position = None
+        if cursor:
+            position = decode_cursor(cursor)
+            if not (isinstance(position, list) and len(position) == 2):
+                raise ValueError(f"Invalid cursor: {cursor}")
+            position = tuple(position)
+
+        self._write_queued()
+        # Fetch one extra row to know whether another page follows
+        fetch = limit + 1 if limit is not None else None
+        sessions = self.backend.list_sessions(agent_name, fetch, before, after, position)
+        next_cursor = None
+        if limit is not None and len(sessions) > limit:
+            sessions = sessions[:limit]
+            next_cursor = encode_cursor(list(session_sort_key(sessions[-1])))
+        return {"sessions": sessions, "next_cursor": next_cursor}
+
     def delete_chat_session(self, session_id: str) -> bool:
         """Delete a chat session"""
-        filepath = os.path.join(self.storage_dir, f"{session_id}.json")
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-                return True
-            except OSError:
-                return False
-        return False
-    
-    def get_chat_history(self, session_id: str) -> List[Dict]:
-        """Get all messages from a chat session"""
-        chat_data = self.load_chat_session(session_id)
-        if chat_data:
-            return chat_data.get("messages", [])
-        return []
-    
-    def search_chats(self, query: str, agent_name: Optional[str] = None) -> List[Dict]:
-        """Search for chats containing specific text"""
-        results = []
-        query_lower = query.lower()
-        
-        for filename in os.listdir(self.storage_dir):
-            if filename.endswith('.json'):
-                session_id = filename[:-5]
-                chat_data = self.load_chat_session(session_id)
-                
-                if chat_data:
-                    if agent_name is None or chat_data.get("agent_name") == agent_name:
-                        # Search in messages
-                        for message in chat_data.get("messages", []):
-                            if query_lower in message.get("message", "").lower():
-                                summary = {
-                                    "session_id": session_id,
-                                    "agent_name": chat_data.get("agent_name"),
-                                    "model": chat_data.get("model"),
-                                    "created_at": chat_data.get("created_at"),
-                                    "updated_at": chat_data.get("updated_at"),
-                                    "message_count": len(chat_data.get("messages", [])),
-                                    "matching_message": message.get("message", "")[:200]
-                                }
-                                results.append(summary)
-                                break  # Only add each session once
-        
-        return results
-    
+        self._write_queued(session_id)
+        self.cache.invalidate(session_id)
+        return self.backend.delete_session(session_id)
+
+    def get_chat_history(self, session_id: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+                         before: Optional[str] = None, after: Optional[str] = None, tail: Optional[int] = None,
+                         start: Optional[int] = None, end: Optional[int] = None) -> List[Dict]:
+        """Get messages from a chat session, oldest first
+
+        tail=N returns only the last N messages and start/end a range of message
+        indexes (end exclusive); both seek straight to those messages.
+        """
+        if tail is not None or start is not None or end is not None:
+            return self.get_chat_history_range(session_id, start or 0, end, tail)["history"]
+        if limit is None and cursor is None and before is None and after is None:
+            chat_data = self.load_chat_session(session_id)
+            return chat_data.get("messages", []) if chat_data else []
+        return self.get_chat_history_page(session_id, limit, cursor, before, after)["history"]
+
+    def get_chat_history_page(self, session_id: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+                              before: Optional[str] = None, after: Optional[str] = None) -> Dict:
+        """Get one page of a session's messages plus the cursor for the next page
+
+        before/after filter on the message timestamp, so "positions" gives each
+        message's index in the session. Messages are streamed from the backend, so
+        memory use depends on the page size, not the session size.
+        """
+        start = 0
+        if cursor:
+            start = decode_cursor(cursor)
+            if not isinstance(start, int) or start < 0:
+                raise ValueError(f"Invalid cursor: {cursor}")
+
+        self._write_queued(session_id)
+        messages = self.backend.iter_messages(session_id, start, before, after)
+        try:
+            page = list(islice(messages, limit + 1 if limit is not None else None))
+        finally:
+            messages.close()
+
+        next_cursor = None
+        if limit is not None and len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(page[-1][0] + 1)
+        return {"history": [message for _, message in page], "positions": [index for index, _ in page],
+                "next_cursor": next_cursor}
+
+    def get_chat_history_range(self, session_id: str, start: int = 0, end: Optional[int] = None,
+                               tail: Optional[int] = None) -> Dict:
+        """Get messages [start, end) of a session, or its last `tail` messages
+
+        Returns the messages, the index of the first one and the session's message count.
+        """
+        if start < 0 or (end is not None and end < 0) or (tail is not None and tail < 0):
+            raise ValueError("start, end and tail must not be negative")
+        self._write_queued(session_id)
+        count = self.backend.message_count(session_id)
+        if count is None:
+            return {"history": [], "start": 0, "message_count": 0}
+        if tail is not None:
+            start = max(count - tail, 0)
+            end = count
+        history = self.backend.read_messages(session_id, start, end)
+        return {"history": history, "start": start, "message_count": count}
+
+    def get_session_state(self, session_id: str) -> Optional[Dict]:
+        """Get the state stored beside a session's transcript, if any"""
+        return self.backend.load_session_state(session_id)
+
+    def set_session_state(self, session_id: str, state: Optional[Dict]):
+        """Store state beside a session's transcript (None removes it)"""
+        self.backend.save_session_state(session_id, state)
+
+    def scan_chats(self, kind: str, params: Dict, jobs: int = 1, limit: Optional[int] = None,
+                   progress: Optional[Callable[[int, int, int], None]] = None) -> Iterator[Dict]:
+        """Scan the stored sessions directly with `jobs` worker processes
+
+        kind is "list" (session summaries), "search" (sessions with a message
+        containing every word of params["query"]) or "grep" (every message matching
+        the regex params["pattern"]). Unlike list_chat_sessions and search_chats this
+        doesn't use the manifest or search index. Results come in session ID order
+        and scanning stops once `limit` results were produced.
+        """
+        self._write_queued()
+        # Workers open their own copy of the backend
+        if isinstance(self.backend, SQLiteBackend):
+            factory, factory_args = SQLiteBackend, (self.backend.db_path,)
+        elif isinstance(self.backend, FileBackend):
+            factory, factory_args = FileBackend, (self.backend.storage_dir, self.backend.layout)
+        else:
+            factory, factory_args, jobs = None, (), 1
+        return parallel_scan(self.backend, factory, factory_args, kind, params, jobs, limit, progress)
+
+    def search_chats(self, query: str, agent_name: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+        """Search for chats whose messages contain every query word (prefixes match), best first"""
+        self._write_queued()
+        return self.backend.search(query, agent_name, limit)
+
+    def rebuild_search_index(self) -> int:
+        """Rebuild the full-text search index, returning the number of sessions indexed"""
+        self._write_queued()
+        return self.backend.rebuild_search_index()
+
+    def migrate_legacy_sessions(self) -> int:
+        """Convert legacy single-file sessions to the journaled format, returning the count"""
+        if isinstance(self.backend, FileBackend):
+            return self.backend.migrate_legacy_sessions()
+        return 0
+
+    def rebuild_manifest(self) -> int:
+        """Rebuild the file backend's session manifest, returning the session count"""
+        if isinstance(self.backend, FileBackend):
+            return self.backend.rebuild_manifest()
+        return 0
+
+    def migrate_layout(self, layout: str) -> int:
+        """Move the file backend's sessions into another directory layout, returning the count"""
+        if not isinstance(self.backend, FileBackend):
+            raise ValueError("Directory layouts only apply to the file backend")
+        self._write_queued()
+        self.cache.clear()
+        return self.backend.migrate_layout(layout)
+
+    def compact_sessions(self, days: float, codec: str = "gzip") -> Dict:
+        """Move sessions not updated for `days` days into the compressed archive tier
+
+        Archived sessions are still loaded, listed, searched and exported as usual,
+        and return to the hot tier when a message is added. Returns the backend's
+        counters (sessions, skipped, bytes_before, bytes_after, elapsed).
+        """
+        if not isinstance(self.backend, FileBackend):
+            raise ValueError("Compaction only applies to the file backend")
+        self._write_queued()
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        return self.backend.archive_sessions(cutoff, codec)
+
+    def copy_sessions_to(self, target: "ChatStorage") -> int:
+        """Copy every session into another storage, returning the count"""
+        copied = 0
+        for summary in self.list_chat_sessions():
+            chat_data = self.load_chat_session(summary["session_id"])
+            if chat_data:
+                target.save_chat_session(chat_data)
+                copied += 1
+        return copied
+
     def export_chat_session(self, session_id: str, format: str = "json") -> Optional[str]:
         """Export a chat session to different formats"""
-        chat_data = self.load_chat_session(session_id)
-        if not chat_data:
+        chunks = self.iter_export_chat_session(session_id, format)
+        if chunks is None:
+            return None
+        return "".join(chunks)
+
+    def iter_export_chat_session(self, session_id: str, format: str = "json") -> Optional[Iterator[str]]:
+        """Export a chat session as a stream of text chunks, one message at a time
+
+        Returns None if the session doesn't exist or the format is unsupported.
+        """
+        format = format.lower()
+        if format not in EXPORT_FORMATS:
             return None
-        
-        if format.lower() == "json":
-            return json.dumps(chat_data, indent=2, ensure_ascii=False)
-        
-        elif format.lower() == "txt":
-            lines = []
-            lines.append(f"Chat Session: {session_id}")
-            lines.append(f"Agent: {chat_data.get('agent_name')}")
-            lines.append(f"Model: {chat_data.get('model')}")
-            lines.append(f"Created: {chat_data.get('created_at')}")
-            lines.append("-" * 50)
-            
-            for message in chat_data.get("messages", []):
-                timestamp = message.get("timestamp", "")
-                sender = message.get("sender", "")
-                content = message.get("message", "")
-                lines.append(f"\n[{timestamp}] {sender.upper()}:")
-                lines.append(content)
-            
-            return "\n".join(lines)
-        
-        return None
+        self._write_queued(session_id)
+        header = self.backend.load_header(session_id)
+        if header is None:
+            return None
+        if format == "json":
+            return self._iter_export_json(session_id, header)
+        return self._iter_export_txt(session_id, header)
+
+    def _iter_export_json(self, session_id: str, header: Dict) -> Iterator[str]:
+        """Same document as json.dumps(chat_data, indent=2), produced incrementally"""
+        yield json.dumps(header, indent=2, ensure_ascii=False)[:-2]
+        yield ',\n  "messages": ['
+        first = True
+        for _, message in self.backend.iter_messages(session_id):
+            body = json.dumps(message, indent=2, ensure_ascii=False).replace("\n", "\n    ")
+            yield ("\n    " if first else ",\n    ") + body
+            first = False
+        yield "]\n}" if first else "\n  ]\n}"
+
+    def _iter_export_txt(self, session_id: str, header: Dict) -> Iterator[str]:
+        yield f"Chat Session: {session_id}\n"
+        yield f"Agent: {header.get('agent_name')}\n"
+        yield f"Model: {header.get('model')}\n"
+        yield f"Created: {header.get('created_at')}\n"
+        yield "-" * 50
+
+        for _, message in self.backend.iter_messages(session_id):
+            timestamp = message.get("timestamp", "")
+            sender = message.get("sender", "")
+            content = message.get("message", "")
+            yield f"\n\n[{timestamp}] {sender.upper()}:\n{content}"
+
+    def iter_export_archive(self, format: str = "jsonl", agent_name: Optional[str] = None,
+                            since: Optional[str] = None, until: Optional[str] = None) -> Iterator[bytes]:
+        """Stream many sessions as a JSONL or tar archive, holding one session in memory at a time
+
+        since/until filter on the session's updated_at timestamp.
+        """
+        format = format.lower()
+        if format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unsupported archive format: {format}")
+        if format == "jsonl":
+            return self._iter_archive_jsonl(agent_name, since, until)
+        return self._iter_archive_tar(agent_name, since, until)
+
+    def _iter_archive_sessions(self, agent_name: Optional[str], since: Optional[str],
+                               until: Optional[str]) -> Iterator[Dict]:
+        """Load matching sessions one by one, paging through the session list"""
+        cursor = None
+        while True:
+            page = self.list_chat_sessions_page(agent_name, ARCHIVE_PAGE_SIZE, cursor, before=until, after=since)
+            for summary in page["sessions"]:
+                chat_data = self.load_chat_session(summary["session_id"])
+                if chat_data:
+                    yield chat_data
+            cursor = page["next_cursor"]
+            if not cursor:
+                return
+
+    def _iter_archive_jsonl(self, agent_name, since, until) -> Iterator[bytes]:
+        for chat_data in self._iter_archive_sessions(agent_name, since, until):
+            yield (json.dumps(chat_data, ensure_ascii=False) + "\n").encode('utf-8')
+
+    def _iter_archive_tar(self, agent_name, since, until) -> Iterator[bytes]:
+        buffer = _ChunkBuffer()
+        # "w|" writes a non-seekable stream, so chunks can be sent as soon as they're ready
+        with tarfile.open(fileobj=buffer, mode="w|") as archive:
+            for chat_data in self._iter_archive_sessions(agent_name, since, until):
+                data = json.dumps(chat_data, indent=2, ensure_ascii=False).encode('utf-8')
+                info = tarfile.TarInfo(name=f"{chat_data['session_id']}.json")
+                info.size = len(data)
+                info.mtime = int(time.time())
+                archive.addfile(info, io.BytesIO(data))
+                yield buffer.drain()
+        yield buffer.drain()
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only file object that collects bytes until they are drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
 
 
 # Global chat storage instance
@@ -0,0 +1,321 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional, Iterator, Callable, List
+
+from storage.locking import atomic_write
+
+
+# Opt-in: "off", "memory", or "disk" (memory in front of a directory of entries)
+DEFAULT_MODE = os.environ.get("CHAT_RESPONSE_CACHE", "off").lower()
+DEFAULT_DIR = os.environ.get("CHAT_RESPONSE_CACHE_DIR", "response_cache")
+DEFAULT_MAX_ENTRIES = int(os.environ.get("CHAT_RESPONSE_CACHE_ENTRIES", "512"))
+DEFAULT_MAX_BYTES = int(os.environ.get("CHAT_RESPONSE_CACHE_BYTES", str(16 * 1024 * 1024)))
+DEFAULT_DISK_MAX_BYTES = int(os.environ.get("CHAT_RESPONSE_CACHE_DISK_BYTES", str(256 * 1024 * 1024)))
+
+MODES = ("off", "memory", "disk")
+ENTRY_SUFFIX = ".json"
+# Cached answers are replayed a word at a time, like tokens from the model
+REPLAY_TOKEN = re.compile(r"\s*\S+|\s+")
+
+
+def cache_key(agent_name: str, model: str, system_prompt: Optional[str], prompt: str,
+              fields: Optional[Dict] = None) -> str:
+    """Key for a generation: agent, model, and hashes of everything sent to the model"""
+    digest = hashlib.sha256()
+    for part in (system_prompt or "", prompt, json.dumps(fields or {}, sort_keys=True, separators=(",", ":"))):
+        digest.update(hashlib.sha256(part.encode('utf-8')).digest())
+    return hashlib.sha256(f"{agent_name}\0{model}\0{digest.hexdigest()}".encode('utf-8')).hexdigest()
+
+
+def replay_tokens(response: str) -> List[str]:
+    return REPLAY_TOKEN.findall(response)
+
+
+class ResponseCache:
+    """Bounded LRU cache of complete model answers, each with its own TTL
+
+    Entries hold the response text and the conversation context Ollama returned
+    with it, so a hit also carries a session's memory forward. In "disk" mode
+    entries are also written to one file each under directory, which is trimmed
+    to disk_max_bytes least recently used first and survives restarts.
+    """
+
+    def __init__(self, mode: str = DEFAULT_MODE, directory: str = DEFAULT_DIR,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 disk_max_bytes: int = DEFAULT_DISK_MAX_BYTES):
+        if mode not in MODES:
+            raise ValueError(f"Unknown response cache mode: {mode}")
+        self.mode = mode
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        if self.mode == "disk":
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off" and self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, key: str, count_miss: bool = True) -> Optional[Dict]:
+        """Cached entry ({"response", "context", "expires_at"}) if present and not expired
+
+        count_miss=False is for a look ahead of stream(), which counts the miss itself.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0]["expires_at"] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._remove(key)
+                self.expired += 1
+
+        entry = self._load(key) if self.mode == "disk" else None
+        with self._lock:
+            if entry is None or entry.get("expires_at", 0) <= now:
+                if entry is not None:
+                    self.expired += 1
+                if count_miss:
+                    self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, ttl: float, response: str, context: Optional[List[int]] = None):
+        """Cache a complete response for ttl seconds"""
+        if not self.enabled or ttl <= 0:
+            return
+        entry = {"expires_at": time.time() + ttl, "response": response, "context": context}
+        with self._lock:
+            self._remember(key, entry)
+        if self.mode == "disk":
+            self._store(key, entry)
+
+    def replay(self, key: str, on_done: Optional[Callable[[Optional[List[int]]], None]] = None
+               ) -> Optional[Iterator[str]]:
+        """Tokens of the cached response for key, or None if it has to be generated
+
+        Lets a request the cache can answer skip waiting for a generation slot.
+        """
+        entry = self.get(key, count_miss=False)
+        return self._replay(entry, on_done) if entry is not None else None
+
+    async def areplay(self, key: str, on_done: Optional[Callable[[Optional[List[int]]], None]] = None
+                      ) -> Optional[AsyncIterator[str]]:
+        """replay() for asyncio callers"""
+        if self.mode == "disk":
+            entry = await asyncio.to_thread(self.get, key, False)
+        else:
+            entry = self.get(key, count_miss=False)
+        return self._areplay(entry, on_done) if entry is not None else None
+
+    @staticmethod
+    def _replay(entry: Dict, on_done) -> Iterator[str]:
+        yield from replay_tokens(entry["response"])
+        if on_done is not None:
+            on_done(entry.get("context"))
+
+    @staticmethod
+    async def _areplay(entry: Dict, on_done) -> AsyncIterator[str]:
+        for token in replay_tokens(entry["response"]):
+            yield token
+        if on_done is not None:
+            on_done(entry.get("context"))
+
+    def stream(self, key: str, ttl: float, generate: Callable[[Callable[[Dict], None]], Iterator[str]],
+               on_done: Optional[Callable[[Optional[List[int]]], None]] = None) -> Iterator[str]:
+        """Stream a response from the cache, or from generate(on_final_chunk) and cache it
+
+        Only responses that ran to their final chunk are cached. on_done gets the
+        conversation context of the answer, cached or fresh.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            yield from self._replay(entry, on_done)
+            return
+
+        final = {}
+        tokens = []
+        upstream = generate(final.update)
+        try:
+            for token in upstream:
+                tokens.append(token)
+                yield token
+        finally:
+            # Stop the generation right away if our caller went away
+            upstream.close()
+        if final.get("done"):
+            self.put(key, ttl, "".join(tokens), final.get("context"))
+        if on_done is not None:
+            on_done(final.get("context"))
+
+    async def astream(self, key: str, ttl: float, generate: Callable[[Callable[[Dict], None]], AsyncIterator[str]],
+                      on_done: Optional[Callable[[Optional[List[int]]], None]] = None) -> AsyncIterator[str]:
+        """stream() for an async generate(on_final_chunk)"""
+        # Disk entries are read and written off the event loop
+        on_disk = self.mode == "disk"
+        entry = await asyncio.to_thread(self.get, key) if on_disk else self.get(key)
+        if entry is not None:
+            async for token in self._areplay(entry, on_done):
+                yield token
+            return
+
+        final = {}
+        tokens = []
+        upstream = generate(final.update)
+        try:
+            async for token in upstream:
+                tokens.append(token)
+                yield token
+        finally:
+            await upstream.aclose()
+        if final.get("done"):
+            if on_disk:
+                await asyncio.to_thread(self.put, key, ttl, "".join(tokens), final.get("context"))
+            else:
+                self.put(key, ttl, "".join(tokens), final.get("context"))
+        if on_done is not None:
+            on_done(final.get("context"))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self.mode == "disk":
+                for path, _, _ in self._disk_entries():
+                    _remove_file(path)
+                self._disk_bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "disk_bytes": self._disk_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "disk_max_bytes": self.disk_max_bytes if self.mode == "disk" else 0,
+            }
+
+    def _remember(self, key: str, entry: Dict):
+        """Put an entry in the memory tier, evicting least recently used ones (lock held)"""
+        size = _estimate_size(entry)
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (entry, size)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{ENTRY_SUFFIX}")
+
+    def _disk_entries(self):
+        """(path, size, last used) of every entry file"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith(ENTRY_SUFFIX) or ".tmp." in name:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _load(self, key: str) -> Optional[Dict]:
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if entry.get("expires_at", 0) <= time.time():
+            with self._lock:
+                self._disk_bytes -= _remove_file(path)
+            return entry
+        try:
+            # mtime doubles as the last-used time for disk eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def _store(self, key: str, entry: Dict):
+        path = self._path(key)
+        data = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        try:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            atomic_write(path, data)
+        except OSError as e:
+            print(f"Error writing response cache entry: {e}")
+            return
+        with self._lock:
+            self._disk_bytes += len(data.encode('utf-8')) - previous
+            if self._disk_bytes <= self.disk_max_bytes:
+                return
+            # Over the limit: recount and drop the least recently used entries
+            entries = sorted(self._disk_entries(), key=lambda e: e[2])
+            self._disk_bytes = sum(size for _, size, _ in entries)
+            for entry_path, _, _ in entries:
+                if self._disk_bytes <= self.disk_max_bytes:
+                    break
+                if entry_path == path:
+                    continue
+                self._disk_bytes -= _remove_file(entry_path)
+                self.evictions += 1
+
+
+def _estimate_size(entry: Dict) -> int:
+    # Context token IDs take roughly 8 bytes each in a Python list
+    return 256 + len(entry["response"]) + 8 * len(entry.get("context") or [])
+
+
+def _remove_file(path: str) -> int:
+    """Remove a file, returning the bytes freed"""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except OSError:
+        return 0
+
+
+# Shared instance used by the web server
+response_cache = ResponseCache()
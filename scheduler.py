@@ -0,0 +1,282 @@
+import asyncio
+import os
+import threading
+import time
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+
+# Generations run at once per model, and how many more requests may wait for one
+DEFAULT_MAX_CONCURRENT = int(os.environ.get("CHAT_MAX_CONCURRENT", "2"))
+DEFAULT_MAX_QUEUE = int(os.environ.get("CHAT_MAX_QUEUE", "16"))
+# Per-model overrides of the concurrency limit, e.g. "mistral=2,llama3.2:1b=4"
+DEFAULT_MODEL_CONCURRENCY = os.environ.get("CHAT_MODEL_CONCURRENCY", "")
+# Longest a request waits in the queue before giving up (seconds)
+DEFAULT_QUEUE_TIMEOUT = float(os.environ.get("CHAT_QUEUE_TIMEOUT", "120"))
+
+
+class SchedulerOverloaded(Exception):
+    """Raised when a model's queue is full; the request should be retried later"""
+    pass
+
+
+class QueueTimeout(Exception):
+    """Raised when a request waited longer than the queue timeout"""
+    pass
+
+
+class TicketReleased(Exception):
+    """Raised when waiting on a ticket that was released, e.g. because its client went away"""
+    pass
+
+
+def parse_model_limits(spec: str) -> Dict[str, int]:
+    """Parse "model=n,model=n" into a dict"""
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        model, _, limit = item.rpartition("=")
+        if not model:
+            raise ValueError(f"Invalid model concurrency setting: {item}")
+        limits[model.strip()] = int(limit)
+    return limits
+
+
+class _ModelQueue:
+    """Slots and waiting tickets of one model (all access under the scheduler's lock)"""
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.running = 0
+        self.reserved = 0
+        self.waiting: List["Ticket"] = []
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+
+    def order(self) -> List["Ticket"]:
+        # Round-robin across sessions, first come first served within a session
+        return sorted(self.waiting, key=lambda ticket: (ticket.round, ticket.seq))
+
+    def stats(self) -> Dict:
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "waiting": len(self.waiting),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_s": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+        }
+
+
+class Ticket:
+    """A request's reservation with the scheduler, from admission to release"""
+
+    def __init__(self, scheduler: "GenerationScheduler", model: str, session_key: str):
+        self.scheduler = scheduler
+        self.model = model
+        self.session_key = session_key
+        self.round = 0
+        self.seq = 0
+        self.running = False
+        self.released = False
+        self._wake: Optional[Callable[[], None]] = None
+
+    def _enqueue(self, queue: _ModelQueue):
+        scheduler = self.scheduler
+        with scheduler._cond:
+            self._check_released()
+            scheduler._seq += 1
+            self.seq = scheduler._seq
+            self.round = sum(1 for ticket in queue.waiting if ticket.session_key == self.session_key)
+            queue.waiting.append(self)
+
+    def _admit(self, queue: _ModelQueue, started: float) -> Optional[int]:
+        """Take a slot if it is our turn, else return the queue position (lock held)"""
+        # Released while waiting: a slot taken now would never be given back
+        self._check_released()
+        position = queue.order().index(self) + 1
+        if position == 1 and queue.running < queue.limit:
+            queue.waiting.remove(self)
+            queue.running += 1
+            queue.admitted += 1
+            queue.total_wait += time.monotonic() - started
+            self.running = True
+            # Whoever is next may be able to start too
+            self.scheduler._notify()
+            return None
+        return position
+
+    def _check_released(self):
+        if self.released:
+            raise TicketReleased(f"Request for {self.model} was cancelled")
+
+    def _leave(self, queue: _ModelQueue):
+        """Leave the queue after a timeout or when the waiter went away"""
+        if self.running:
+            return
+        with self.scheduler._cond:
+            if self in queue.waiting:
+                queue.waiting.remove(self)
+                self.scheduler._notify()
+
+    def _timed_out(self, queue: _ModelQueue, timeout: float) -> QueueTimeout:
+        queue.timed_out += 1
+        return QueueTimeout(f"Timed out waiting for {self.model} after {round(timeout, 1):g}s")
+
+    def wait(self, timeout: Optional[float] = None, tick: Optional[float] = None) -> Iterator[int]:
+        """Wait for a generation slot, yielding the queue position (1 = next) whenever it changes
+
+        With tick, the position is also yielded again after tick seconds without
+        a change. Returns once the slot is held; raises QueueTimeout after timeout
+        seconds, and TicketReleased if the ticket is (or gets) released. Nothing is
+        yielded when a slot is free straight away.
+        """
+        scheduler = self.scheduler
+        queue = scheduler._queue(self.model)
+        timeout = scheduler.queue_timeout if timeout is None else timeout
+        started = time.monotonic()
+        self._enqueue(queue)
+
+        last_position = None
+        try:
+            while True:
+                ticked_at = time.monotonic()
+                with scheduler._cond:
+                    while True:
+                        position = self._admit(queue, started)
+                        if position is None:
+                            return
+                        if position != last_position:
+                            break
+                        now = time.monotonic()
+                        remaining = started + timeout - now
+                        if remaining <= 0:
+                            raise self._timed_out(queue, timeout)
+                        if tick is not None:
+                            if now - ticked_at >= tick:
+                                break
+                            remaining = min(remaining, ticked_at + tick - now)
+                        scheduler._cond.wait(remaining)
+                last_position = position
+                yield position
+        finally:
+            self._leave(queue)
+
+    async def wait_async(self, timeout: Optional[float] = None, tick: Optional[float] = None) -> AsyncIterator[int]:
+        """wait() for asyncio callers: yields the same positions without blocking the event loop"""
+        scheduler = self.scheduler
+        queue = scheduler._queue(self.model)
+        timeout = scheduler.queue_timeout if timeout is None else timeout
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        # Called by _notify(), possibly from another thread
+        self._wake = lambda: loop.call_soon_threadsafe(changed.set)
+        self._enqueue(queue)
+
+        last_position = None
+        ticked_at = started
+        try:
+            while True:
+                changed.clear()
+                with scheduler._cond:
+                    position = self._admit(queue, started)
+                    if position is None:
+                        return
+                    now = time.monotonic()
+                    remaining = started + timeout - now
+                    if remaining <= 0:
+                        raise self._timed_out(queue, timeout)
+                if position != last_position or (tick is not None and now - ticked_at >= tick):
+                    last_position = position
+                    ticked_at = now
+                    yield position
+                    continue
+                if tick is not None:
+                    remaining = min(remaining, ticked_at + tick - now)
+                try:
+                    await asyncio.wait_for(changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._wake = None
+            self._leave(queue)
+
+    def release(self):
+        """Give back the slot and reservation (safe to call more than once)"""
+        scheduler = self.scheduler
+        with scheduler._cond:
+            if self.released:
+                return
+            self.released = True
+            queue = scheduler._queue(self.model)
+            if self.running:
+                queue.running -= 1
+                self.running = False
+            if self in queue.waiting:
+                queue.waiting.remove(self)
+                # _notify() only wakes tickets still waiting, so wake this one's waiter here
+                if self._wake is not None:
+                    self._wake()
+            queue.reserved -= 1
+            scheduler._notify()
+
+
+class GenerationScheduler:
+    """Admission control for model generations
+
+    Each model has `limit` generation slots and room for max_queue more requests.
+    reserve() is called when a request arrives and raises SchedulerOverloaded when
+    there is no room, so overload is refused straight away instead of timing out.
+    Reserved requests call Ticket.wait(), or wait_async() from asyncio code, once
+    their prompt is ready; waiting requests are served first come first served,
+    except that a session with several queued requests only gets one turn per round.
+    """
+
+    def __init__(self, max_concurrent: int = DEFAULT_MAX_CONCURRENT, max_queue: int = DEFAULT_MAX_QUEUE,
+                 model_limits: Optional[Dict[str, int]] = None, queue_timeout: float = DEFAULT_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.model_limits = model_limits if model_limits is not None else parse_model_limits(DEFAULT_MODEL_CONCURRENCY)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._queues: Dict[str, _ModelQueue] = {}
+        self._seq = 0
+
+    def _notify(self):
+        """Wake every waiter, threads and asyncio tasks alike (lock held)"""
+        self._cond.notify_all()
+        for queue in self._queues.values():
+            for ticket in queue.waiting:
+                if ticket._wake is not None:
+                    ticket._wake()
+
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self._queues.get(model)
+        if queue is None:
+            limit = self.model_limits.get(model, self.max_concurrent)
+            queue = self._queues[model] = _ModelQueue(max(limit, 1), self.max_queue)
+        return queue
+
+    def reserve(self, model: str, session_key: str) -> Ticket:
+        """Reserve room for a generation, raising SchedulerOverloaded if the model is saturated"""
+        with self._cond:
+            queue = self._queue(model)
+            if queue.reserved >= queue.limit + queue.max_queue:
+                queue.rejected += 1
+                raise SchedulerOverloaded(f"Too many requests for {model}, try again shortly")
+            queue.reserved += 1
+        return Ticket(self, model, session_key)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {model: queue.stats() for model, queue in self._queues.items()}
+
+
+# Shared instance used by the web server
+scheduler = GenerationScheduler()
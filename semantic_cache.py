@@ -0,0 +1,246 @@
+import hashlib
+import math
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from agents.ollama_client import ollama_client, OllamaError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Opt-in: answer paraphrases of recent questions from cache
+DEFAULT_ENABLED = os.environ.get("CHAT_SEMANTIC_CACHE", "0").lower() in ("1", "true", "yes")
+DEFAULT_EMBED_MODEL = os.environ.get("CHAT_SEMANTIC_CACHE_MODEL", "nomic-embed-text")
+# Cosine similarity a question needs to reuse a cached answer
+DEFAULT_THRESHOLD = float(os.environ.get("CHAT_SEMANTIC_CACHE_THRESHOLD", "0.92"))
+# Capacity is per agent; entries also expire after the agent's TTL or max_age, whichever is sooner
+DEFAULT_MAX_ENTRIES = int(os.environ.get("CHAT_SEMANTIC_CACHE_ENTRIES", "256"))
+DEFAULT_MAX_AGE = float(os.environ.get("CHAT_SEMANTIC_CACHE_MAX_AGE", "3600"))
+# Fraction of hits regenerated anyway to check the cached answer still fits
+DEFAULT_AUDIT_RATE = float(os.environ.get("CHAT_SEMANTIC_CACHE_AUDIT_RATE", "0.05"))
+# Audited answers less similar than this to the fresh one count as false hits
+DEFAULT_AUDIT_THRESHOLD = float(os.environ.get("CHAT_SEMANTIC_CACHE_AUDIT_THRESHOLD", "0.8"))
+
+
+def _normalize(vector: List[float]):
+    if numpy is not None:
+        array = numpy.asarray(vector, dtype=numpy.float32)
+        norm = float(numpy.linalg.norm(array))
+        return array / norm if norm else array
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else list(vector)
+
+
+def _dot(a, b) -> float:
+    if numpy is not None:
+        return float(numpy.dot(a, b))
+    return sum(x * y for x, y in zip(a, b))
+
+
+class _AgentIndex:
+    """Fixed-capacity matrix of one agent's normalized question vectors
+
+    Rows are slots; a slot is free when its entry is None. With NumPy a lookup is
+    one matrix-vector product over all slots, otherwise a loop over used ones.
+    """
+
+    def __init__(self, capacity: int, dim: int):
+        self.capacity = capacity
+        self.dim = dim
+        self.entries: List[Optional[Dict]] = [None] * capacity
+        if numpy is not None:
+            self.matrix = numpy.zeros((capacity, dim), dtype=numpy.float32)
+        else:
+            self.matrix = [None] * capacity
+
+    def __len__(self):
+        return sum(1 for entry in self.entries if entry is not None)
+
+    def best(self, vector, group: str, now: float) -> Optional[tuple]:
+        """(similarity, slot) of the most similar live entry in group"""
+        slots = [i for i, entry in enumerate(self.entries)
+                 if entry is not None and entry["group"] == group and entry["expires_at"] > now]
+        if not slots:
+            return None
+        if numpy is not None:
+            similarities = self.matrix[slots] @ vector
+            best = int(numpy.argmax(similarities))
+            return float(similarities[best]), slots[best]
+        return max((_dot(self.matrix[slot], vector), slot) for slot in slots)
+
+    def put(self, vector, entry: Dict, now: float) -> int:
+        """Store an entry, returning how many were evicted to make room"""
+        evicted = 0
+        for slot, existing in enumerate(self.entries):
+            if existing is not None and existing["expires_at"] <= now:
+                self.entries[slot] = None
+                evicted += 1
+        free = next((slot for slot, existing in enumerate(self.entries) if existing is None), None)
+        if free is None:
+            # Full of live entries: replace the oldest
+            free = min(range(self.capacity), key=lambda slot: self.entries[slot]["created_at"])
+            evicted += 1
+        self.entries[free] = entry
+        self.matrix[free] = vector
+        return evicted
+
+    def remove(self, slot: int):
+        self.entries[slot] = None
+
+
+class SemanticCache:
+    """Answers reused across paraphrased questions, matched by embedding similarity
+
+    Questions are embedded with Ollama's embeddings endpoint. Entries are kept per
+    agent and only match questions asked of the same model with the same system
+    prompt. A sample of hits (audit_rate) is regenerated anyway: if the fresh
+    answer differs too much from the cached one, the hit is counted as false and
+    the entry replaced, which keeps the false-hit rate visible in stats().
+    """
+
+    def __init__(self, enabled: bool = DEFAULT_ENABLED, embed_model: str = DEFAULT_EMBED_MODEL,
+                 threshold: float = DEFAULT_THRESHOLD, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_age: float = DEFAULT_MAX_AGE, audit_rate: float = DEFAULT_AUDIT_RATE,
+                 audit_threshold: float = DEFAULT_AUDIT_THRESHOLD, client=None):
+        self.enabled = enabled and max_entries > 0
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.audit_rate = audit_rate
+        self.audit_threshold = audit_threshold
+        self.client = client or ollama_client
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, _AgentIndex] = {}
+        self._random = random.Random()
+        self.lookups = 0
+        self.hits = 0
+        self.audits = 0
+        self.false_hits = 0
+        self.evictions = 0
+        self.embed_errors = 0
+
+    def _embed(self, text: str):
+        try:
+            return _normalize(self.client.embed(self.embed_model, text))
+        except OllamaError as e:
+            with self._lock:
+                self.embed_errors += 1
+            print(f"Error embedding question for semantic cache: {e}")
+            return None
+
+    @staticmethod
+    def _group(model: str, system_prompt: Optional[str]) -> str:
+        return f"{model}\0{hashlib.sha256((system_prompt or '').encode('utf-8')).hexdigest()}"
+
+    def lookup(self, agent_name: str, model: str, system_prompt: Optional[str], question: str) -> Optional[Dict]:
+        """Closest cached answer to a question, or None if the question couldn't be embedded
+
+        question is whatever the caller matches on: the user's question, or the
+        prompt prepared from it when the data fetched depends on the question.
+
+        Returns {"response", "similarity", "audit", ...}, with "response" None when
+        nothing is similar enough. When "audit" is True the caller should generate
+        a fresh answer anyway. Either way pass the result to add() along with the
+        generated answer, so the question isn't embedded twice.
+        """
+        vector = self._embed(question)
+        if vector is None:
+            return None
+        now = time.time()
+        with self._lock:
+            self.lookups += 1
+            index = self._indexes.get(agent_name)
+            best = None
+            if index is not None and index.dim == len(vector):
+                best = index.best(vector, self._group(model, system_prompt), now)
+            if best is None or best[0] < self.threshold:
+                return {"response": None, "vector": vector}
+            similarity, slot = best
+            self.hits += 1
+            entry = index.entries[slot]
+            entry["hits"] += 1
+            audit = self._random.random() < self.audit_rate
+            return {"response": entry["response"], "similarity": similarity, "question": entry["question"],
+                    "slot": slot, "audit": audit, "vector": vector}
+
+    def add(self, agent_name: str, model: str, system_prompt: Optional[str], question: str,
+            response: str, ttl: float, looked_up: Optional[Dict] = None):
+        """Cache an answer; looked_up is the lookup() result that led to generating it"""
+        if not self.enabled or ttl <= 0 or not response or response.startswith("Error:"):
+            return
+        if looked_up is not None and looked_up.get("audit"):
+            self._audit(agent_name, looked_up, response)
+        vector = looked_up.get("vector") if looked_up is not None else None
+        if vector is None:
+            vector = self._embed(question)
+            if vector is None:
+                return
+
+        now = time.time()
+        entry = {
+            "group": self._group(model, system_prompt),
+            "question": question,
+            "response": response,
+            "created_at": now,
+            "expires_at": now + min(ttl, self.max_age),
+            "hits": 0,
+        }
+        with self._lock:
+            index = self._indexes.get(agent_name)
+            if index is None or index.dim != len(vector):
+                # First entry, or the embedding model changed: start over
+                index = self._indexes[agent_name] = _AgentIndex(self.max_entries, len(vector))
+            self.evictions += index.put(vector, entry, now)
+
+    def _audit(self, agent_name: str, looked_up: Dict, response: str):
+        cached = self._embed(looked_up["response"])
+        fresh = self._embed(response)
+        if cached is None or fresh is None:
+            return
+        false_hit = _dot(cached, fresh) < self.audit_threshold
+        with self._lock:
+            self.audits += 1
+            if false_hit:
+                self.false_hits += 1
+            # The fresh answer replaces the audited one
+            index = self._indexes.get(agent_name)
+            entry = index.entries[looked_up["slot"]] if index is not None else None
+            if entry is not None and entry["response"] == looked_up["response"]:
+                index.remove(looked_up["slot"])
+        if false_hit:
+            print(f"Semantic cache false hit for {agent_name}: {looked_up['question']!r} "
+                  f"(similarity {looked_up['similarity']:.3f})")
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "embed_model": self.embed_model,
+                "threshold": self.threshold,
+                "vectorized": numpy is not None,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "audits": self.audits,
+                "false_hits": self.false_hits,
+                "false_hit_rate": round(self.false_hits / self.audits, 4) if self.audits else 0.0,
+                "evictions": self.evictions,
+                "embed_errors": self.embed_errors,
+                "entries": {agent: len(index) for agent, index in self._indexes.items()},
+                "max_entries": self.max_entries,
+            }
+
+
+# Shared instance used by the web server
+semantic_cache = SemanticCache()
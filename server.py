@@ -1,37 +1,46 @@
+import os
 import subprocess
-import socket
 import time
-import json
-import requests
-from threading import Thread
+from threading import Thread, Lock
 from flask import Flask, request, Response, jsonify
 from flask_cors import CORS
 from chat_storage import chat_storage
+from response_cache import response_cache, replay_tokens
+from semantic_cache import semantic_cache
+from scheduler import scheduler, SchedulerOverloaded
+from single_flight import single_flight
+from sse import StreamOptions, frame_events, MIMETYPE as SSE_MIMETYPE, HEADERS as SSE_HEADERS
 
 # Import all agents
 from agents import (
     WeatherAgent, NewsAgent, TodoAgent, StockAgent, 
     QuizAgent, WritingFeedbackAgent, JokeAgent, BasicAgent
 )
+from agents.ollama_client import ollama_client
+from agents.context import RequestContext
 
 app = Flask(__name__)
 CORS(app)
 
-def is_port_open(host, port):
-    """Check if a port is open on localhost"""
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        return s.connect_ex((host, port)) == 0
+# Longest a request may spend fetching agent data and queueing before its answer starts (seconds)
+REQUEST_DEADLINE = float(os.environ.get("CHAT_REQUEST_DEADLINE", "120"))
 
+EXPORT_MIMETYPES = {"json": "application/json", "txt": "text/plain"}
+
+# Streams ended early by the client (Stop button, closed tab)
+stream_stats = {"disconnects": 0, "truncated_responses": 0}
+stream_stats_lock = Lock()
+ARCHIVE_MIMETYPES = {"jsonl": "application/x-ndjson", "tar": "application/x-tar"}
 
 def start_ollama_server():
     """Start Ollama server if not running"""
-    if not is_port_open("localhost", 11434):
+    if not ollama_client.is_running():
         print("Starting Ollama server...")
         subprocess.Popen(["ollama", "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         
         # Wait for Ollama to be ready
         for _ in range(10):
-            if is_port_open("localhost", 11434):
+            if ollama_client.is_running():
                 print("Ollama server started.")
                 return
             time.sleep(1)
@@ -57,13 +66,7 @@ agents_registry = {
 def get_models():
     """Get available Ollama models"""
     try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=10)
-        if response.status_code == 200:
-            models_data = response.json()
-            models = [model["name"] for model in models_data.get("models", [])]
-            return {"models": models}
-        else:
-            return {"models": ["mistral"]}, 500
+        return {"models": ollama_client.list_models()}
     except Exception as e:
         print(f"Error fetching models: {e}")
         return {"models": ["mistral"]}, 500
@@ -77,23 +80,30 @@ def handle_agent():
     message = data.get("message")
     model = data.get("model", "mistral")  # Default to mistral if no model specified
     session_id = data.get("session_id")  # Optional session ID
+    try:
+        # Optional {"flush_ms", "flush_bytes", "heartbeat_s"} framing overrides
+        options = StreamOptions.from_request(data.get("stream_options"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     agent = agents_registry.get(agent_name)
     if not agent:
         def error_generator():
-            yield f"data: {json.dumps({'token': 'Unknown agent.', 'done': True})}\n\n"
-        return Response(error_generator(), mimetype='text/plain')
+            yield {'token': 'Unknown agent.', 'done': True}
+        return Response(frame_events(error_generator(), options), mimetype=SSE_MIMETYPE, headers=SSE_HEADERS)
 
-    # Update agent model if different from current
-    if hasattr(agent, 'model') and agent.model != model:
-        agent.model = model
+    # Refuse straight away when this model's queue is full, before storing anything
+    try:
+        ticket = scheduler.reserve(model, session_id or request.remote_addr or "")
+    except SchedulerOverloaded as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": "5"}
 
     # Create new session if not provided
     if not session_id:
         session_id = chat_storage.create_chat_session(agent_name, model)
     
-    # Set session ID for the agent
-    agent.set_session_id(session_id)
+    # Agents are shared between requests; everything about this one goes in its context
+    ctx = RequestContext(model, session_id, timeout=REQUEST_DEADLINE)
     
     # Store user message
     chat_storage.add_message(session_id, "user", message)
@@ -101,64 +111,92 @@ def handle_agent():
     def generate():
         """Generate streaming response with loading status updates"""
         full_response = ""
+        stream = None
         try:
             # Custom generator that yields loading messages and tokens
             def agent_stream_with_status():
                 # Initial loading message
-                loading_message = getattr(agent, '_loading_message', 'Thinking...')
+                loading_message = ctx.loading_message
                 yield {'status': 'loading', 'message': loading_message}
                 
                 # Get system prompt (usually quick)
-                system_prompt = agent.get_system_prompt()
+                system_prompt = agent.get_system_prompt(ctx)
                 
                 # Check if loading message changed
-                current_loading_message = getattr(agent, '_loading_message', 'Thinking...')
+                current_loading_message = ctx.loading_message
                 if current_loading_message != loading_message:
                     yield {'status': 'loading', 'message': current_loading_message}
                     loading_message = current_loading_message
                 
+                # Paraphrases of a recently answered opening question are answered from the
+                # semantic cache, before prompt preparation when the agent allows it
+                opening = False
+                if semantic_cache.enabled and agent.response_cache_ttl > 0:
+                    summary = chat_storage.get_session_summary(session_id)
+                    # No summary: a stale or deleted session, so just generate
+                    opening = summary is not None and summary["message_count"] == 1
+                looked_up = None
+                cached_text = None
+                if opening and agent.semantic_cache_before_prepare:
+                    cached_text = message
+                    looked_up = semantic_cache.lookup(agent_name, model, system_prompt, cached_text)
+                    if semantic_hit(looked_up):
+                        ticket.release()
+                        yield from replay_events(looked_up["response"])
+                        return
+                
                 # Prepare prompt (this is where agents do their background work)
-                prompt = agent.prepare_prompt(message)
+                prompt = agent.prepare_prompt(message, ctx)
                 
                 # Check if loading message changed again
-                current_loading_message = getattr(agent, '_loading_message', 'Thinking...')
+                current_loading_message = ctx.loading_message
                 if current_loading_message != loading_message:
                     yield {'status': 'loading', 'message': current_loading_message}
                     loading_message = current_loading_message
                 
-                # Now stream the actual response
-                payload = {
-                    "model": agent.model,
-                    "system": system_prompt,
-                    "prompt": prompt,
-                    "stream": True
-                }
+                # The fetched data depends on the question: match on the prompt it went into
+                if opening and not agent.semantic_cache_before_prepare:
+                    cached_text = prompt
+                    looked_up = semantic_cache.lookup(agent_name, model, system_prompt, cached_text)
+                    if semantic_hit(looked_up):
+                        ticket.release()
+                        yield from replay_events(looked_up["response"])
+                        return
                 
-                response = requests.post("http://localhost:11434/api/generate", json=payload, stream=True)
-                first_token = True
+                generation = agent.plan_generation(prompt, system_prompt, ctx)
+                # A cached answer, or an identical generation already running, needs no slot
+                # of its own; the reservation is only given back once the reply is in hand
+                reply = generation.cached(response_cache)
+                if reply is None:
+                    reply = generation.join(single_flight)
+                if reply is not None:
+                    ticket.release()
+                else:
+                    # Wait for a generation slot for this model
+                    queued = False
+                    for position in ticket.wait(timeout=ctx.timeout(scheduler.queue_timeout)):
+                        queued = True
+                        yield {'status': 'queued', 'position': position,
+                               'message': f"Waiting for {model} (position {position} in queue)..."}
+                    if queued:
+                        yield {'status': 'loading', 'message': loading_message}
                 
-                for line in response.iter_lines():
-                    if line:
-                        try:
-                            json_response = json.loads(line.decode('utf-8'))
-                            if 'response' in json_response:
-                                token = json_response['response']
-                                if first_token:
-                                    token = token.lstrip()
-                                    first_token = False
-                                yield {'token': token, 'done': False}
-                            if json_response.get('done', False):
-                                yield {'token': '', 'done': True}
-                                break
-                        except json.JSONDecodeError:
-                            continue
+                # Now stream the actual response
+                tokens = []
+                if reply is None:
+                    reply = generation.stream(response_cache, single_flight)
+                for token in reply:
+                    tokens.append(token)
+                    yield {'token': token, 'done': False}
+                if looked_up is not None:
+                    semantic_cache.add(agent_name, model, system_prompt, cached_text, "".join(tokens),
+                                       agent.response_cache_ttl, looked_up)
+                yield {'token': '', 'done': True}
             
             # Process the generator and send appropriate responses
-            for item in agent_stream_with_status():
-                if 'status' in item:
-                    # This is a loading message
-                    yield f"data: {json.dumps(item)}\n\n"
-                elif 'token' in item:
+            stream = agent_stream_with_status()
+            for item in stream:
+                if 'token' in item:
                     # This is a token from the AI
                     full_response += item['token']
                     if item.get('done', False):
@@ -166,21 +204,71 @@ def handle_agent():
                         item['session_id'] = session_id
                         # Store bot response when done
                         chat_storage.add_message(session_id, "bot", full_response)
-                    yield f"data: {json.dumps(item)}\n\n"
+                # Loading/queue status and tokens are framed by frame_events
+                yield item
                     
+        except GeneratorExit:
+            # The client went away: stop the upstream generation now rather than at "done"
+            if stream is not None:
+                stream.close()
+            with stream_stats_lock:
+                stream_stats["disconnects"] += 1
+                if full_response:
+                    stream_stats["truncated_responses"] += 1
+            if full_response:
+                chat_storage.add_message(session_id, "bot", full_response, truncated=True)
+            raise
         except Exception as e:
             error_msg = f"Error: {str(e)}"
-            yield f"data: {json.dumps({'token': error_msg, 'done': True})}\n\n"
+            yield {'token': error_msg, 'done': True}
+        finally:
+            ticket.release()
+
+    response = Response(frame_events(generate(), options), mimetype=SSE_MIMETYPE, headers=SSE_HEADERS)
+    # Also covers a client that disconnects before the stream starts
+    response.call_on_close(ticket.release)
+    # The events are read on a thread of their own that may be blocked on Ollama:
+    # cut its stream off now instead of when the next token arrives
+    response.call_on_close(ctx.cancel)
+    return response
+
+
+def semantic_hit(looked_up) -> bool:
+    """Whether a semantic cache lookup found an answer to replay (audited hits are generated anyway)"""
+    return looked_up is not None and looked_up["response"] is not None and not looked_up["audit"]
 
-    return Response(generate(), mimetype='text/plain')
+
+def replay_events(response: str):
+    """Token events streaming a cached answer"""
+    for token in replay_tokens(response):
+        yield {'token': token, 'done': False}
+    yield {'token': '', 'done': True}
+
+
+def get_page_args():
+    """Read limit/cursor/before/after pagination query parameters"""
+    limit = request.args.get('limit')
+    if limit is not None:
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError("limit must be a positive integer")
+    return {
+        "limit": limit,
+        "cursor": request.args.get('cursor'),
+        "before": request.args.get('before'),
+        "after": request.args.get('after'),
+    }
 
 
 @app.route("/api/chat/sessions", methods=["GET"])
 def get_chat_sessions():
-    """Get list of all chat sessions"""
+    """Get list of chat sessions, optionally paginated"""
     agent_name = request.args.get('agent')
-    sessions = chat_storage.list_chat_sessions(agent_name)
-    return jsonify({"sessions": sessions})
+    try:
+        page = chat_storage.list_chat_sessions_page(agent_name, **get_page_args())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(page)
 
 
 @app.route("/api/chat/session/<session_id>", methods=["GET"])
@@ -205,9 +293,87 @@ def delete_chat_session(session_id):
 
 @app.route("/api/chat/session/<session_id>/history", methods=["GET"])
 def get_chat_history(session_id):
-    """Get chat history for a specific session"""
-    history = chat_storage.get_chat_history(session_id)
-    return jsonify({"history": history})
+    """Get chat history for a specific session, optionally paginated
+
+    ?tail=N returns the last N messages and ?start=&end= a range of message
+    indexes; both respond with the index of the first message and the total count.
+    """
+    try:
+        if any(key in request.args for key in ('tail', 'start', 'end')):
+            tail = request.args.get('tail')
+            start = request.args.get('start', 0)
+            end = request.args.get('end')
+            page = chat_storage.get_chat_history_range(
+                session_id,
+                int(start),
+                int(end) if end is not None else None,
+                int(tail) if tail is not None else None
+            )
+        else:
+            page = chat_storage.get_chat_history_page(session_id, **get_page_args())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(page)
+
+
+@app.route("/api/chat/cache/stats", methods=["GET"])
+def get_chat_cache_stats():
+    """Get hit/miss counters of the loaded-session cache"""
+    return jsonify(chat_storage.cache_stats())
+
+
+@app.route("/api/chat/storage/stats", methods=["GET"])
+def get_chat_storage_stats():
+    """Get queue depth and flush counters of the write-behind writer"""
+    return jsonify(chat_storage.writer_stats())
+
+
+@app.route("/api/response-cache/stats", methods=["GET"])
+def get_response_cache_stats():
+    """Get hit/miss counters of the agent response cache"""
+    return jsonify(response_cache.stats())
+
+
+@app.route("/api/semantic-cache/stats", methods=["GET"])
+def get_semantic_cache_stats():
+    """Get hit rate and false-hit audit counters of the semantic cache"""
+    return jsonify(semantic_cache.stats())
+
+
+@app.route("/api/scheduler/stats", methods=["GET"])
+def get_scheduler_stats():
+    """Get running/waiting counts and admission counters per model"""
+    return jsonify(scheduler.stats())
+
+
+@app.route("/api/coalescing/stats", methods=["GET"])
+def get_coalescing_stats():
+    """Get counts of shared (single-flight) generations"""
+    return jsonify(single_flight.stats())
+
+
+@app.route("/api/backends/stats", methods=["GET"])
+def get_backend_stats():
+    """Get health, load and session affinity of the Ollama backends"""
+    return jsonify(ollama_client.pool.stats())
+
+
+@app.route("/api/metrics", methods=["GET"])
+def get_metrics():
+    """Get generation, cancellation, queueing and cache counters in one document"""
+    with stream_stats_lock:
+        streams = dict(stream_stats)
+    return jsonify({
+        "streams": streams,
+        "generations": ollama_client.stats(),
+        "backends": ollama_client.pool.stats(),
+        "scheduler": scheduler.stats(),
+        "coalescing": single_flight.stats(),
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "chat_cache": chat_storage.cache_stats(),
+        "chat_storage": chat_storage.writer_stats(),
+    })
 
 
 @app.route("/api/chat/search", methods=["GET"])
@@ -225,19 +391,35 @@ def search_chats():
 
 @app.route("/api/chat/session/<session_id>/export", methods=["GET"])
 def export_chat_session(session_id):
-    """Export a chat session"""
-    format_type = request.args.get('format', 'json')
-    exported_data = chat_storage.export_chat_session(session_id, format_type)
+    """Export a chat session as a chunked stream"""
+    format_type = request.args.get('format', 'json').lower()
+    if format_type not in EXPORT_MIMETYPES:
+        return jsonify({"error": "Unsupported format"}), 400
     
-    if exported_data:
-        if format_type.lower() == 'json':
-            return Response(exported_data, mimetype='application/json')
-        elif format_type.lower() == 'txt':
-            return Response(exported_data, mimetype='text/plain')
-        else:
-            return jsonify({"error": "Unsupported format"}), 400
-    else:
+    chunks = chat_storage.iter_export_chat_session(session_id, format_type)
+    if chunks is None:
         return jsonify({"error": "Session not found"}), 404
+    return Response(chunks, mimetype=EXPORT_MIMETYPES[format_type])
+
+
+@app.route("/api/chat/export", methods=["GET"])
+def export_chat_archive():
+    """Stream an archive of many chat sessions, filterable by agent and date"""
+    format_type = request.args.get('format', 'jsonl').lower()
+    if format_type not in ARCHIVE_MIMETYPES:
+        return jsonify({"error": "Unsupported format"}), 400
+    
+    chunks = chat_storage.iter_export_archive(
+        format_type,
+        agent_name=request.args.get('agent'),
+        since=request.args.get('since'),
+        until=request.args.get('until'),
+    )
+    return Response(
+        chunks,
+        mimetype=ARCHIVE_MIMETYPES[format_type],
+        headers={"Content-Disposition": f"attachment; filename=chat_history.{format_type}"},
+    )
 
 
 if __name__ == "__main__":
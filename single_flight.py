@@ -0,0 +1,305 @@
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+
+class _Flight:
+    """One upstream generation shared by every request that subscribed to it
+
+    There is no pump thread: the subscriber that runs out of buffered tokens pulls
+    the next one from upstream while the others wait, so the generation keeps
+    going as long as anyone is reading and stops when the last subscriber leaves.
+    """
+
+    def __init__(self, key: str, upstream: Callable[[Callable, Callable], Iterator[str]]):
+        self.key = key
+        self.tokens: List[str] = []
+        self.context = None
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        # Subscribers whose requests haven't been cancelled, and the upstream's abort callbacks
+        self.wanted = 0
+        self.abandoned = False
+        self.aborts: List[Callable[[], None]] = []
+        self.pumping = False
+        self._upstream_factory = upstream
+        self._upstream = None
+        # Async flights only: the running pull task, and an event set after each pull
+        self.pull: Optional[asyncio.Future] = None
+        self.changed: Optional[asyncio.Event] = None
+
+    def _set_context(self, context):
+        self.context = context
+
+    def _on_cancel(self, abort: Callable[[], None]) -> Callable[[], None]:
+        """Register how to cut the upstream off once every subscriber's request is cancelled"""
+        if self.abandoned:
+            abort()
+            return lambda: None
+        self.aborts.append(abort)
+
+        def unregister():
+            if abort in self.aborts:
+                self.aborts.remove(abort)
+        return unregister
+
+
+class SingleFlight:
+    """Coalesces identical generations that are in progress at the same time
+
+    The first request for a key starts the upstream generation; requests for the
+    same key arriving while it runs attach to it and receive every token from
+    the beginning. Each subscriber's on_done still gets the final context.
+    upstream(on_context, on_cancel) may register an abort callback with
+    on_cancel; it runs once the on_cancel hooks of every subscriber (e.g.
+    RequestContext.on_cancel) have fired, even while a read is blocked.
+    astream() does the same for async upstreams, whose subscribers share one
+    event loop.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._flights: Dict[str, _Flight] = {}
+        self._async_flights: Dict[str, _Flight] = {}
+        self.started = 0
+        self.joined = 0
+        self.cancelled = 0
+
+    def in_flight(self, key: str) -> bool:
+        with self._cond:
+            return key in self._flights or key in self._async_flights
+
+    def join(self, key: str, on_done: Optional[Callable] = None,
+             on_cancel: Optional[Callable] = None) -> Optional[Iterator[str]]:
+        """Tokens of the generation for key if one is in flight, else None (nothing is started)
+
+        Checking and attaching happen under one lock, so a joined generation can't
+        end before its new subscriber is counted.
+        """
+        with self._cond:
+            flight = self._flights.get(key)
+            if flight is None:
+                return None
+            self.joined += 1
+            flight.subscribers += 1
+            flight.wanted += 1
+        return self._subscribe(flight, on_done, self._watch(flight, on_cancel))
+
+    def stream(self, key: str, upstream: Callable[[Callable, Callable], Iterator[str]],
+               on_done: Optional[Callable] = None, on_cancel: Optional[Callable] = None) -> Iterator[str]:
+        """Tokens of the generation for key, starting upstream(on_context, on_cancel) if none is in flight"""
+        with self._cond:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight(key, upstream)
+                self.started += 1
+            else:
+                self.joined += 1
+            flight.subscribers += 1
+            flight.wanted += 1
+        return self._subscribe(flight, on_done, self._watch(flight, on_cancel))
+
+    def _watch(self, flight: _Flight, on_cancel: Optional[Callable]) -> Callable[[], None]:
+        """Count a subscriber as wanting the flight until its request is cancelled
+
+        Returns the function to call when the subscriber leaves.
+        """
+        gone = []
+
+        def leave(cancelled: bool):
+            with self._cond:
+                if gone:
+                    return
+                gone.append(True)
+                flight.wanted -= 1
+                if not cancelled or flight.wanted > 0 or flight.done:
+                    return
+                flight.abandoned = True
+                aborts = list(flight.aborts)
+            for abort in aborts:
+                abort()
+
+        unregister = on_cancel(lambda: leave(True)) if on_cancel is not None else None
+
+        def finish():
+            if unregister is not None:
+                unregister()
+            leave(False)
+        return finish
+
+    def _subscribe(self, flight: _Flight, on_done: Optional[Callable],
+                   finish: Optional[Callable] = None) -> Iterator[str]:
+        position = 0
+        completed = False
+        try:
+            while True:
+                pull = False
+                with self._cond:
+                    while position >= len(flight.tokens) and not flight.done and flight.pumping:
+                        self._cond.wait()
+                    if position < len(flight.tokens):
+                        token = flight.tokens[position]
+                        position += 1
+                    elif flight.done:
+                        if flight.error is not None:
+                            raise flight.error
+                        completed = True
+                        break
+                    else:
+                        flight.pumping = True
+                        pull = True
+                if pull:
+                    self._pull(flight)
+                    continue
+                yield token
+        finally:
+            if finish is not None:
+                finish()
+            self._unsubscribe(flight)
+        if completed and on_done is not None:
+            on_done(flight.context)
+
+    def _pull(self, flight: _Flight):
+        """Fetch the next upstream token into the flight's buffer (called with pumping set)"""
+        token = None
+        finished = False
+        error = None
+        try:
+            if flight._upstream is None:
+                flight._upstream = flight._upstream_factory(flight._set_context, flight._on_cancel)
+            token = next(flight._upstream)
+        except StopIteration:
+            finished = True
+        except Exception as e:
+            finished = True
+            error = e
+        with self._cond:
+            if token is not None:
+                flight.tokens.append(token)
+            if finished:
+                flight.done = True
+                flight.error = error
+                # Later identical requests start a fresh generation
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+            flight.pumping = False
+            self._cond.notify_all()
+
+    def _unsubscribe(self, flight: _Flight):
+        with self._cond:
+            flight.subscribers -= 1
+            if flight.subscribers > 0 or flight.done:
+                return
+            # Nobody is reading any more: stop the generation
+            flight.done = True
+            self.cancelled += 1
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            upstream = flight._upstream
+        if upstream is not None and hasattr(upstream, "close"):
+            upstream.close()
+
+    def astream(self, key: str, upstream: Callable[[Callable, Callable], AsyncIterator[str]],
+                on_done: Optional[Callable] = None) -> AsyncIterator[str]:
+        """stream() for an async upstream(on_context)"""
+        with self._cond:
+            flight = self._async_flights.get(key)
+            if flight is None:
+                flight = self._async_flights[key] = _Flight(key, upstream)
+                flight.changed = asyncio.Event()
+                self.started += 1
+            else:
+                self.joined += 1
+            flight.subscribers += 1
+        return self._asubscribe(flight, on_done)
+
+    def ajoin(self, key: str, on_done: Optional[Callable] = None) -> Optional[AsyncIterator[str]]:
+        """join() for async flights"""
+        with self._cond:
+            flight = self._async_flights.get(key)
+            if flight is None:
+                return None
+            self.joined += 1
+            flight.subscribers += 1
+        return self._asubscribe(flight, on_done)
+
+    async def _asubscribe(self, flight: _Flight, on_done: Optional[Callable]) -> AsyncIterator[str]:
+        position = 0
+        completed = False
+        try:
+            while True:
+                if position < len(flight.tokens):
+                    token = flight.tokens[position]
+                    position += 1
+                    yield token
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    completed = True
+                    break
+                else:
+                    if flight.pull is None:
+                        # A task of its own, so a subscriber cancelled mid-pull doesn't cut off the rest
+                        flight.pull = asyncio.ensure_future(self._apull(flight))
+                    await flight.changed.wait()
+        finally:
+            await self._aunsubscribe(flight)
+        if completed and on_done is not None:
+            on_done(flight.context)
+
+    async def _apull(self, flight: _Flight):
+        """Fetch the next upstream token into the flight's buffer and wake the subscribers"""
+        token = None
+        finished = False
+        error = None
+        try:
+            if flight._upstream is None:
+                flight._upstream = flight._upstream_factory(flight._set_context, flight._on_cancel)
+            token = await flight._upstream.__anext__()
+        except StopAsyncIteration:
+            finished = True
+        except Exception as e:
+            finished = True
+            error = e
+        if token is not None:
+            flight.tokens.append(token)
+        if finished:
+            flight.done = True
+            flight.error = error
+            with self._cond:
+                if self._async_flights.get(flight.key) is flight:
+                    del self._async_flights[flight.key]
+        flight.pull = None
+        changed, flight.changed = flight.changed, asyncio.Event()
+        changed.set()
+
+    async def _aunsubscribe(self, flight: _Flight):
+        with self._cond:
+            flight.subscribers -= 1
+            if flight.subscribers > 0 or flight.done:
+                return
+            flight.done = True
+            self.cancelled += 1
+            if self._async_flights.get(flight.key) is flight:
+                del self._async_flights[flight.key]
+        pull = flight.pull
+        if pull is not None:
+            # Interrupts the upstream mid-read, which ends it
+            pull.cancel()
+            await asyncio.wait([pull])
+        if flight._upstream is not None:
+            await flight._upstream.aclose()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "in_flight": len(self._flights) + len(self._async_flights),
+                "started": self.started,
+                "joined": self.joined,
+                "cancelled": self.cancelled,
+            }
+
+
+# Shared instance used by the web server
+single_flight = SingleFlight()
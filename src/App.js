@@ -186,6 +186,18 @@ function App() {
         signal: controller.signal, // Add abort signal
       });
 
+      if (response.status === 429) {
+        // Server is at capacity for this model
+        setMessages((prev) =>
+          prev.map((msg) =>
+            msg.id === botMessageId
+              ? { ...msg, text: "The server is busy right now. Please try again in a moment.", isLoading: false, loadingMessage: "" }
+              : msg
+          )
+        );
+        return;
+      }
+
       const reader = response.body.getReader();
       const decoder = new TextDecoder();
       let buffer = "";
@@ -222,8 +234,8 @@ function App() {
             try {
               const data = JSON.parse(line.slice(6));
               
-              // Handle status updates (loading messages)
-              if (data.status === 'loading') {
+              // Handle status updates (loading messages and queue position)
+              if (data.status === 'loading' || data.status === 'queued') {
                 setMessages((prev) =>
                   prev.map((msg) =>
                     msg.id === botMessageId
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+
+# Token frames are written once flush_ms have passed since the last write or flush_bytes
+# of token text are waiting, whichever comes first; 0 ms writes every token as its own frame
+DEFAULT_FLUSH_MS = float(os.environ.get("SSE_FLUSH_MS", "50"))
+DEFAULT_FLUSH_BYTES = int(os.environ.get("SSE_FLUSH_BYTES", "1024"))
+# Comment line written after this many seconds of silence so proxies keep the stream open
+DEFAULT_HEARTBEAT_S = float(os.environ.get("SSE_HEARTBEAT_S", "15"))
+
+MIMETYPE = "text/event-stream"
+# Ask proxies (nginx in particular) not to buffer or cache the stream
+HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+HEARTBEAT = ": keep-alive\n\n"
+# Events read ahead of the client by frame_events
+EVENT_BUFFER = 64
+
+
+class StreamOptions:
+    """Framing settings of one stream"""
+
+    def __init__(self, flush_ms: float = DEFAULT_FLUSH_MS, flush_bytes: int = DEFAULT_FLUSH_BYTES,
+                 heartbeat_s: float = DEFAULT_HEARTBEAT_S):
+        self.flush_ms = flush_ms
+        self.flush_bytes = flush_bytes
+        self.heartbeat_s = heartbeat_s
+
+    @classmethod
+    def from_request(cls, options: Optional[Dict]) -> "StreamOptions":
+        """Defaults overridden by a request's "stream_options", clamped to sane ranges"""
+        options = options or {}
+        try:
+            return cls(
+                min(max(float(options.get("flush_ms", DEFAULT_FLUSH_MS)), 0.0), 1000.0),
+                min(max(int(options.get("flush_bytes", DEFAULT_FLUSH_BYTES)), 1), 64 * 1024),
+                min(max(float(options.get("heartbeat_s", DEFAULT_HEARTBEAT_S)), 1.0), 300.0),
+            )
+        except (TypeError, ValueError, AttributeError) as e:
+            raise ValueError(f"Invalid stream_options: {options}") from e
+
+
+def frame(event: Dict) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+
+def _is_token(event: Dict) -> bool:
+    return len(event) == 2 and "token" in event and event.get("done") is False
+
+
+class _Framer:
+    """Coalescing state of one stream (see frame_events)"""
+
+    def __init__(self, options: StreamOptions):
+        self.options = options
+        self.flush_s = options.flush_ms / 1000.0
+        self.pending: List[str] = []
+        self.pending_bytes = 0
+        self.first_token = True
+        self.last_write = time.monotonic()
+
+    def _flush(self) -> str:
+        data = frame({"token": "".join(self.pending), "done": False})
+        self.pending.clear()
+        self.pending_bytes = 0
+        return data
+
+    def next_due(self) -> float:
+        """Seconds until pending tokens or a heartbeat are due to be written"""
+        wait = self.flush_s if self.pending else self.options.heartbeat_s
+        return max(self.last_write + wait - time.monotonic(), 0.0)
+
+    def feed(self, event: Dict) -> List[str]:
+        """Frames to write after an event (often none)"""
+        now = time.monotonic()
+        if not event:
+            if self.pending and now - self.last_write >= self.flush_s:
+                self.last_write = now
+                return [self._flush()]
+            if now - self.last_write >= self.options.heartbeat_s:
+                self.last_write = now
+                return [HEARTBEAT]
+            return []
+
+        if _is_token(event):
+            self.pending.append(event["token"])
+            self.pending_bytes += len(event["token"].encode('utf-8'))
+            if (self.first_token and self.pending_bytes) or self.pending_bytes >= self.options.flush_bytes \
+                    or now - self.last_write >= self.flush_s:
+                self.first_token = False
+                self.last_write = now
+                return [self._flush()]
+            return []
+
+        frames = [self._flush()] if self.pending else []
+        frames.append(frame(event))
+        self.last_write = now
+        return frames
+
+
+class _Failed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_END = object()
+
+
+def frame_events(events: Iterator[Dict], options: StreamOptions) -> Iterator[str]:
+    """Turn a stream of event dicts into SSE frames, coalescing consecutive tokens
+
+    Token events ({"token", "done": False}) are merged into one frame; the first
+    non-empty token is always written straight away. Any other event writes the
+    pending tokens first. events is read on a thread of its own, so pending
+    tokens and heartbeats go out on time however long the next event takes
+    (empty dicts from the producer are accepted as extra ticks). Closing this
+    generator closes events, on that thread, once its current event is out; a
+    read that thread is blocked on has to be cut off by the caller (the server
+    cancels the request's RequestContext).
+    """
+    framer = _Framer(options)
+    received = queue.Queue(maxsize=EVENT_BUFFER)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                received.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def pull():
+        try:
+            for event in events:
+                if not put(event):
+                    return
+            put(_END)
+        except BaseException as e:
+            put(_Failed(e))
+        finally:
+            events.close()
+
+    threading.Thread(target=pull, name="sse-events", daemon=True).start()
+    try:
+        while True:
+            try:
+                event = received.get(timeout=framer.next_due())
+            except queue.Empty:
+                event = {}
+            if event is _END:
+                return
+            if isinstance(event, _Failed):
+                raise event.error
+            yield from framer.feed(event)
+    finally:
+        stopped.set()
+
+
+async def aframe_events(events: AsyncIterator[Dict], options: StreamOptions) -> AsyncIterator[str]:
+    """frame_events() for an async generator of events, timed by the event loop instead of a thread"""
+    framer = _Framer(options)
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(events.__anext__())
+            # The pending __anext__ keeps running across timeouts; cancelling it would end events
+            done, _ = await asyncio.wait({pending}, timeout=framer.next_due())
+            if not done:
+                for data in framer.feed({}):
+                    yield data
+                continue
+            next_event, pending = pending, None
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            for data in framer.feed(event):
+                yield data
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.wait({pending})
+        await events.aclose()
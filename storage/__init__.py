@@ -0,0 +1,16 @@
+from .base import StorageBackend
+from .file_backend import FileBackend
+from .sqlite_backend import SQLiteBackend
+from .session_cache import SessionCache
+from .write_behind import WriteBehindWriter, FlushError
+from .locking import SessionLocks
+
+__all__ = [
+    'StorageBackend',
+    'FileBackend',
+    'SQLiteBackend',
+    'SessionCache',
+    'WriteBehindWriter',
+    'FlushError',
+    'SessionLocks'
+]
@@ -0,0 +1,188 @@
+import gzip
+import json
+import os
+import threading
+import uuid
+from typing import List, Dict, Optional, Hashable, Iterable
+
+from .locking import SessionLocks, atomic_write
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CODECS = ("gzip", "zstd")
+PACK_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+INDEX_FILENAME = "index.json"
+
+
+def codec_available(codec: str) -> bool:
+    return codec == "gzip" or (codec == "zstd" and zstandard is not None)
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    """Compress data as one self-contained gzip member or zstd frame"""
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    raise ValueError(f"Unsupported archive codec: {codec}")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unsupported archive codec: {codec}")
+
+
+class SessionArchive:
+    """Cold tier holding whole sessions compressed into shared pack files
+
+    A pack is a concatenation of independently compressed session documents, so
+    one session is read back with a single seek and decompress. index.json maps
+    each archived session to its pack, offset and length, along with its listing
+    summary so archived sessions can be listed without decompressing anything.
+    Packs are deleted once none of their sessions are still archived.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        # Serializes index updates across threads and processes
+        self._index_lock = SessionLocks(directory, stripes=1)
+        self._lock = threading.Lock()
+        self._index: Dict[str, Dict] = {}
+        self._index_stat = None
+
+    def _refresh(self) -> Dict[str, Dict]:
+        """Current index, re-read only if another writer replaced it"""
+        with self._lock:
+            try:
+                stat = os.stat(self.index_path)
+                key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                self._index, self._index_stat = {}, None
+                return self._index
+            if key != self._index_stat:
+                try:
+                    with open(self.index_path, 'r', encoding='utf-8') as f:
+                        self._index = json.load(f)
+                except (json.JSONDecodeError, IOError):
+                    self._index = {}
+                self._index_stat = key
+            return self._index
+
+    def _update(self, apply):
+        """Apply a change to the index and write it back atomically"""
+        with self._index_lock.lock("index"):
+            self._index_stat = None
+            index = dict(self._refresh())
+            apply(index)
+            atomic_write(self.index_path, json.dumps(index, ensure_ascii=False), sync=True)
+            self._index_stat = None
+            self._remove_unused_packs()
+
+    def contains(self, session_id: str) -> bool:
+        return session_id in self._refresh()
+
+    def session_ids(self) -> List[str]:
+        return list(self._refresh())
+
+    def entry(self, session_id: str) -> Optional[Dict]:
+        return self._refresh().get(session_id)
+
+    def version(self, session_id: str) -> Optional[Hashable]:
+        entry = self.entry(session_id)
+        if entry is None:
+            return None
+        return ("archive", entry["pack"], entry["offset"])
+
+    def pack_path(self, session_id: str) -> Optional[str]:
+        entry = self.entry(session_id)
+        return os.path.join(self.directory, entry["pack"]) if entry else None
+
+    def summary(self, session_id: str) -> Optional[Dict]:
+        entry = self.entry(session_id)
+        return dict(entry["summary"]) if entry else None
+
+    def load(self, session_id: str) -> Optional[Dict]:
+        """Decompress and return an archived session document"""
+        entry = self.entry(session_id)
+        if entry is None:
+            return None
+        try:
+            with open(os.path.join(self.directory, entry["pack"]), 'rb') as f:
+                f.seek(entry["offset"])
+                data = f.read(entry["length"])
+            return json.loads(decompress(data, entry["codec"]).decode('utf-8'))
+        except (IOError, OSError, ValueError) as e:
+            print(f"Error reading archived session {session_id}: {e}")
+            return None
+
+    def write_pack(self, sessions: Iterable[tuple], codec: str = "gzip") -> Dict[str, Dict]:
+        """Write (chat_data, summary) pairs into a new pack and add them to the index
+
+        Returns the new index entries by session ID. The pack is fsynced
+        before the index refers to it.
+        """
+        if not codec_available(codec):
+            raise ValueError(f"Unsupported archive codec: {codec}")
+        pack = f"pack-{uuid.uuid4().hex}{PACK_EXTENSIONS[codec]}"
+        tmp_path = os.path.join(self.directory, f"{pack}.tmp.{os.getpid()}")
+        entries = {}
+        offset = 0
+        with open(tmp_path, 'wb') as f:
+            for chat_data, summary in sessions:
+                data = compress(json.dumps(chat_data, ensure_ascii=False).encode('utf-8'), codec)
+                f.write(data)
+                entries[chat_data["session_id"]] = {
+                    "pack": pack, "offset": offset, "length": len(data),
+                    "codec": codec, "summary": summary
+                }
+                offset += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if not entries:
+            os.remove(tmp_path)
+            return entries
+
+        def apply(index):
+            # Publish the pack under the index lock so it's never seen unreferenced
+            os.replace(tmp_path, os.path.join(self.directory, pack))
+            index.update(entries)
+        self._update(apply)
+        return entries
+
+    def remove(self, session_ids: Iterable[str]):
+        """Drop sessions from the archive"""
+        session_ids = [sid for sid in session_ids if self.contains(sid)]
+        if session_ids:
+            def apply(index):
+                for session_id in session_ids:
+                    index.pop(session_id, None)
+            self._update(apply)
+
+    def _remove_unused_packs(self):
+        used = {entry["pack"] for entry in self._refresh().values()}
+        for filename in os.listdir(self.directory):
+            if filename.startswith("pack-") and ".tmp." not in filename and filename not in used:
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict:
+        index = self._refresh()
+        packs = {entry["pack"] for entry in index.values()}
+        pack_bytes = 0
+        for pack in packs:
+            try:
+                pack_bytes += os.path.getsize(os.path.join(self.directory, pack))
+            except OSError:
+                pass
+        return {"sessions": len(index), "packs": len(packs), "bytes": pack_bytes}
@@ -0,0 +1,163 @@
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from itertools import islice
+from typing import List, Dict, Optional, Iterator, Tuple, Hashable
+
+
+# Fields kept in the header for cheap listing but not part of the session document
+SUMMARY_FIELDS = ("message_count", "first_message")
+
+
+def build_summary(header: Dict) -> Dict:
+    """Build the listing summary for a session header"""
+    return {
+        "session_id": header.get("session_id"),
+        "agent_name": header.get("agent_name"),
+        "model": header.get("model"),
+        "created_at": header.get("created_at"),
+        "updated_at": header.get("updated_at"),
+        "message_count": header.get("message_count", 0),
+        "first_message": header.get("first_message", "")
+    }
+
+
+def session_sort_key(summary: Dict) -> Tuple[str, str]:
+    """Key that orders session summaries for listing and pagination"""
+    return (summary.get("updated_at") or "", summary.get("session_id") or "")
+
+
+def build_header(chat_data: Dict) -> Dict:
+    """Build a session header (document minus messages, plus summary fields)"""
+    messages = chat_data.get("messages", [])
+    header = {k: v for k, v in chat_data.items() if k != "messages"}
+    header["message_count"] = len(messages)
+    header["first_message"] = messages[0].get("message", "")[:100] if messages else ""
+    return header
+
+
+class StorageBackend(ABC):
+    """Interface implemented by every chat history backend used by ChatStorage"""
+
+    @abstractmethod
+    def create_session(self, chat_data: Dict):
+        """Persist a newly created (empty) session"""
+        pass
+
+    @abstractmethod
+    def append_message(self, session_id: str, record: Dict) -> bool:
+        """Append one message record to a session, returning False if it doesn't exist"""
+        pass
+
+    def append_messages(self, session_id: str, records: List[Dict], sync: bool = False) -> bool:
+        """Append several message records as one write
+
+        With sync=True the data must be on stable storage (fsync) before returning.
+        """
+        for record in records:
+            if not self.append_message(session_id, record):
+                return False
+        return True
+
+    def session_lock(self, session_id: str):
+        """Context manager that excludes other writers of a session
+
+        Backend methods take it themselves; callers hold it to make several
+        calls (e.g. version check, append, version check) atomic.
+        """
+        return nullcontext()
+
+    @abstractmethod
+    def load_session(self, session_id: str) -> Optional[Dict]:
+        """Load a full session document, or None if it doesn't exist"""
+        pass
+
+    @abstractmethod
+    def session_version(self, session_id: str) -> Optional[Hashable]:
+        """Cheap token that changes whenever a session changes, or None if it doesn't exist"""
+        pass
+
+    @abstractmethod
+    def load_header(self, session_id: str) -> Optional[Dict]:
+        """Load a session document without its messages, or None if it doesn't exist"""
+        pass
+
+    @abstractmethod
+    def load_summary(self, session_id: str) -> Optional[Dict]:
+        """Load a session's listing summary without its messages, or None if it doesn't exist"""
+        pass
+
+    @abstractmethod
+    def save_session(self, chat_data: Dict):
+        """Save a full session document, replacing any stored copy"""
+        pass
+
+    @abstractmethod
+    def list_sessions(self, agent_name: Optional[str] = None, limit: Optional[int] = None,
+                      before: Optional[str] = None, after: Optional[str] = None,
+                      cursor: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        """List session summaries, most recently updated first
+
+        before/after filter on updated_at; cursor is the session_sort_key of the
+        last summary already returned, and only summaries ordered after it are listed.
+        """
+        pass
+
+    @abstractmethod
+    def delete_session(self, session_id: str) -> bool:
+        """Delete a session, returning False if it doesn't exist"""
+        pass
+
+    @abstractmethod
+    def get_messages(self, session_id: str) -> List[Dict]:
+        """Get all messages of a session"""
+        pass
+
+    @abstractmethod
+    def iter_messages(self, session_id: str, start: int = 0, before: Optional[str] = None,
+                      after: Optional[str] = None) -> Iterator[Tuple[int, Dict]]:
+        """Yield (index, message) pairs from index start on, optionally filtered by timestamp"""
+        pass
+
+    def session_ids(self) -> List[str]:
+        """IDs of every stored session, read from the sessions themselves where possible"""
+        return [summary["session_id"] for summary in self.list_sessions()]
+
+    def message_count(self, session_id: str) -> Optional[int]:
+        """Number of messages in a session, or None if it doesn't exist"""
+        summary = self.load_summary(session_id)
+        return summary.get("message_count", 0) if summary is not None else None
+
+    def read_messages(self, session_id: str, start: int = 0, end: Optional[int] = None) -> List[Dict]:
+        """Messages with index in [start, end), like messages[start:end] for non-negative bounds"""
+        messages = self.iter_messages(session_id, start)
+        try:
+            return [message for _, message in islice(messages, None if end is None else max(end - start, 0))]
+        finally:
+            messages.close()
+
+    def load_session_state(self, session_id: str) -> Optional[Dict]:
+        """Per-session state kept beside the transcript (e.g. the model's conversation context)"""
+        return None
+
+    def save_session_state(self, session_id: str, state: Optional[Dict]):
+        """Replace a session's state, or remove it when state is None"""
+        pass
+
+    @abstractmethod
+    def search(self, query: str, agent_name: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+        """Find sessions with a message matching every query term, best match first"""
+        pass
+
+    @abstractmethod
+    def rebuild_search_index(self) -> int:
+        """Rebuild the full-text search index, returning the number of sessions indexed"""
+        pass
+
+    @abstractmethod
+    def describe_location(self, session_id: str) -> str:
+        """Human readable location of a session, for CLI output"""
+        pass
+
+    def close(self):
+        """Release any resources held by the backend"""
+        pass
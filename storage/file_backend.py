@@ -0,0 +1,735 @@
+import json
+import os
+import struct
+import time
+from typing import List, Dict, Optional, Iterator, Tuple, Hashable
+
+from .archive import SessionArchive
+from .base import StorageBackend, SUMMARY_FIELDS, build_header, build_summary, session_sort_key
+from .locking import SessionLocks, LOCK_DIRNAME, atomic_write
+from .manifest import SessionManifest
+from .search_index import SearchIndex
+
+
+# Session file layout:
+#   <session_id>.meta.json  - header and summary (everything except messages)
+#   <session_id>.jsonl      - message journal, one JSON record appended per message
+#   <session_id>.idx        - byte offset of each journal record (little-endian uint64s),
+#                             so ranges and tails are read with two seeks; rebuilt if stale
+#   <session_id>.state.json - optional state carried between turns (model context)
+#   <session_id>.json       - legacy single-document format (read transparently)
+# Writers of a session hold its lock (thread + file lock under _locks/), and whole
+# files are replaced atomically, so concurrent workers and crashes can't lose messages.
+META_SUFFIX = ".meta.json"
+JOURNAL_SUFFIX = ".jsonl"
+INDEX_SUFFIX = ".idx"
+STATE_SUFFIX = ".state.json"
+LEGACY_SUFFIX = ".json"
+# Longer suffixes ending in ".json" must come before LEGACY_SUFFIX
+SESSION_SUFFIXES = (META_SUFFIX, JOURNAL_SUFFIX, INDEX_SUFFIX, STATE_SUFFIX, LEGACY_SUFFIX)
+OFFSET = struct.Struct("<Q")
+MANIFEST_FILENAME = "_sessions.manifest"
+SEARCH_INDEX_FILENAME = "_search_index.db"
+# Cold tier: sessions compacted into compressed packs (see SessionArchive)
+ARCHIVE_DIRNAME = "_archive"
+
+# Directory layouts: "flat" keeps every session file in storage_dir, "sharded" puts
+# them under two levels of prefix directories (ab/cd/abcd1234-....jsonl) so no single
+# directory grows past a few files. The layout in use is recorded in LAYOUT_FILENAME.
+LAYOUTS = ("flat", "sharded")
+LAYOUT_FILENAME = "_layout"
+
+
+def shard_parts(session_id: str) -> Tuple[str, str]:
+    """Two-level shard directory names for a session ID"""
+    key = session_id.lower().ljust(4, "_")
+    return key[:2], key[2:4]
+
+
+def _encode_records(records: List[Dict]) -> Tuple[bytes, List[int]]:
+    """Journal lines for records plus the offset of each line within them"""
+    lines = [(json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8') for record in records]
+    offsets = []
+    position = 0
+    for line in lines:
+        offsets.append(position)
+        position += len(line)
+    return b"".join(lines), offsets
+
+
+def _session_id_of(filename: str) -> Optional[Tuple[str, str]]:
+    """(session_id, suffix) for a session file name, or None for anything else"""
+    if filename.startswith("_") or ".tmp." in filename:
+        return None
+    for suffix in SESSION_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)], suffix
+    return None
+
+
+class FileBackend(StorageBackend):
+    """Stores each session as a JSON header plus an append-only JSONL journal
+
+    layout selects a flat or sharded directory layout. When None, the layout
+    recorded in the storage directory is used (flat if there is none yet).
+    """
+
+    def __init__(self, storage_dir: str = "chat_history", layout: Optional[str] = None):
+        self.storage_dir = storage_dir
+        self.ensure_storage_dir()
+        self.layout = self._resolve_layout(layout)
+        self.manifest = SessionManifest(os.path.join(storage_dir, MANIFEST_FILENAME),
+                                        os.path.join(storage_dir, LOCK_DIRNAME, "manifest.lock"))
+        self.search_index = SearchIndex(os.path.join(storage_dir, SEARCH_INDEX_FILENAME))
+        self.locks = SessionLocks(os.path.join(storage_dir, LOCK_DIRNAME))
+        self.archive = SessionArchive(os.path.join(storage_dir, ARCHIVE_DIRNAME))
+
+    def ensure_storage_dir(self):
+        """Create storage directory if it doesn't exist"""
+        if not os.path.exists(self.storage_dir):
+            os.makedirs(self.storage_dir)
+
+    def _layout_path(self) -> str:
+        return os.path.join(self.storage_dir, LAYOUT_FILENAME)
+
+    def _read_layout(self) -> Optional[str]:
+        try:
+            with open(self._layout_path(), 'r', encoding='utf-8') as f:
+                layout = f.read().strip()
+        except IOError:
+            return None
+        return layout if layout in LAYOUTS else None
+
+    def _resolve_layout(self, layout: Optional[str]) -> str:
+        recorded = self._read_layout()
+        if layout is None:
+            return recorded or "flat"
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown chat storage layout: {layout}")
+        if recorded is None and layout != "flat" and self._session_ids_in("flat"):
+            # Sessions written before layouts were recorded are flat
+            recorded = "flat"
+        if recorded is not None and recorded != layout:
+            # Keep reading the sessions where they are rather than losing them
+            print(f"Warning: {self.storage_dir} uses the {recorded} layout; "
+                  f"run 'python chat_manager.py migrate-layout {layout}' to convert it")
+            return recorded
+        if recorded is None:
+            atomic_write(self._layout_path(), layout + "\n")
+        return layout
+
+    def session_dir(self, session_id: str, layout: Optional[str] = None) -> str:
+        """Directory holding a session's files, computed without touching the disk"""
+        if (layout or self.layout) == "sharded":
+            return os.path.join(self.storage_dir, *shard_parts(session_id))
+        return self.storage_dir
+
+    def meta_path(self, session_id: str) -> str:
+        """Path of the header/summary file for a session"""
+        return os.path.join(self.session_dir(session_id), f"{session_id}{META_SUFFIX}")
+
+    def journal_path(self, session_id: str) -> str:
+        """Path of the append-only message journal for a session"""
+        return os.path.join(self.session_dir(session_id), f"{session_id}{JOURNAL_SUFFIX}")
+
+    def index_path(self, session_id: str) -> str:
+        """Path of the message offset index for a session"""
+        return os.path.join(self.session_dir(session_id), f"{session_id}{INDEX_SUFFIX}")
+
+    def state_path(self, session_id: str) -> str:
+        """Path to a session's state file"""
+        return os.path.join(self.session_dir(session_id), f"{session_id}{STATE_SUFFIX}")
+
+    def legacy_path(self, session_id: str) -> str:
+        """Path of a session stored in the legacy single-file format"""
+        return os.path.join(self.session_dir(session_id), f"{session_id}{LEGACY_SUFFIX}")
+
+    def describe_location(self, session_id: str) -> str:
+        if not self._has_live_files(session_id) and self.archive.contains(session_id):
+            return f"{self.archive.pack_path(session_id)} (archived)"
+        return self.journal_path(session_id)
+
+    def _session_files_of(self, session_id: str) -> Tuple[str, ...]:
+        return (self.meta_path(session_id), self.journal_path(session_id),
+                self.index_path(session_id), self.state_path(session_id), self.legacy_path(session_id))
+
+    def _has_live_files(self, session_id: str) -> bool:
+        """Whether a session is stored outside the archive"""
+        return os.path.exists(self.meta_path(session_id)) or os.path.exists(self.legacy_path(session_id))
+
+    def session_lock(self, session_id: str):
+        return self.locks.lock(session_id)
+
+    def create_session(self, chat_data: Dict):
+        self.save_session(chat_data)
+
+    def append_message(self, session_id: str, record: Dict) -> bool:
+        return self.append_messages(session_id, [record])
+
+    def append_messages(self, session_id: str, records: List[Dict], sync: bool = False) -> bool:
+        with self.locks.lock(session_id):
+            return self._append_messages(session_id, records, sync)
+
+    def _append_messages(self, session_id: str, records: List[Dict], sync: bool) -> bool:
+        header = self._load_header(session_id)
+        if header is None and os.path.exists(self.legacy_path(session_id)):
+            # Convert legacy sessions on first write so the append below is cheap
+            if self._migrate_session(session_id):
+                header = self._load_header(session_id)
+        elif header is None and self.archive.contains(session_id):
+            # Bring an archived session back to the hot tier before writing to it
+            chat_data = self.archive.load(session_id)
+            if chat_data is not None:
+                self._save_session(chat_data)
+                header = self._load_header(session_id)
+        if header is None:
+            return False
+        if not records:
+            return True
+        if not self._index_covers_journal(session_id, header.get("message_count", 0)):
+            # Records of an append that crashed before its index and header writes:
+            # count them in, or the offsets of this append would land after them
+            self._rebuild_offset_index(session_id)
+            header = self._load_header(session_id)
+
+        data, offsets = _encode_records(records)
+        try:
+            with open(self.journal_path(session_id), 'a+b') as f:
+                base = f.seek(0, os.SEEK_END)
+                if base > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        # Terminate a record torn by a crash so it doesn't swallow this one
+                        data = b"\n" + data
+                        base += 1
+                f.write(data)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        except IOError as e:
+            print(f"Error saving chat message: {e}")
+            return False
+
+        first_seq = header.get("message_count", 0)
+        self._append_offsets(session_id, first_seq, [base + offset for offset in offsets])
+        header["updated_at"] = records[-1]["timestamp"]
+        header["message_count"] = first_seq + len(records)
+        if not header.get("first_message"):
+            header["first_message"] = records[0].get("message", "")[:100]
+        self._write_header(header, sync)
+        summary = build_summary(header)
+        self.manifest.put(summary)
+        self.search_index.add_messages(summary, first_seq, [record.get("message", "") for record in records])
+        return True
+
+    def load_session(self, session_id: str) -> Optional[Dict]:
+        header = self._load_header(session_id)
+        if header is not None:
+            chat_data = {k: v for k, v in header.items() if k not in SUMMARY_FIELDS}
+            chat_data["messages"] = list(self._iter_journal(session_id))
+            return chat_data
+
+        filepath = self.legacy_path(session_id)
+        if os.path.exists(filepath):
+            try:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (json.JSONDecodeError, IOError):
+                return None
+        return self.archive.load(session_id)
+
+    def session_version(self, session_id: str) -> Optional[Hashable]:
+        try:
+            meta = os.stat(self.meta_path(session_id))
+        except OSError:
+            try:
+                legacy = os.stat(self.legacy_path(session_id))
+            except OSError:
+                return self.archive.version(session_id)
+            return (legacy.st_mtime_ns, legacy.st_size)
+        try:
+            journal = os.stat(self.journal_path(session_id))
+            journal_version = (journal.st_mtime_ns, journal.st_size)
+        except OSError:
+            journal_version = None
+        # The header is replaced on every write, so its inode changes even within one mtime tick
+        return (meta.st_ino, meta.st_mtime_ns, meta.st_size, journal_version)
+
+    def load_header(self, session_id: str) -> Optional[Dict]:
+        header = self._load_header(session_id)
+        if header is not None:
+            return {k: v for k, v in header.items() if k not in SUMMARY_FIELDS}
+        chat_data = self.load_session(session_id)
+        if chat_data is None:
+            return None
+        chat_data.pop("messages", None)
+        return chat_data
+
+    def save_session(self, chat_data: Dict):
+        with self.locks.lock(chat_data["session_id"]):
+            self._save_session(chat_data)
+
+    def _save_session(self, chat_data: Dict):
+        session_id = chat_data["session_id"]
+        os.makedirs(self.session_dir(session_id), exist_ok=True)
+
+        data, offsets = _encode_records(chat_data.get("messages", []))
+        try:
+            atomic_write(self.journal_path(session_id), data)
+            atomic_write(self.index_path(session_id), b"".join(OFFSET.pack(offset) for offset in offsets))
+        except IOError as e:
+            print(f"Error saving chat session: {e}")
+            return
+
+        header = build_header(chat_data)
+        self._write_header(header)
+        summary = build_summary(header)
+        self.manifest.put(summary)
+        self.search_index.index_session(chat_data, summary)
+
+        # The journaled copy supersedes any legacy file or archived copy of this session
+        legacy = self.legacy_path(session_id)
+        if os.path.exists(legacy):
+            try:
+                os.remove(legacy)
+            except OSError:
+                pass
+        self.archive.remove([session_id])
+
+    def _load_header(self, session_id: str) -> Optional[Dict]:
+        """Load the header/summary of a journaled session"""
+        filepath = self.meta_path(session_id)
+        if not os.path.exists(filepath):
+            return None
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return None
+
+    def _write_header(self, header: Dict, sync: bool = False):
+        """Write the header/summary of a journaled session"""
+        try:
+            atomic_write(self.meta_path(header["session_id"]), json.dumps(header, ensure_ascii=False), sync)
+        except IOError as e:
+            print(f"Error saving chat session header: {e}")
+
+    def _append_offsets(self, session_id: str, first_seq: int, offsets: List[int]):
+        """Extend the offset index after an append, or drop it if it was already stale"""
+        path = self.index_path(session_id)
+        try:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size == first_seq * OFFSET.size:
+                with open(path, 'ab') as f:
+                    f.write(b"".join(OFFSET.pack(offset) for offset in offsets))
+            else:
+                # Rebuilt from the journal on the next range read
+                os.remove(path)
+        except OSError as e:
+            print(f"Error updating message index: {e}")
+
+    def _indexed_count(self, session_id: str) -> Optional[int]:
+        """Messages covered by a journaled session's offset index, rebuilding the index if stale
+
+        Returns None for sessions without a journal (legacy or archived).
+        """
+        header = self._load_header(session_id)
+        if header is None:
+            return None
+        count = header.get("message_count", 0)
+        try:
+            if (os.path.getsize(self.index_path(session_id)) == count * OFFSET.size
+                    and self._index_covers_journal(session_id, count)):
+                return count
+        except OSError:
+            pass
+        with self.locks.lock(session_id):
+            return self._rebuild_offset_index(session_id)
+
+    def _index_covers_journal(self, session_id: str, count: int) -> bool:
+        """Whether no complete record follows the count-th record of the journal
+
+        A crash between the journal write of an append and its index and header
+        writes leaves such records behind. A torn last line doesn't count.
+        """
+        try:
+            with open(self.journal_path(session_id), 'rb') as journal:
+                if count == 0:
+                    tail = journal.read()
+                    lines = tail.split(b"\n")[:-1]
+                else:
+                    with open(self.index_path(session_id), 'rb') as index:
+                        index.seek((count - 1) * OFFSET.size)
+                        (last,) = OFFSET.unpack(index.read(OFFSET.size))
+                    journal.seek(last)
+                    lines = journal.read().split(b"\n")[1:-1]
+        except FileNotFoundError:
+            return count == 0
+        except (OSError, struct.error):
+            return False
+        for line in lines:
+            try:
+                if line.strip():
+                    json.loads(line)
+                    return False
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                pass
+        return True
+
+    def _rebuild_offset_index(self, session_id: str) -> Optional[int]:
+        """Recompute the offset index by scanning the journal (caller holds the session lock)"""
+        header = self._load_header(session_id)
+        if header is None:
+            return None
+        offsets = []
+        position = 0
+        last = None
+        try:
+            with open(self.journal_path(session_id), 'rb') as f:
+                for line in f:
+                    try:
+                        if line.strip():
+                            last = json.loads(line)
+                            offsets.append(position)
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        pass
+                    position += len(line)
+        except IOError:
+            pass
+        atomic_write(self.index_path(session_id), b"".join(OFFSET.pack(offset) for offset in offsets))
+        if header.get("message_count", 0) != len(offsets):
+            # The journal is authoritative, e.g. after a crash between journal and header writes
+            header["message_count"] = len(offsets)
+            if isinstance(last, dict) and last.get("timestamp"):
+                header["updated_at"] = last["timestamp"]
+            self._write_header(header)
+            summary = build_summary(header)
+            self.manifest.put(summary)
+            chat_data = {k: v for k, v in header.items() if k not in SUMMARY_FIELDS}
+            chat_data["messages"] = list(self._iter_journal(session_id))
+            self.search_index.index_session(chat_data, summary)
+        return len(offsets)
+
+    def message_count(self, session_id: str) -> Optional[int]:
+        count = self._indexed_count(session_id)
+        return count if count is not None else super().message_count(session_id)
+
+    def read_messages(self, session_id: str, start: int = 0, end: Optional[int] = None) -> List[Dict]:
+        count = self._indexed_count(session_id)
+        if count is None:
+            return super().read_messages(session_id, start, end)
+        end = count if end is None else min(end, count)
+        if start >= end:
+            return []
+
+        # Offsets of the requested records, plus the next one to bound the read
+        with open(self.index_path(session_id), 'rb') as f:
+            f.seek(start * OFFSET.size)
+            raw = f.read((min(end + 1, count) - start) * OFFSET.size)
+        offsets = [offset for (offset,) in OFFSET.iter_unpack(raw)]
+        stop = offsets.pop() if len(offsets) > end - start else None
+
+        with open(self.journal_path(session_id), 'rb') as f:
+            f.seek(offsets[0])
+            data = f.read(stop - offsets[0]) if stop is not None else f.read()
+
+        messages = []
+        for offset in offsets:
+            begin = offset - offsets[0]
+            newline = data.find(b"\n", begin)
+            try:
+                messages.append(json.loads(data[begin:newline if newline >= 0 else len(data)]))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+        return messages
+
+    def _iter_journal(self, session_id: str) -> Iterator[Dict]:
+        """Yield messages from a session journal, skipping torn or corrupt records"""
+        filepath = self.journal_path(session_id)
+        if not os.path.exists(filepath):
+            return
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash mid-append can leave a partial last record
+                        continue
+        except IOError:
+            return
+
+    def _session_dirs(self, layout: str) -> Iterator[str]:
+        """Every directory that can hold session files in a layout"""
+        if layout == "flat":
+            yield self.storage_dir
+            return
+        for first in sorted(os.listdir(self.storage_dir)):
+            first_dir = os.path.join(self.storage_dir, first)
+            if first.startswith("_") or not os.path.isdir(first_dir):
+                continue
+            for second in sorted(os.listdir(first_dir)):
+                second_dir = os.path.join(first_dir, second)
+                if os.path.isdir(second_dir):
+                    yield second_dir
+
+    def _session_files(self, layout: str) -> Iterator[Tuple[str, str, str]]:
+        """(session_id, suffix, path) of every session file stored in a layout"""
+        for directory in self._session_dirs(layout):
+            for filename in os.listdir(directory):
+                parsed = _session_id_of(filename)
+                if parsed is not None:
+                    yield parsed[0], parsed[1], os.path.join(directory, filename)
+
+    def _session_ids_in(self, layout: str) -> List[str]:
+        session_ids = set()
+        for session_id, suffix, _ in self._session_files(layout):
+            if suffix in (META_SUFFIX, LEGACY_SUFFIX):
+                session_ids.add(session_id)
+        return sorted(session_ids)
+
+    def _session_ids(self) -> List[str]:
+        """IDs of all stored sessions, journaled, legacy or archived"""
+        return sorted(set(self._session_ids_in(self.layout)) | set(self.archive.session_ids()))
+
+    def session_ids(self) -> List[str]:
+        # Walk the directory rather than trusting the manifest
+        return self._session_ids()
+
+    def _load_summary_header(self, session_id: str) -> Optional[Dict]:
+        """Header with summary fields, computing them for legacy sessions"""
+        header = self._load_header(session_id)
+        if header is None:
+            # Legacy session: summary has to be computed from the full document
+            chat_data = self.load_session(session_id)
+            if not chat_data:
+                return None
+            header = build_header(chat_data)
+            header["session_id"] = session_id
+        return header
+
+    def migrate_session(self, session_id: str) -> bool:
+        """Convert a legacy single-file session to the journaled format"""
+        with self.locks.lock(session_id):
+            return self._migrate_session(session_id)
+
+    def _migrate_session(self, session_id: str) -> bool:
+        if self._load_header(session_id) is not None:
+            return False
+        filepath = self.legacy_path(session_id)
+        if not os.path.exists(filepath):
+            return False
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                chat_data = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return False
+        chat_data["session_id"] = session_id
+        self._save_session(chat_data)
+        return True
+
+    def migrate_legacy_sessions(self) -> int:
+        """Convert every legacy session to the journaled format, returning the count"""
+        migrated = 0
+        legacy_ids = [sid for sid, suffix, _ in self._session_files(self.layout) if suffix == LEGACY_SUFFIX]
+        for session_id in legacy_ids:
+            if self.migrate_session(session_id):
+                migrated += 1
+        return migrated
+
+    def migrate_layout(self, layout: str) -> int:
+        """Move every session into another directory layout, returning the number moved
+
+        Safe to re-run after an interruption: files already in place are left
+        alone. Other processes must not use the directory while this runs.
+        """
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown chat storage layout: {layout}")
+        moved = set()
+        for source_layout in LAYOUTS:
+            if source_layout == layout:
+                continue
+            for session_id, suffix, path in list(self._session_files(source_layout)):
+                target_dir = self.session_dir(session_id, layout)
+                target = os.path.join(target_dir, f"{session_id}{suffix}")
+                if path == target:
+                    continue
+                with self.locks.lock(session_id):
+                    os.makedirs(target_dir, exist_ok=True)
+                    os.replace(path, target)
+                moved.add(session_id)
+        atomic_write(self._layout_path(), layout + "\n")
+        self.layout = layout
+        if layout == "flat":
+            self._remove_empty_shards()
+        return len(moved)
+
+    def _remove_empty_shards(self):
+        for directory in list(self._session_dirs("sharded")):
+            for path in (directory, os.path.dirname(directory)):
+                try:
+                    os.rmdir(path)
+                except OSError:
+                    pass
+
+    def list_sessions(self, agent_name: Optional[str] = None, limit: Optional[int] = None,
+                      before: Optional[str] = None, after: Optional[str] = None,
+                      cursor: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        def predicate(summary):
+            updated_at = summary.get("updated_at") or ""
+            return ((agent_name is None or summary.get("agent_name") == agent_name)
+                    and (before is None or updated_at < before)
+                    and (after is None or updated_at > after)
+                    and (cursor is None or session_sort_key(summary) < cursor))
+        sessions = self.manifest.recent(self._session_ids, self.load_summary, limit, predicate)
+        return [dict(summary) for summary in sessions]
+
+    def load_summary(self, session_id: str) -> Optional[Dict]:
+        if not self._has_live_files(session_id):
+            return self.archive.summary(session_id)
+        header = self._load_summary_header(session_id)
+        if header is None:
+            return None
+        summary = build_summary(header)
+        summary["session_id"] = session_id
+        return summary
+
+    def archive_sessions(self, cutoff: str, codec: str = "gzip", pack_size: int = 500) -> Dict:
+        """Compress sessions last updated before cutoff into the archive tier
+
+        Each session is added to a pack before its files are removed, so a crash
+        never loses it; a session written to while its pack was being built stays
+        in the hot tier. Returns counts, bytes before/after and elapsed time.
+        """
+        started = time.perf_counter()
+        stats = {"sessions": 0, "skipped": 0, "bytes_before": 0, "bytes_after": 0}
+        candidates = [s["session_id"] for s in self.list_sessions(before=cutoff)
+                      if self._has_live_files(s["session_id"])]
+
+        for start in range(0, len(candidates), pack_size):
+            batch = []
+            for session_id in candidates[start:start + pack_size]:
+                with self.locks.lock(session_id):
+                    version = self.session_version(session_id)
+                    chat_data = self.load_session(session_id)
+                    summary = self.load_summary(session_id)
+                if chat_data is None or summary is None:
+                    continue
+                chat_data["session_id"] = session_id
+                batch.append((session_id, version, chat_data, summary))
+            entries = self.archive.write_pack(((c, s) for _, _, c, s in batch), codec)
+
+            changed = []
+            for session_id, version, _, _ in batch:
+                with self.locks.lock(session_id):
+                    if self.session_version(session_id) != version:
+                        changed.append(session_id)
+                        continue
+                    size = 0
+                    for filepath in self._session_files_of(session_id):
+                        if os.path.exists(filepath):
+                            size += os.path.getsize(filepath)
+                            os.remove(filepath)
+                stats["sessions"] += 1
+                stats["bytes_before"] += size
+                stats["bytes_after"] += entries[session_id]["length"]
+            self.archive.remove(changed)
+            stats["skipped"] += len(changed)
+
+        stats["elapsed"] = time.perf_counter() - started
+        return stats
+
+    def load_session_state(self, session_id: str) -> Optional[Dict]:
+        filepath = self.state_path(session_id)
+        if not os.path.exists(filepath):
+            return None
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return None
+
+    def save_session_state(self, session_id: str, state: Optional[Dict]):
+        with self.locks.lock(session_id):
+            # Never leave a state file behind for a deleted or archived session
+            if not self._has_live_files(session_id):
+                return
+            filepath = self.state_path(session_id)
+            try:
+                if state is None:
+                    if os.path.exists(filepath):
+                        os.remove(filepath)
+                else:
+                    atomic_write(filepath, json.dumps(state, separators=(",", ":")))
+            except (IOError, OSError) as e:
+                print(f"Error saving session state: {e}")
+
+    def rebuild_manifest(self) -> int:
+        """Rebuild the session manifest from the session files, returning the count"""
+        return self.manifest.rebuild(self._session_ids(), self.load_summary)
+
+    def delete_session(self, session_id: str) -> bool:
+        with self.locks.lock(session_id):
+            return self._delete_session(session_id)
+
+    def _delete_session(self, session_id: str) -> bool:
+        deleted = False
+        for filepath in self._session_files_of(session_id):
+            if os.path.exists(filepath):
+                try:
+                    os.remove(filepath)
+                    deleted = True
+                except OSError:
+                    return False
+        if self.archive.contains(session_id):
+            self.archive.remove([session_id])
+            deleted = True
+        if deleted:
+            self.manifest.delete(session_id)
+            self.search_index.remove_session(session_id)
+        return deleted
+
+    def get_messages(self, session_id: str) -> List[Dict]:
+        chat_data = self.load_session(session_id)
+        if chat_data:
+            return chat_data.get("messages", [])
+        return []
+
+    def iter_messages(self, session_id: str, start: int = 0, before: Optional[str] = None,
+                      after: Optional[str] = None) -> Iterator[Tuple[int, Dict]]:
+        if self._load_header(session_id) is not None:
+            # Stream the journal so only the requested page is held in memory
+            messages = self._iter_journal(session_id)
+        else:
+            messages = iter(self.get_messages(session_id))
+        for index, message in enumerate(messages):
+            if index < start:
+                continue
+            timestamp = message.get("timestamp") or ""
+            if before is not None and timestamp >= before:
+                continue
+            if after is not None and timestamp <= after:
+                continue
+            yield index, message
+
+    def search(self, query: str, agent_name: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+        if self.search_index.is_empty() and self._session_ids():
+            # History written before the index existed
+            self.rebuild_search_index()
+        return self.search_index.search(query, agent_name, limit)
+
+    def rebuild_search_index(self) -> int:
+        """Rebuild the full-text search index from the session files, returning the count"""
+        def sessions():
+            for session_id in self._session_ids():
+                chat_data = self.load_session(session_id)
+                summary = self.load_summary(session_id)
+                if chat_data and summary:
+                    yield chat_data, summary
+        return self.search_index.rebuild(sessions())
+
+    def close(self):
+        self.search_index.close()
@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# Sessions hash onto a fixed set of locks so lock files never have to be cleaned up
+LOCK_STRIPES = 64
+LOCK_DIRNAME = "_locks"
+
+
+def atomic_write(path: str, data: Union[str, bytes], sync: bool = False):
+    """Replace path with data so readers see either the old or the new file, never a partial one"""
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    mode, encoding = ('wb', None) if isinstance(data, bytes) else ('w', 'utf-8')
+    try:
+        with open(tmp_path, mode, encoding=encoding) as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _lock_file(fd: int):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            # LK_LOCK gives up after ~10 seconds; keep waiting like flock does
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            time.sleep(0.01)
+
+
+def _unlock_file(fd: int):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class _Stripe:
+    """Reentrant lock held by one thread of one process at a time"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and self.path is not None:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    _lock_file(fd)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            except BaseException:
+                self._thread_lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fd, self._fd = self._fd, None
+            try:
+                _unlock_file(fd)
+            finally:
+                os.close(fd)
+        self._thread_lock.release()
+
+
+class FileLock:
+    """One exclusive, reentrant lock shared by threads and processes (thread-only without a path)"""
+
+    def __init__(self, path: Optional[str] = None):
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._stripe = _Stripe(path)
+
+    def __enter__(self):
+        self._stripe.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stripe.release()
+
+
+class SessionLocks:
+    """Per-session exclusive locks for read-modify-write of session data
+
+    Each lock combines a thread lock with, when lock_dir is given, an advisory
+    file lock (flock, or msvcrt on Windows), so writers in other threads and in
+    other processes sharing the storage directory are serialized. Locks are
+    reentrant within a thread.
+    """
+
+    def __init__(self, lock_dir: Optional[str] = None, stripes: int = LOCK_STRIPES):
+        if lock_dir is not None:
+            os.makedirs(lock_dir, exist_ok=True)
+        self._stripes = [
+            _Stripe(os.path.join(lock_dir, f"{i:02x}.lock") if lock_dir is not None else None)
+            for i in range(stripes)
+        ]
+
+    @contextmanager
+    def lock(self, session_id: str):
+        stripe = self._stripes[zlib.crc32(session_id.encode('utf-8')) % len(self._stripes)]
+        stripe.acquire()
+        try:
+            yield
+        finally:
+            stripe.release()
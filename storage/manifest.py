@@ -0,0 +1,209 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Callable, Iterable
+
+from .base import session_sort_key
+from .locking import FileLock
+
+
+# Rewrite the log once it holds this many more records than live sessions
+COMPACT_SLACK = 1000
+# Most recently written sessions whose summaries are checked against their files on load
+VERIFY_SAMPLE = 16
+
+
+class SessionManifest:
+    """Append-only log of session summaries, folded into memory for fast listing
+
+    Each line is either {"op": "put", ...summary} or {"op": "del", "session_id": ...}.
+    The in-memory view keeps sessions in write order, so the most recently
+    updated sessions are at the end and listing never has to parse session files.
+    New records written by other processes are picked up by reading only the
+    bytes appended since the last read. Appends and rewrites of the log take
+    lock_path, so a compaction in one process never drops another's records.
+    """
+
+    def __init__(self, path: str, lock_path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(lock_path)
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._records = 0
+        self._offset = 0
+        self._inode = None
+        self._loaded = False
+
+    def put(self, summary: Dict):
+        """Record the current summary of a session"""
+        self._append({"op": "put", **summary})
+
+    def delete(self, session_id: str):
+        """Record that a session was deleted"""
+        self._append({"op": "del", "session_id": session_id})
+
+    def _append(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                # One write call per record keeps concurrent appends line-atomic
+                with self._file_lock, open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except IOError as e:
+                print(f"Error updating session manifest: {e}")
+
+    def summaries(self, session_ids: Callable[[], Iterable[str]],
+                  load_summary: Callable[[str], Optional[Dict]]) -> List[Dict]:
+        """Current session summaries in write order (oldest first)
+
+        session_ids and load_summary describe the directory contents and are only
+        used to verify the manifest on first load and to rebuild it if they disagree.
+        """
+        with self._lock:
+            if not self._refresh():
+                self._verify(session_ids, load_summary)
+            elif self._needs_compaction():
+                self._compact()
+            return list(self._entries.values())
+
+    def recent(self, session_ids: Callable[[], Iterable[str]],
+               load_summary: Callable[[str], Optional[Dict]],
+               limit: Optional[int] = None,
+               predicate: Optional[Callable[[Dict], bool]] = None) -> List[Dict]:
+        """Summaries ordered by updated_at, most recent first"""
+        entries = self.summaries(session_ids, load_summary)
+        if predicate is not None:
+            entries = [e for e in entries if predicate(e)]
+        if limit is not None:
+            return heapq.nlargest(limit, entries, key=session_sort_key)
+        # Entries are already nearly in updated_at order, which timsort handles in linear time
+        entries.reverse()
+        entries.sort(key=session_sort_key, reverse=True)
+        return entries
+
+    def rebuild(self, session_ids: Iterable[str], load_summary: Callable[[str], Optional[Dict]]) -> int:
+        """Rebuild the manifest from the session files, returning the session count"""
+        with self._lock:
+            return self._rebuild(session_ids, load_summary)
+
+    def _needs_compaction(self) -> bool:
+        return self._records > 2 * len(self._entries) + COMPACT_SLACK
+
+    def _compact(self):
+        """Rewrite the log with one record per live session"""
+        with self._file_lock:
+            # Pick up whatever other processes appended before taking the lock
+            self._refresh()
+            self._write(list(self._entries.values()))
+
+    def _refresh(self) -> bool:
+        """Fold newly appended records into memory
+
+        Returns True if only an incremental read was needed, False if the
+        manifest was (re)loaded from scratch and should be verified.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self._reset()
+            return False
+
+        if self._loaded and stat.st_ino == self._inode and stat.st_size >= self._offset:
+            if stat.st_size > self._offset:
+                self._read_from(self._offset)
+            return True
+
+        # First load, or the file was compacted/replaced by another process
+        self._reset()
+        self._inode = stat.st_ino
+        self._read_from(0)
+        self._loaded = True
+        return False
+
+    def _reset(self):
+        self._entries = OrderedDict()
+        self._records = 0
+        self._offset = 0
+        self._inode = None
+        self._loaded = False
+
+    def _read_from(self, offset: int):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except IOError:
+            return
+
+        # Only consume complete lines; a record still being written is picked up next time
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+            self._apply(record)
+        self._offset = offset + end
+
+    def _apply(self, record: Dict):
+        session_id = record.get("session_id")
+        if not session_id:
+            return
+        self._records += 1
+        op = record.pop("op", "put")
+        if op == "del":
+            self._entries.pop(session_id, None)
+        else:
+            self._entries.pop(session_id, None)
+            self._entries[session_id] = record
+
+    def _verify(self, session_ids: Callable[[], Iterable[str]],
+                load_summary: Callable[[str], Optional[Dict]]):
+        """Rebuild from the directory if it disagrees with the manifest
+
+        Besides the set of IDs, only the summaries of the last VERIFY_SAMPLE
+        sessions written are compared with their files (a lost append is most
+        likely among them), so loading never reads every session file.
+        """
+        on_disk = set(session_ids())
+        recent = itertools.islice(reversed(self._entries), VERIFY_SAMPLE)
+        if on_disk != set(self._entries) or any(load_summary(session_id) != self._entries[session_id]
+                                                 for session_id in recent):
+            self._rebuild(on_disk, load_summary)
+        elif self._needs_compaction():
+            self._compact()
+
+    def _rebuild(self, session_ids: Iterable[str], load_summary: Callable[[str], Optional[Dict]]) -> int:
+        with self._file_lock:
+            summaries = []
+            for session_id in session_ids:
+                summary = load_summary(session_id)
+                if summary is not None:
+                    summaries.append(summary)
+            summaries.sort(key=session_sort_key)
+            self._write(summaries)
+        return len(summaries)
+
+    def _write(self, summaries: List[Dict]):
+        """Atomically replace the manifest with a compacted copy"""
+        tmp_path = f"{self.path}.tmp.{os.getpid()}"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for summary in summaries:
+                    f.write(json.dumps({"op": "put", **summary}, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+        except IOError as e:
+            print(f"Error rebuilding session manifest: {e}")
+            return
+        self._reset()
+        self._entries = OrderedDict((s["session_id"], dict(s)) for s in summaries)
+        self._records = len(summaries)
+        stat = os.stat(self.path)
+        self._inode = stat.st_ino
+        self._offset = stat.st_size
+        self._loaded = True
@@ -0,0 +1,150 @@
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Callable, Iterator
+
+from .search_index import tokenize
+
+
+SCAN_KINDS = ("list", "search", "grep")
+# Sessions handed to a worker at a time; small enough to stop soon after a --limit is hit
+CHUNK_SIZE = 64
+# Chunks queued per worker ahead of the one being merged
+PREFETCH = 4
+GREP_CONTEXT = 200
+
+# Backend opened once per worker process by _init_worker
+_worker_backend = None
+
+
+def _init_worker(backend_factory: Callable, args: tuple):
+    global _worker_backend
+    _worker_backend = backend_factory(*args)
+
+
+def _summary_matches(summary: Dict, params: Dict) -> bool:
+    updated_at = summary.get("updated_at") or ""
+    return ((params.get("agent_name") is None or summary.get("agent_name") == params["agent_name"])
+            and (params.get("before") is None or updated_at < params["before"])
+            and (params.get("after") is None or updated_at > params["after"]))
+
+
+def _words_match(tokens: List[str], text: str) -> bool:
+    """Every query token is a prefix of some word in text (same rule as the search index)"""
+    words = tokenize(text)
+    return all(any(word.startswith(token) for word in words) for token in tokens)
+
+
+def scan_chunk(backend, kind: str, params: Dict, session_ids: List[str]) -> List[Dict]:
+    """Scan a chunk of sessions, returning results in session order"""
+    results = []
+    if kind == "search":
+        tokens = list(dict.fromkeys(tokenize(params["query"])))
+    elif kind == "grep":
+        pattern = re.compile(params["pattern"], re.IGNORECASE if params.get("ignore_case") else 0)
+
+    for session_id in session_ids:
+        summary = backend.load_summary(session_id)
+        if summary is None or not _summary_matches(summary, params):
+            continue
+        if kind == "list":
+            results.append(summary)
+            continue
+        if kind == "search" and not tokens:
+            continue
+
+        messages = backend.iter_messages(session_id)
+        try:
+            for index, message in messages:
+                text = message.get("message") or ""
+                if kind == "search":
+                    if _words_match(tokens, text):
+                        # One result per session, showing its first matching message
+                        results.append(dict(summary, matching_message=text[:GREP_CONTEXT], message_index=index))
+                        break
+                else:
+                    match = pattern.search(text)
+                    if match:
+                        start = max(match.start() - GREP_CONTEXT // 2, 0)
+                        results.append({
+                            "session_id": session_id,
+                            "agent_name": summary.get("agent_name"),
+                            "message_index": index,
+                            "sender": message.get("sender"),
+                            "timestamp": message.get("timestamp"),
+                            "match": match.group(0),
+                            "context": text[start:start + GREP_CONTEXT],
+                        })
+        finally:
+            messages.close()
+    return results
+
+
+def _scan_chunk_in_worker(kind: str, params: Dict, session_ids: List[str]) -> List[Dict]:
+    return scan_chunk(_worker_backend, kind, params, session_ids)
+
+
+def parallel_scan(backend, backend_factory: Callable, factory_args: tuple, kind: str, params: Dict,
+                  jobs: int = 1, limit: Optional[int] = None,
+                  progress: Optional[Callable[[int, int, int], None]] = None) -> Iterator[Dict]:
+    """Scan every stored session, yielding results in a stable order
+
+    Sessions are split into chunks in session ID order and scanned by `jobs`
+    worker processes, each opening its own backend with
+    backend_factory(*factory_args). Results are yielded chunk by chunk in that
+    order, so the output doesn't depend on the number of workers. Scanning
+    stops as soon as `limit` results have been yielded. progress is called with
+    (sessions scanned, total sessions, results so far) after each chunk.
+    """
+    if kind not in SCAN_KINDS:
+        raise ValueError(f"Unknown scan kind: {kind}")
+    if kind == "grep":
+        # Fail fast on a bad pattern instead of in every worker
+        re.compile(params["pattern"])
+
+    session_ids = sorted(backend.session_ids())
+    chunks = [session_ids[i:i + CHUNK_SIZE] for i in range(0, len(session_ids), CHUNK_SIZE)]
+    total = len(session_ids)
+    scanned = 0
+    found = 0
+
+    def emit(chunk, results):
+        nonlocal scanned, found
+        scanned += len(chunk)
+        if limit is not None:
+            results = results[:limit - found]
+        found += len(results)
+        if progress is not None:
+            progress(scanned, total, found)
+        return results
+
+    if limit is not None and limit <= 0:
+        return
+    if jobs <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield from emit(chunk, scan_chunk(backend, kind, params, chunk))
+            if limit is not None and found >= limit:
+                return
+        return
+
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                   initargs=(backend_factory, factory_args))
+    try:
+        pending = deque()
+        remaining = iter(chunks)
+        for chunk in remaining:
+            pending.append((chunk, executor.submit(_scan_chunk_in_worker, kind, params, chunk)))
+            if len(pending) >= jobs * PREFETCH:
+                break
+        while pending:
+            chunk, future = pending.popleft()
+            results = future.result()
+            # Keep the workers busy while this chunk's results are consumed
+            next_chunk = next(remaining, None)
+            if next_chunk is not None:
+                pending.append((next_chunk, executor.submit(_scan_chunk_in_worker, kind, params, next_chunk)))
+            yield from emit(chunk, results)
+            if limit is not None and found >= limit:
+                return
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,324 @@
+import math
+import re
+import sqlite3
+import threading
+from typing import List, Dict, Optional, Iterable, Iterator
+
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Most dictionary terms a query token expands to (the token itself always counts)
+MAX_PREFIX_EXPANSIONS = 64
+# Candidate messages intersected with the other query terms per batch
+CANDIDATE_PAGE = 5000
+SNIPPET_LENGTH = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_sessions (
+    session_id TEXT PRIMARY KEY,
+    agent_name TEXT,
+    model TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS search_docs (
+    doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    snippet TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_search_docs_session ON search_docs(session_id, seq);
+CREATE TABLE IF NOT EXISTS search_terms (
+    term TEXT PRIMARY KEY,
+    df INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS search_postings (
+    term TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_search_postings_doc ON search_postings(doc_id);
+"""
+
+SESSION_FIELDS = ("session_id", "agent_name", "model", "created_at", "updated_at", "message_count")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens"""
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    """Smallest string greater than every string starting with prefix"""
+    return prefix + "\U0010ffff"
+
+
+def _batches(items: List, size: int = CANDIDATE_PAGE) -> Iterator[List]:
+    """items in slices small enough to bind as statement parameters"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SearchIndex:
+    """Persistent inverted index (token -> message postings) stored in SQLite
+
+    Every message is one document. Queries AND all terms within a message,
+    prefix-match each term against the term dictionary, and rank sessions by
+    the TF-IDF score of their best matching message, with exact term matches
+    weighted above prefix matches.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def is_empty(self) -> bool:
+        """Whether no session has been indexed yet"""
+        return self._connect().execute("SELECT 1 FROM search_sessions LIMIT 1").fetchone() is None
+
+    def _upsert_session(self, conn: sqlite3.Connection, summary: Dict):
+        conn.execute(
+            "INSERT OR REPLACE INTO search_sessions (session_id, agent_name, model, created_at, updated_at,"
+            " message_count) VALUES (?, ?, ?, ?, ?, ?)",
+            tuple(summary.get(k) for k in SESSION_FIELDS[:-1]) + (summary.get("message_count", 0),)
+        )
+
+    def _add_doc(self, conn: sqlite3.Connection, session_id: str, seq: int, text: str):
+        tokens = tokenize(text)
+        cursor = conn.execute(
+            "INSERT INTO search_docs (session_id, seq, snippet) VALUES (?, ?, ?)",
+            (session_id, seq, (text or "")[:SNIPPET_LENGTH])
+        )
+        doc_id = cursor.lastrowid
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        conn.executemany(
+            "INSERT INTO search_postings (term, doc_id, tf) VALUES (?, ?, ?)",
+            [(term, doc_id, tf) for term, tf in counts.items()]
+        )
+        conn.executemany(
+            "INSERT INTO search_terms (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+            [(term,) for term in counts]
+        )
+        conn.execute(
+            "INSERT INTO search_meta (key, value) VALUES ('doc_count', 1)"
+            " ON CONFLICT(key) DO UPDATE SET value = value + 1"
+        )
+
+    def _remove_session(self, conn: sqlite3.Connection, session_id: str):
+        rows = conn.execute(
+            "SELECT p.term, COUNT(*) AS n FROM search_postings p"
+            " JOIN search_docs d ON d.doc_id = p.doc_id WHERE d.session_id = ? GROUP BY p.term",
+            (session_id,)
+        ).fetchall()
+        conn.executemany("UPDATE search_terms SET df = df - ? WHERE term = ?", [(r["n"], r["term"]) for r in rows])
+        conn.execute("DELETE FROM search_terms WHERE df <= 0")
+        conn.execute(
+            "DELETE FROM search_postings WHERE doc_id IN (SELECT doc_id FROM search_docs WHERE session_id = ?)",
+            (session_id,)
+        )
+        removed = conn.execute("DELETE FROM search_docs WHERE session_id = ?", (session_id,)).rowcount
+        conn.execute("UPDATE search_meta SET value = value - ? WHERE key = 'doc_count'", (removed,))
+        conn.execute("DELETE FROM search_sessions WHERE session_id = ?", (session_id,))
+
+    def _run(self, func, *args, conn: Optional[sqlite3.Connection] = None):
+        """Run func(conn, *args) in a write transaction
+
+        Given a connection to the same database, func runs in the caller's open
+        transaction instead, and errors are left for the caller to roll back.
+        """
+        if conn is not None:
+            func(conn, *args)
+            return
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            func(conn, *args)
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            # BEGIN itself may have failed (database is locked), leaving nothing to roll back
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"Error updating search index: {e}")
+
+    def add_message(self, summary: Dict, seq: int, text: str):
+        """Index one new message and refresh its session's summary"""
+        self.add_messages(summary, seq, [text])
+
+    def add_messages(self, summary: Dict, first_seq: int, texts: List[str],
+                     conn: Optional[sqlite3.Connection] = None):
+        """Index consecutive new messages in one transaction and refresh the session's summary"""
+        def apply(conn):
+            self._upsert_session(conn, summary)
+            for offset, text in enumerate(texts):
+                self._add_doc(conn, summary["session_id"], first_seq + offset, text)
+        self._run(apply, conn=conn)
+
+    def index_session(self, chat_data: Dict, summary: Dict, conn: Optional[sqlite3.Connection] = None):
+        """(Re)index a whole session, replacing anything indexed for it"""
+        def apply(conn):
+            self._remove_session(conn, summary["session_id"])
+            self._upsert_session(conn, summary)
+            for seq, message in enumerate(chat_data.get("messages", [])):
+                self._add_doc(conn, summary["session_id"], seq, message.get("message", ""))
+        self._run(apply, conn=conn)
+
+    def update_session(self, summary: Dict):
+        """Refresh a session's summary without touching its postings"""
+        self._run(self._upsert_session, summary)
+
+    def remove_session(self, session_id: str, conn: Optional[sqlite3.Connection] = None):
+        """Drop a session and all of its postings"""
+        self._run(self._remove_session, session_id, conn=conn)
+
+    def clear(self):
+        """Remove everything from the index"""
+        def apply(conn):
+            for table in ("search_postings", "search_terms", "search_docs", "search_sessions", "search_meta"):
+                conn.execute(f"DELETE FROM {table}")
+        self._run(apply)
+
+    def rebuild(self, sessions: Iterable[tuple]) -> int:
+        """Rebuild the index from (chat_data, summary) pairs, returning the session count"""
+        self.clear()
+        count = 0
+        for chat_data, summary in sessions:
+            self.index_session(chat_data, summary)
+            count += 1
+        return count
+
+    def _expand(self, conn: sqlite3.Connection, token: str) -> List[sqlite3.Row]:
+        """token itself if indexed, then the most frequent longer terms starting with it
+
+        Only MAX_PREFIX_EXPANSIONS terms are kept, so a very common prefix skips
+        its rarest completions; an exact match is never dropped.
+        """
+        exact = conn.execute("SELECT term, df FROM search_terms WHERE term = ?", (token,)).fetchall()
+        return exact + conn.execute(
+            "SELECT term, df FROM search_terms WHERE term > ? AND term < ? ORDER BY df DESC LIMIT ?",
+            (token, _prefix_upper_bound(token), MAX_PREFIX_EXPANSIONS - len(exact))
+        ).fetchall()
+
+    @staticmethod
+    def _score(postings: Iterable[sqlite3.Row], weights: Dict[str, float]) -> Dict[int, float]:
+        """Best weighted score of each posting's message"""
+        scores: Dict[int, float] = {}
+        for posting in postings:
+            score = (1 + math.log(posting["tf"])) * weights[posting["term"]]
+            doc_id = posting["doc_id"]
+            scores[doc_id] = max(scores.get(doc_id, 0.0), score)
+        return scores
+
+    def _candidate_pages(self, conn: sqlite3.Connection, weights: Dict[str, float]) -> Iterator[Dict[int, float]]:
+        """Scores of every message containing one of weights' terms, CANDIDATE_PAGE messages at a time
+
+        A message matching several terms may show up in more than one page.
+        """
+        placeholders = ",".join("?" * len(weights))
+        cursor = conn.execute(f"SELECT doc_id, term, tf FROM search_postings WHERE term IN ({placeholders})",
+                              list(weights))
+        while True:
+            rows = cursor.fetchmany(CANDIDATE_PAGE)
+            if not rows:
+                return
+            yield self._score(rows, weights)
+
+    def search(self, query: str, agent_name: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+        """Sessions whose messages contain every query term (as a word prefix), best first
+
+        Every matching message is considered; only the prefix expansion of each
+        term is capped (see _expand).
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM search_meta WHERE key = 'doc_count'").fetchone()
+        doc_count = max(row["value"] if row else 0, 1)
+
+        expansions = []
+        for token in tokens:
+            terms = self._expand(conn, token)
+            if not terms:
+                return []
+            weights = {}
+            for term in terms:
+                idf = math.log(1 + doc_count / term["df"])
+                weights[term["term"]] = idf if term["term"] == token else idf * 0.5
+            expansions.append((sum(t["df"] for t in terms), weights))
+
+        # Start from the rarest term so the candidate set is as small as possible, and
+        # intersect its messages with the other terms a page at a time so every
+        # match is found while each statement stays bounded
+        expansions.sort(key=lambda e: e[0])
+        scores: Dict[int, float] = {}
+        for page in self._candidate_pages(conn, expansions[0][1]):
+            for _, weights in expansions[1:]:
+                if not page:
+                    break
+                sql = (f"SELECT doc_id, term, tf FROM search_postings WHERE term IN ({','.join('?' * len(weights))})"
+                       f" AND doc_id IN ({','.join('?' * len(page))})")
+                term_scores = self._score(conn.execute(sql, list(weights) + list(page)), weights)
+                page = {doc_id: page[doc_id] + s for doc_id, s in term_scores.items()}
+            for doc_id, score in page.items():
+                scores[doc_id] = max(scores.get(doc_id, 0.0), score)
+
+        if not scores:
+            return []
+
+        # Rank sessions by their best matching message
+        best: Dict[str, tuple] = {}
+        for batch in _batches(list(scores)):
+            placeholders = ",".join("?" * len(batch))
+            for doc in conn.execute(
+                f"SELECT doc_id, session_id, seq, snippet FROM search_docs WHERE doc_id IN ({placeholders})", batch
+            ):
+                score = scores[doc["doc_id"]]
+                current = best.get(doc["session_id"])
+                if current is None or score > current[0] or (score == current[0] and doc["seq"] < current[1]):
+                    best[doc["session_id"]] = (score, doc["seq"], doc["snippet"])
+
+        results = []
+        for batch in _batches(list(best)):
+            sql = f"SELECT * FROM search_sessions WHERE session_id IN ({','.join('?' * len(batch))})"
+            params = list(batch)
+            if agent_name is not None:
+                sql += " AND agent_name = ?"
+                params.append(agent_name)
+            for session in conn.execute(sql, params):
+                score, seq, snippet = best[session["session_id"]]
+                result = {k: session[k] for k in SESSION_FIELDS}
+                result["matching_message"] = snippet or ""
+                result["score"] = round(score, 4)
+                results.append(result)
+
+        results.sort(key=lambda r: (r["score"], r["updated_at"] or ""), reverse=True)
+        if limit is not None:
+            results = results[:limit]
+        return results
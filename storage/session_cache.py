@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Hashable
+
+
+# Rough per-message and per-session overhead used to estimate cached bytes
+MESSAGE_OVERHEAD = 96
+SESSION_OVERHEAD = 512
+
+
+def estimate_size(chat_data: Dict) -> int:
+    """Approximate memory held by a loaded session"""
+    size = SESSION_OVERHEAD
+    for message in chat_data.get("messages", []):
+        size += MESSAGE_OVERHEAD + len(message.get("message") or "")
+    return size
+
+
+class SessionCache:
+    """Bounded LRU cache of loaded sessions, validated by a backend version token
+
+    Each entry remembers the version the backend reported when it was loaded
+    (file mtime/size for the file backend), so sessions changed by another
+    process or by chat_manager.py are reloaded instead of served stale.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, session_id: str, version: Hashable) -> Optional[Dict]:
+        """Cached session if its version still matches, else None"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    self._remove(session_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return _copy(entry[1])
+
+    def put(self, session_id: str, version: Hashable, chat_data: Dict):
+        """Cache a freshly loaded session"""
+        if not self.enabled:
+            return
+        size = estimate_size(chat_data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(session_id)
+            self._entries[session_id] = (version, _copy(chat_data), size)
+            self._bytes += size
+            self._evict()
+
+    def append(self, session_id: str, expected_version: Hashable, new_version: Hashable,
+               messages: List[Dict], updated_at: str):
+        """Apply messages we just wrote to the cached copy, if it was current before the write"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return
+            if entry[0] != expected_version:
+                self._remove(session_id)
+                return
+            version, chat_data, size = entry
+            chat_data["messages"].extend(dict(message) for message in messages)
+            chat_data["updated_at"] = updated_at
+            added = sum(MESSAGE_OVERHEAD + len(message.get("message") or "") for message in messages)
+            self._entries[session_id] = (new_version, chat_data, size + added)
+            self._entries.move_to_end(session_id)
+            self._bytes += added
+            self._evict()
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._remove(session_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _evict(self):
+        """Drop least recently used entries until both limits are met"""
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, session_id: str):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+
+def _copy(chat_data: Dict) -> Dict:
+    """Copy deep enough that callers can't change the cached messages list"""
+    copied = dict(chat_data)
+    copied["messages"] = list(chat_data.get("messages", []))
+    return copied
@@ -0,0 +1,362 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import List, Dict, Optional, Iterator, Tuple, Hashable
+
+from .base import StorageBackend, build_header, build_summary
+from .locking import SessionLocks, LOCK_DIRNAME
+from .search_index import SearchIndex
+
+
+# Columns stored natively; any other header or message keys go into the "extra" JSON column
+SESSION_COLUMNS = ("session_id", "agent_name", "model", "created_at", "updated_at",
+                   "message_count", "first_message")
+MESSAGE_COLUMNS = ("sender", "message", "timestamp")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    agent_name TEXT,
+    model TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    first_message TEXT NOT NULL DEFAULT '',
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at);
+CREATE INDEX IF NOT EXISTS idx_sessions_agent_updated_at ON sessions(agent_name, updated_at);
+
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    sender TEXT,
+    message TEXT,
+    timestamp TEXT,
+    extra TEXT,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS session_state (
+    session_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+
+def _split_extra(data: Dict, columns) -> Optional[str]:
+    """Serialize keys that don't have their own column"""
+    extra = {k: v for k, v in data.items() if k not in columns}
+    return json.dumps(extra, ensure_ascii=False) if extra else None
+
+
+def _rollback(conn: sqlite3.Connection):
+    """Roll back the open transaction, if BEGIN got as far as opening one"""
+    if conn.in_transaction:
+        conn.execute("ROLLBACK")
+
+
+def _merge_extra(data: Dict, extra: Optional[str]) -> Dict:
+    """Merge the "extra" JSON column back into a row dict"""
+    if extra:
+        try:
+            data.update(json.loads(extra))
+        except json.JSONDecodeError:
+            pass
+    return data
+
+
+class SQLiteBackend(StorageBackend):
+    """Stores sessions and messages in a single SQLite database in WAL mode"""
+
+    def __init__(self, db_path: str = os.path.join("chat_history", "chat_history.db")):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        # The full-text index lives in the same database, in its own tables, and is
+        # updated in the same transaction as the rows it indexes
+        self.search_index = SearchIndex(db_path)
+        # SQLite serializes the writes themselves; these locks let ChatStorage make
+        # version check + append + version check atomic for its session cache
+        self.locks = SessionLocks(os.path.join(directory or ".", LOCK_DIRNAME))
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        self.search_index.close()
+
+    def describe_location(self, session_id: str) -> str:
+        return f"{self.db_path} (session {session_id})"
+
+    def _row_to_header(self, row: sqlite3.Row) -> Dict:
+        header = {k: row[k] for k in SESSION_COLUMNS}
+        return _merge_extra(header, row["extra"])
+
+    def _row_to_message(self, row: sqlite3.Row) -> Dict:
+        message = {k: row[k] for k in MESSAGE_COLUMNS}
+        return _merge_extra(message, row["extra"])
+
+    def _write_session(self, conn: sqlite3.Connection, chat_data: Dict):
+        """Replace a session and its messages inside the caller's transaction"""
+        header = build_header(chat_data)
+        session_id = header["session_id"]
+        conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, agent_name, model, created_at, updated_at,"
+            " message_count, first_message, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            tuple(header.get(k) for k in SESSION_COLUMNS) + (_split_extra(header, SESSION_COLUMNS),)
+        )
+        conn.executemany(
+            "INSERT INTO messages (session_id, seq, sender, message, timestamp, extra)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (session_id, seq) + tuple(m.get(k) for k in MESSAGE_COLUMNS) + (_split_extra(m, MESSAGE_COLUMNS),)
+                for seq, m in enumerate(chat_data.get("messages", []))
+            ]
+        )
+
+    def session_lock(self, session_id: str):
+        return self.locks.lock(session_id)
+
+    def create_session(self, chat_data: Dict):
+        self.save_session(chat_data)
+
+    def save_session(self, chat_data: Dict):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._write_session(conn, chat_data)
+            self.search_index.index_session(chat_data, build_summary(build_header(chat_data)), conn=conn)
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            _rollback(conn)
+            print(f"Error saving chat session: {e}")
+
+    def append_message(self, session_id: str, record: Dict) -> bool:
+        return self.append_messages(session_id, [record])
+
+    def append_messages(self, session_id: str, records: List[Dict], sync: bool = False) -> bool:
+        with self.locks.lock(session_id):
+            return self._append_messages(session_id, records, sync)
+
+    def _append_messages(self, session_id: str, records: List[Dict], sync: bool) -> bool:
+        conn = self._connect()
+        if sync:
+            # WAL with synchronous=NORMAL doesn't fsync on commit; FULL does
+            conn.execute("PRAGMA synchronous=FULL")
+        try:
+            # IMMEDIATE takes the write lock up front so concurrent appends get distinct seqs
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return False
+            if not records:
+                conn.execute("ROLLBACK")
+                return True
+            first_seq = row["message_count"]
+            conn.executemany(
+                "INSERT INTO messages (session_id, seq, sender, message, timestamp, extra)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (session_id, first_seq + offset) + tuple(record.get(k) for k in MESSAGE_COLUMNS)
+                    + (_split_extra(record, MESSAGE_COLUMNS),)
+                    for offset, record in enumerate(records)
+                ]
+            )
+            first_message = row["first_message"] or records[0].get("message", "")[:100]
+            conn.execute(
+                "UPDATE sessions SET updated_at = ?, message_count = message_count + ?, first_message = ?"
+                " WHERE session_id = ?",
+                (records[-1]["timestamp"], len(records), first_message, session_id)
+            )
+            summary = build_summary(self._row_to_header(row))
+            summary["updated_at"] = records[-1]["timestamp"]
+            summary["message_count"] = first_seq + len(records)
+            summary["first_message"] = first_message
+            self.search_index.add_messages(summary, first_seq, [record.get("message", "") for record in records],
+                                           conn=conn)
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            _rollback(conn)
+            print(f"Error saving chat message: {e}")
+            return False
+        finally:
+            if sync:
+                conn.execute("PRAGMA synchronous=NORMAL")
+        return True
+
+    def load_session(self, session_id: str) -> Optional[Dict]:
+        chat_data = self.load_header(session_id)
+        if chat_data is None:
+            return None
+        chat_data["messages"] = self.get_messages(session_id)
+        return chat_data
+
+    def session_version(self, session_id: str) -> Optional[Hashable]:
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT updated_at, message_count, extra FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return (row["updated_at"], row["message_count"], row["extra"])
+
+    def load_header(self, session_id: str) -> Optional[Dict]:
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        header = self._row_to_header(row)
+        del header["message_count"]
+        del header["first_message"]
+        return header
+
+    def load_summary(self, session_id: str) -> Optional[Dict]:
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        return build_summary(self._row_to_header(row))
+
+    def list_sessions(self, agent_name: Optional[str] = None, limit: Optional[int] = None,
+                      before: Optional[str] = None, after: Optional[str] = None,
+                      cursor: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        conn = self._connect()
+        conditions = []
+        params = []
+        if agent_name is not None:
+            conditions.append("agent_name = ?")
+            params.append(agent_name)
+        if before is not None:
+            conditions.append("updated_at < ?")
+            params.append(before)
+        if after is not None:
+            conditions.append("updated_at > ?")
+            params.append(after)
+        if cursor is not None:
+            conditions.append("(updated_at < ? OR (updated_at = ? AND session_id < ?))")
+            params.extend([cursor[0], cursor[0], cursor[1]])
+        sql = "SELECT * FROM sessions"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY updated_at DESC, session_id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [build_summary(self._row_to_header(row)) for row in conn.execute(sql, params)]
+
+    def delete_session(self, session_id: str) -> bool:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM session_state WHERE session_id = ?", (session_id,))
+            deleted = conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount > 0
+            if deleted:
+                self.search_index.remove_session(session_id, conn=conn)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            _rollback(conn)
+            return False
+        return deleted
+
+    def get_messages(self, session_id: str) -> List[Dict]:
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT * FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+        )
+        return [self._row_to_message(row) for row in rows]
+
+    def iter_messages(self, session_id: str, start: int = 0, before: Optional[str] = None,
+                      after: Optional[str] = None) -> Iterator[Tuple[int, Dict]]:
+        conn = self._connect()
+        sql = "SELECT * FROM messages WHERE session_id = ? AND seq >= ?"
+        params = [session_id, start]
+        if before is not None:
+            sql += " AND timestamp < ?"
+            params.append(before)
+        if after is not None:
+            sql += " AND timestamp > ?"
+            params.append(after)
+        sql += " ORDER BY seq"
+        # Rows are fetched lazily, so callers that stop early never read the rest
+        for row in conn.execute(sql, params):
+            yield row["seq"], self._row_to_message(row)
+
+    def message_count(self, session_id: str) -> Optional[int]:
+        row = self._connect().execute(
+            "SELECT message_count FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row["message_count"] if row is not None else None
+
+    def read_messages(self, session_id: str, start: int = 0, end: Optional[int] = None) -> List[Dict]:
+        sql = "SELECT * FROM messages WHERE session_id = ? AND seq >= ?"
+        params = [session_id, start]
+        if end is not None:
+            sql += " AND seq < ?"
+            params.append(end)
+        sql += " ORDER BY seq"
+        return [self._row_to_message(row) for row in self._connect().execute(sql, params)]
+
+    def load_session_state(self, session_id: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            "SELECT data FROM session_state WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row["data"])
+        except json.JSONDecodeError:
+            return None
+
+    def save_session_state(self, session_id: str, state: Optional[Dict]):
+        conn = self._connect()
+        try:
+            if state is None:
+                conn.execute("DELETE FROM session_state WHERE session_id = ?", (session_id,))
+            else:
+                # Only for sessions that still exist
+                conn.execute(
+                    "INSERT OR REPLACE INTO session_state (session_id, data)"
+                    " SELECT session_id, ? FROM sessions WHERE session_id = ?",
+                    (json.dumps(state, separators=(",", ":")), session_id)
+                )
+        except sqlite3.Error as e:
+            print(f"Error saving session state: {e}")
+
+    def search(self, query: str, agent_name: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+        conn = self._connect()
+        if self.search_index.is_empty() and conn.execute("SELECT 1 FROM sessions LIMIT 1").fetchone():
+            # History written before the index existed
+            self.rebuild_search_index()
+        return self.search_index.search(query, agent_name, limit)
+
+    def rebuild_search_index(self) -> int:
+        """Rebuild the full-text search index from the stored sessions, returning the count"""
+        def sessions():
+            conn = self._connect()
+            for row in conn.execute("SELECT * FROM sessions").fetchall():
+                chat_data = self.load_session(row["session_id"])
+                if chat_data:
+                    yield chat_data, build_summary(self._row_to_header(row))
+        return self.search_index.rebuild(sessions())
@@ -0,0 +1,151 @@
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Callable, Optional
+
+
+FSYNC_POLICIES = ("none", "interval", "always")
+
+
+class FlushError(Exception):
+    """Raised for a session whose queued messages could not be written"""
+    pass
+
+
+class WriteBehindWriter:
+    """Background writer that batches message appends per session
+
+    add() only queues a record. A daemon thread flushes the queue every
+    flush_interval seconds, or as soon as max_pending records are waiting,
+    calling flush_fn(session_id, records) once per session with everything
+    queued for it. At most one interval (or max_pending records) of writes
+    can be lost if the process crashes. If the backend falls behind and
+    max_queued records pile up, add() writes the queue itself before
+    returning, so callers are slowed down instead of memory growing.
+    A batch that fails to write is counted in stats() and its error is raised,
+    as FlushError, by the session's next add() or flush().
+    """
+
+    def __init__(self, flush_fn: Callable[[str, List[Dict]], bool],
+                 flush_interval: float = 0.05, max_pending: int = 256, max_queued: int = 4096):
+        self.flush_fn = flush_fn
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_queued = max(max_queued, max_pending)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Held while writing, so batches of one session are always written in order
+        self._flush_lock = threading.Lock()
+        self._pending: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._pending_count = 0
+        self._closed = False
+        self.flushes = 0
+        self.inline_flushes = 0
+        self.records_written = 0
+        self.failed_flushes = 0
+        self.records_failed = 0
+        # Error of the last failed batch of each session, until it is reported
+        self._errors: Dict[str, Exception] = {}
+        self._thread = threading.Thread(target=self._run, name="chat-storage-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, session_id: str, record: Dict):
+        """Queue a record for session_id, writing the queue first if it is full"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Write-behind writer is closed")
+            self._raise_error(session_id)
+            self._pending.setdefault(session_id, []).append(record)
+            self._pending_count += 1
+            full = self._pending_count >= self.max_queued
+            if full:
+                self.inline_flushes += 1
+            elif self._pending_count >= self.max_pending:
+                self._wakeup.notify()
+        if full:
+            self._flush()
+
+    def pending(self, session_id: Optional[str] = None) -> int:
+        """Number of queued records, for one session or in total"""
+        with self._lock:
+            if session_id is None:
+                return self._pending_count
+            return len(self._pending.get(session_id, ()))
+
+    def flush(self, session_id: Optional[str] = None, check: bool = True):
+        """Synchronously write queued records (for one session, or all of them)
+
+        With check, raises FlushError if a batch of the session (or of any
+        session) failed to write since the last check.
+        """
+        self._flush(session_id)
+        if check:
+            with self._lock:
+                if session_id is not None:
+                    self._raise_error(session_id)
+                elif self._errors:
+                    self._raise_error(next(iter(self._errors)))
+
+    def _raise_error(self, session_id: str):
+        """Raise and forget session_id's write error, if any (lock held)"""
+        error = self._errors.pop(session_id, None)
+        if error is not None:
+            raise FlushError(f"Messages of session {session_id} could not be written: {error}") from error
+
+    def _flush(self, session_id: Optional[str] = None):
+        with self._flush_lock:
+            with self._lock:
+                if session_id is None:
+                    batches = list(self._pending.items())
+                    self._pending.clear()
+                    self._pending_count = 0
+                else:
+                    records = self._pending.pop(session_id, None)
+                    batches = [(session_id, records)] if records else []
+                    self._pending_count -= len(records or ())
+            self._write(batches)
+
+    def _write(self, batches):
+        for session_id, records in batches:
+            try:
+                if self.flush_fn(session_id, records):
+                    self.records_written += len(records)
+            except Exception as e:
+                print(f"Error flushing chat messages: {e}")
+                with self._lock:
+                    self.failed_flushes += 1
+                    self.records_failed += len(records)
+                    self._errors[session_id] = e
+            self.flushes += 1
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._closed and self._pending_count < self.max_pending:
+                    self._wakeup.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self._flush()
+
+    def close(self):
+        """Flush everything and stop the background thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join()
+        self._flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "pending": self._pending_count,
+                "flushes": self.flushes,
+                "records_written": self.records_written,
+                "failed_flushes": self.failed_flushes,
+                "records_failed": self.records_failed,
+                "flush_interval": self.flush_interval,
+                "max_pending": self.max_pending,
+                "max_queued": self.max_queued,
+                "inline_flushes": self.inline_flushes,
+            }